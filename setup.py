@@ -11,7 +11,8 @@ setup(
     },
     install_requires=['urwid'],
     extras_require={
-        'Notifications': ['gobject']
+        'Notifications': ['gobject'],
+        'FastCodecs': ['orjson', 'msgpack']
     },
     license='',      # TODO
     url='',          # TODO
@@ -0,0 +1,752 @@
+"""
+    Benchmarks for smscli-client
+
+    usage: python -m smscliclient.benchmark <benchmark> [options]
+    run with -h to list them
+"""
+
+import gc
+import os
+import sys
+import time
+import random
+import asyncio
+import datetime
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+import tracemalloc
+import statistics
+import configparser
+
+import urwid
+
+from smscliclient.smscliclient import ViewMessage, MessageWidget, ConnectionHandler, JSONHelper, JSONCodec, MessageStore, \
+    LogView, MainWindow, MainLoop, NullBackend, MAX_MESSAGE_LEN, state
+from smscliclient.fakeserver import FakeServer
+from smscliclient.server import ProtocolServer
+from smscliclient.daemon import Daemon
+
+BENCHMARKS = {}
+
+
+def benchmark(name, help_text, arguments=()):
+    """
+        register a benchmark, func takes the parsed args
+        arguments are (flag, type, default, help) tuples
+    """
+
+    def register(func):
+        BENCHMARKS[name] = (func, help_text, arguments)
+        return func
+
+    return register
+
+
+def synthetic_message_fields(count, num_contacts=500):
+    """
+        yields fields for count fake messages, every string is built
+        fresh like it would be coming off the wire
+    """
+
+    for i in range(count):
+        yield (
+            '{:02d}:{:02d}:{:02d}'.format(i // 3600 % 24, i // 60 % 60, i % 60),
+            'synthetic message number {}'.format(i),
+            str(i % num_contacts),
+            'Contact {}'.format(i % num_contacts),
+            ''.join(['IN', 'BOX']) if i % 3 else ''.join(['OUT', 'BOX'])
+        )
+
+
+def measure_bytes(build, count):
+    """ bytes allocated per item by build(count), which must return the items so they stay alive """
+
+    gc.collect()
+    tracemalloc.start()
+    items = build(count)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del items
+    gc.collect()
+
+    return allocated / count
+
+
+@benchmark('memory', 'bytes per message, widget per message vs compact ViewMessage records', [
+    ('--count', int, 1000000, 'number of messages')
+])
+def bench_memory(args):
+    def build_widgets(count):
+        # what every message used to cost: the data plus a full urwid widget
+        return [MessageWidget(ViewMessage(*fields)) for fields in synthetic_message_fields(count)]
+
+    def build_records(count):
+        return [ViewMessage(*fields) for fields in synthetic_message_fields(count)]
+
+    print('messages: {}'.format(args.count))
+    widget_bytes = measure_bytes(build_widgets, args.count)
+    print('  widget per message: {:8.1f} bytes/message'.format(widget_bytes))
+    record_bytes = measure_bytes(build_records, args.count)
+    print('  ViewMessage record: {:8.1f} bytes/message'.format(record_bytes))
+    print('  ratio:              {:8.1f}x'.format(widget_bytes / record_bytes))
+
+
+def time_per_call(func, arg, count):
+    """ seconds per func(arg), best of three runs """
+
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(count):
+            func(arg)
+        elapsed = (time.perf_counter() - start) / count
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+@benchmark('codecs', 'encode/decode of message and contact dicts with every available codec', [
+    ('--count', int, 20000, 'number of message encode/decodes'),
+    ('--contacts', int, 5000, 'number of contacts in the contact dump')
+])
+def bench_codecs(args):
+    message_dict = JSONHelper.view_message_to_dict(ViewMessage('12:00:00', 'synthetic message body ' * 4, '42', 'Me',
+                                                               ViewMessage.TYPE_OUTGOING), '7')
+    contacts = FakeServer(args.contacts).contacts
+
+    print('messages: {}, contact dump: {} contacts'.format(args.count, args.contacts))
+    print('  {:10} {:>12} {:>12} {:>8} {:>12} {:>12} {:>10}'.format(
+        'codec', 'msg enc us', 'msg dec us', 'bytes', 'dump enc ms', 'dump dec ms', 'bytes'))
+
+    for codec_class in JSONHelper.get_codecs():
+        codec = codec_class()
+        message_data = codec.encode(message_dict)
+        contacts_data = codec.encode(contacts)
+        dump_count = max(1, args.count // args.contacts)
+
+        print('  {:10} {:12.2f} {:12.2f} {:8d} {:12.2f} {:12.2f} {:10d}'.format(
+            codec.NAME,
+            time_per_call(codec.encode, message_dict, args.count) * 1e6,
+            time_per_call(codec.decode, message_data, args.count) * 1e6,
+            len(message_data),
+            time_per_call(codec.encode, contacts, dump_count) * 1e3,
+            time_per_call(lambda data: list(codec.iter_items(data)), contacts_data, dump_count) * 1e3,
+            len(contacts_data)
+        ))
+
+
+async def open_client(port, features):
+    """
+        a bare ConnectionHandler connected to a local server, handshake done,
+        enough of the client to read frames without the ui
+    """
+
+    connection_handler = ConnectionHandler()
+    await connection_handler.connect('127.0.0.1', port)
+
+    await connection_handler.read_server()
+    await connection_handler.write_frame({JSONHelper.JSON_HELLO_KEY: {
+        JSONHelper.JSON_VERSION_KEY: ConnectionHandler.PROTOCOL_VERSION,
+        JSONHelper.JSON_FEATURES_KEY: features
+    }})
+    connection_handler.compression = ConnectionHandler.FEATURE_ZLIB in features
+
+    return connection_handler
+
+
+@benchmark('compression', 'initial contact dump size and transfer time over a throttled link, with and without zlib', [
+    ('--contacts', int, 5000, 'number of contacts in the dump'),
+    ('--bandwidth', float, 1000000, 'link speed in bytes a second')
+])
+def bench_compression(args):
+    async def transfer(features):
+        server = FakeServer(args.contacts, bandwidth=args.bandwidth)
+        port = await server.start()
+
+        # handshake, contact list and the (empty) delta after it
+        start = time.perf_counter()
+        connection_handler = await open_client(port, features)
+        await connection_handler.read_server()
+        await connection_handler.read_server()
+        elapsed = time.perf_counter() - start
+
+        connection_handler.writer.close()
+        await server.stop()
+
+        return server.bytes_sent, elapsed
+
+    print('contacts: {}, link: {:.0f} bytes/s'.format(args.contacts, args.bandwidth))
+    for label, features in (('uncompressed', []), ('zlib', [ConnectionHandler.FEATURE_ZLIB])):
+        size, elapsed = asyncio.run(transfer(features))
+        print('  {:12} {:10d} bytes on the wire {:8.3f} s'.format(label, size, elapsed))
+
+
+@benchmark('ingest', 'messages/second from server dicts into the store, one at a time vs batched', [
+    ('--count', int, 100000, 'number of messages'),
+    ('--contacts', int, 500, 'number of contacts they are spread over')
+])
+def bench_ingest(args):
+    server = FakeServer(args.contacts)
+    start_date = int(time.time() * 1000) - args.count * 1000
+    view_message_dicts = [server.make_message(str(i % args.contacts + 1), 'synthetic message number {}'.format(i),
+                                              date=start_date + i * 1000)
+                          for i in range(args.count)]
+    remote_times = [view_message_dict[JSONHelper.JSON_MESSAGE_TIME_KEY] for view_message_dict in view_message_dicts]
+
+    def parse_every_time():
+        for remote_time in remote_times:
+            datetime.datetime.strptime(remote_time, JSONHelper.REMOTE_TIME_FORMAT_STR).strftime(ViewMessage.TIME_FORMAT_STR)
+
+    def parse_cached():
+        for remote_time in remote_times:
+            JSONHelper.format_time(remote_time)
+
+    def one_at_a_time():
+        for view_message_dict in view_message_dicts:
+            state.message_store.add_messages([JSONHelper.dict_to_view_message(view_message_dict)])
+            state.message_store.update_sync_marks({
+                view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]: view_message_dict[JSONHelper.JSON_MESSAGE_DATE_KEY]
+            })
+
+    def batched():
+        state.message_store.add_messages(JSONHelper.dicts_to_view_messages(view_message_dicts))
+        state.message_store.update_sync_marks({
+            view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]: view_message_dict[JSONHelper.JSON_MESSAGE_DATE_KEY]
+            for view_message_dict in view_message_dicts
+        })
+
+    print('messages: {}, contacts: {}'.format(args.count, args.contacts))
+
+    for label, run in (('time parse, every message', parse_every_time), ('time parse, cached', parse_cached),
+                       ('ingest, one at a time', one_at_a_time), ('ingest, batched', batched)):
+        with tempfile.TemporaryDirectory() as store_dir:
+            state.message_store.open(os.path.join(store_dir, MessageStore.STORE_FILE_NAME))
+            JSONHelper.time_cache.clear()
+
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+
+            state.message_store.close()
+
+        print('  {:28} {:12.0f} messages/s'.format(label, args.count / elapsed))
+
+
+@benchmark('frames', 'frames/second received from a local server, readexactly per frame vs the buffered FrameProtocol', [
+    ('--count', int, 200000, 'number of message frames'),
+    ('--chunk', int, 65536, 'bytes the server writes at a time')
+])
+def bench_frames(args):
+    server = FakeServer()
+    frame_data = b''.join(ProtocolServer.encode_frame(server.make_message(str(i % 10 + 1), 'synthetic message number {}'.format(i)))
+                          for i in range(args.count))
+
+    async def serve_frames(reader, writer):
+        for i in range(0, len(frame_data), args.chunk):
+            writer.write(frame_data[i:i + args.chunk])
+            await writer.drain()
+        writer.close()
+
+    async def read_exactly(port, decode):
+        # what read_server used to do, two awaits and two copies a frame
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        codec = JSONCodec()
+
+        for _ in range(args.count):
+            length = int.from_bytes(await reader.readexactly(ConnectionHandler.LEN_BYTE_SIZE),
+                                    ConnectionHandler.LEN_STRUCT_INT_TYPE)
+            payload = await reader.readexactly(length & ConnectionHandler.FRAME_LENGTH_MASK)
+            if decode:
+                codec.decode(payload)
+
+        writer.close()
+
+    async def frame_protocol(port, decode):
+        connection_handler = ConnectionHandler()
+        await connection_handler.connect('127.0.0.1', port)
+        codec = JSONCodec()
+
+        received = [0]
+
+        def on_frame(payload):
+            received[0] += 1
+            if decode:
+                codec.decode(payload)
+
+        # like the read loop, whatever came in before there was anyone to hand it to first
+        while connection_handler.protocol.frames:
+            on_frame(connection_handler.protocol.frames.popleft())
+
+        connection_handler.protocol.on_frame = on_frame
+        await connection_handler.protocol.lost
+
+        assert received[0] == args.count, received[0]
+
+    async def run(read, decode):
+        tcp_server = await asyncio.start_server(serve_frames, '127.0.0.1', 0)
+        port = tcp_server.sockets[0].getsockname()[1]
+
+        start = time.perf_counter()
+        await read(port, decode)
+        elapsed = time.perf_counter() - start
+
+        tcp_server.close()
+        await tcp_server.wait_closed()
+        return elapsed
+
+    print('frames: {}, {} bytes, written {} bytes at a time'.format(args.count, len(frame_data), args.chunk))
+    for label, read in (('readexactly', read_exactly), ('FrameProtocol', frame_protocol)):
+        for decode in (False, True):
+            elapsed = asyncio.run(run(read, decode))
+            print('  {:14} {:10} {:12.0f} frames/s'.format(label, 'decoded' if decode else 'framing', args.count / elapsed))
+
+
+@benchmark('search', '/search latency over a large store, the fts5 index vs scanning message bodies', [
+    ('--count', int, 1000000, 'number of messages in the store'),
+    ('--contacts', int, 500, 'number of contacts they are spread over')
+])
+def bench_search(args):
+    # made up words, some much more common than others like in real messages
+    rng = random.Random(0)
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'do', 'gu']
+    vocabulary = sorted({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(5000)})
+    rng.shuffle(vocabulary)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    common, rare = vocabulary[0], vocabulary[-1]
+    queries = (
+        ('common word', [common]),
+        ('rare word', [rare]),
+        ('two words', [common, vocabulary[1]]),
+        ('prefix', [common[:3] + MessageStore.SEARCH_PREFIX]),
+        ('no match', ['pizza'])
+    )
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        state.message_store.open(os.path.join(store_dir, MessageStore.STORE_FILE_NAME))
+
+        start = time.perf_counter()
+        batch_size = 10000
+        for batch_start in range(0, args.count, batch_size):
+            state.message_store.add_messages([
+                ViewMessage('12:00:00', ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(3, 15))),
+                            str(i % args.contacts), 'Contact', ViewMessage.TYPE_INCOMING, i)
+                for i in range(batch_start, min(batch_start + batch_size, args.count))
+            ])
+        fill_time = time.perf_counter() - start
+
+        print('messages: {}, filled in {:.1f} s, fts5: {}'.format(args.count, fill_time, state.message_store.search_indexed))
+        for search_indexed, label, count in ((True, 'fts5', 20), (False, 'scan', 1)):
+            if search_indexed and not state.message_store.search_indexed:
+                continue
+
+            state.message_store.search_indexed = search_indexed
+            for query_label, terms in queries:
+                results = len(state.message_store.search(terms))
+                print('  {:5} {:12} {:>22} {:4d} results {:10.2f} ms'.format(
+                    label, query_label, ' '.join(terms), results, time_per_call(state.message_store.search, terms, count) * 1000))
+
+        state.message_store.close()
+
+
+@benchmark('lookup', 'contact lookups by /msg and tab completion, the ContactIndex vs scanning every contact', [
+    ('--contacts', int, 100000, 'number of contacts')
+])
+def bench_lookup(args):
+    contacts = FakeServer(args.contacts).contacts
+    middle = str(args.contacts // 2)
+
+    start = time.perf_counter()
+    contact_views = [JSONHelper.dict_to_contact_view(contact_view_dict, history_end_id=0) for contact_view_dict in contacts.values()]
+    for contact_view in contact_views:
+        state.contact_views[contact_view.view_id] = contact_view
+    views_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    state.contact_index.add_contacts(contact_views)
+    index_time = time.perf_counter() - start
+
+    def scan(name):
+        # what /msg did before the index
+        folded_name = name.casefold()
+        return [contact_view.view_id for contact_view in state.contact_views.values()
+                if contact_view.display_name.casefold() == folded_name]
+
+    name = contacts[middle][JSONHelper.JSON_CONTACT_DISPLAY_KEY]
+    number = contacts[middle][JSONHelper.JSON_CONTACT_PHONE_KEY]
+    formatted_number = '+1 ({}) {}-{}'.format(number[:3], number[3:6], number[6:])
+
+    for query in (name, name.upper(), formatted_number):
+        assert state.contact_index.find(query) == scan(name) == [middle], query
+
+    # (label, func, query, calls timed)
+    queries = (
+        ('find, name', state.contact_index.find, name, 1000),
+        ('find, name in other case', state.contact_index.find, name.upper(), 1000),
+        ('find, formatted number', state.contact_index.find, formatted_number, 1000),
+        ('find, no such contact', state.contact_index.find, 'nobody at all', 1000),
+        ('complete, name prefix', state.contact_index.complete, name[:-1], 1000),
+        ('scan, name', scan, name, 3)
+    )
+
+    print('contacts: {}, views made in {:.0f} ms, indexed in {:.1f} ms'.format(args.contacts, views_time * 1000, index_time * 1000))
+    for label, func, query, count in queries:
+        print('  {:26} {:>20} {:10.2f} us'.format(label, repr(query), time_per_call(func, query, count) * 1e6))
+
+
+@benchmark('snapshot', 'contacts at startup from the snapshot vs decoding the contact dump the server sends', [
+    ('--contacts', int, 5000, 'number of contacts')
+])
+def bench_snapshot(args):
+    contacts = FakeServer(args.contacts).contacts
+    contacts_data = JSONHelper.get_json_codec().encode(contacts)
+
+    def from_dump():
+        codec = JSONHelper.get_json_codec()
+        history_end_id = state.message_store.get_last_message_id()
+        return [JSONHelper.dict_to_contact_view(contact_view_dict, history_end_id=history_end_id)
+                for _, contact_view_dict in codec.iter_items(contacts_data)]
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        state.message_store.open(MessageStore.MEMORY_PATH)
+        state.log_view = LogView([])
+        state.contact_snapshot.set_directory(snapshot_dir)
+
+        contact_views = from_dump()
+        start = time.perf_counter()
+        state.contact_snapshot.save('', '1', contact_views)
+        save_time = time.perf_counter() - start
+        size = os.path.getsize(state.contact_snapshot.get_path(''))
+
+        print('contacts: {}, dump {} bytes, snapshot {} bytes'.format(args.contacts, len(contacts_data), size))
+        print('  {:34} {:10.2f} ms'.format('snapshot save', save_time * 1000))
+        print('  {:34} {:10.2f} ms'.format('snapshot load, records only',
+                                           time_per_call(state.contact_snapshot.load, state.contact_snapshot.get_path(''), 10) * 1000))
+
+        # restoring redraws at the end, it needs a main loop to schedule that on
+        loop = asyncio.new_event_loop()
+        state.main_loop = MainLoop(MainWindow(state.log_view), screen=HeadlessScreen((120, 40), lambda: None),
+                                   event_loop=urwid.AsyncioEventLoop(loop=loop))
+        print('  {:34} {:10.2f} ms'.format('snapshot restore, contact views', time_per_call(
+            lambda _: loop.run_until_complete(state.contact_snapshot.restore(state.contact_snapshot.load_all())), None, 3) * 1000))
+        loop.close()
+
+        print('  {:34} {:10.2f} ms'.format('contact dump decode, contact views', time_per_call(
+            lambda _: from_dump(), None, 3) * 1000))
+
+        state.message_store.close()
+
+
+@benchmark('attach', 'a new frontend and a caught up one attaching to a daemon that already has the history', [
+    ('--contacts', int, 1000, 'number of contacts'),
+    ('--messages', int, 20000, 'number of messages in the history')
+])
+def bench_attach(args):
+    async def attach(socket_path, since):
+        """ what a frontend does, returns the messages it was sent """
+
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        await ProtocolServer.read_frame(reader)
+
+        writer.write(ProtocolServer.encode_frame({JSONHelper.JSON_HELLO_KEY: {
+            JSONHelper.JSON_VERSION_KEY: ConnectionHandler.PROTOCOL_VERSION,
+            JSONHelper.JSON_FEATURES_KEY: [ConnectionHandler.FEATURE_DELTA],
+            JSONHelper.JSON_SINCE_KEY: since
+        }}))
+
+        frame = await ProtocolServer.read_frame(reader)
+        if JSONHelper.JSON_DELTA_KEY not in frame:
+            frame = await ProtocolServer.read_frame(reader)
+        writer.close()
+
+        return frame[JSONHelper.JSON_DELTA_KEY][JSONHelper.JSON_MESSAGES_KEY]
+
+    async def run(store_dir):
+        server = FakeServer(args.contacts, num_messages=args.messages)
+        port = await server.start()
+
+        daemon = Daemon('127.0.0.1', port, os.path.join(store_dir, Daemon.STORE_FILE_NAME), 30, 90)
+        socket_path = os.path.join(store_dir, 'daemon.sock')
+        daemon_task = asyncio.get_running_loop().create_task(daemon.run(socket_path))
+
+        # warm, the daemon has synced the whole history from the phone
+        while daemon.store.get_last_message_id() < args.messages:
+            await asyncio.sleep(0.05)
+
+        start = time.perf_counter()
+        messages = await attach(socket_path, {})
+        fresh_time = time.perf_counter() - start
+        assert len(messages) == args.messages, len(messages)
+
+        since = {}
+        for message in messages:
+            contact_id = message[JSONHelper.JSON_MESSAGE_ID_KEY]
+            since[contact_id] = max(since.get(contact_id, 0), message[JSONHelper.JSON_MESSAGE_DATE_KEY])
+
+        start = time.perf_counter()
+        missed = await attach(socket_path, since)
+        caught_up_time = time.perf_counter() - start
+        assert not missed, len(missed)
+
+        daemon_task.cancel()
+        await asyncio.gather(daemon_task, return_exceptions=True)
+        await server.stop()
+
+        return fresh_time, caught_up_time
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        fresh_time, caught_up_time = asyncio.run(run(store_dir))
+
+    print('contacts: {}, history: {} messages'.format(args.contacts, args.messages))
+    print('  {:24} {:10.1f} ms'.format('attach, new frontend', fresh_time * 1000))
+    print('  {:24} {:10.1f} ms'.format('attach, caught up', caught_up_time * 1000))
+
+
+class HeadlessScreen(urwid.BaseScreen):
+    """ A screen of a fixed size that draws nowhere, so the whole client can run without a terminal """
+
+    def __init__(self, size, on_draw):
+        super().__init__()
+        self.size = size
+        self.on_draw = on_draw
+        self.canvas = None      # the last one drawn, kept like raw_display keeps what's on the terminal
+
+    def get_cols_rows(self):
+        return self.size
+
+    def draw_screen(self, size, canvas):
+        self.canvas = canvas
+        self.on_draw()
+
+    def get_input_descriptors(self):
+        return []
+
+    def get_available_raw_input(self):
+        return []
+
+    def get_input(self, raw_keys=False):
+        return []
+
+    def hook_event_loop(self, event_loop, callback):
+        pass
+
+    def unhook_event_loop(self, event_loop):
+        pass
+
+    def set_input_timeouts(self, *args, **kwargs):
+        pass
+
+    def clear(self):
+        pass
+
+
+def start_fake_server(*options):
+    """ a fake server in its own process so it doesn't count towards the client's memory, returns (process, port) """
+
+    process = subprocess.Popen([sys.executable, '-m', 'smscliclient.fakeserver', '--port', '0', *options],
+                               stdout=subprocess.PIPE, text=True)
+    port = int(process.stdout.readline().rsplit(':', 1)[1])
+
+    return process, port
+
+
+def run_client(store_path, port, until, on_draw=lambda: None, size=(120, 40)):
+    """
+        the whole client, store, views and main loop, on a headless screen
+        connects to port and runs until the coroutine until() returns, returns its result
+    """
+
+    state.__init__()
+    state.config_handler.config = configparser.ConfigParser()       # default settings
+    state.notifier.configure(NullBackend.NAME, 0, 0)
+    state.message_store.open(store_path)
+
+    state.log_view = LogView([])
+    state.main_window = MainWindow(state.log_view)
+    state.event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(state.event_loop)
+
+    state.main_loop = MainLoop(state.main_window, screen=HeadlessScreen(size, on_draw),
+                               event_loop=urwid.AsyncioEventLoop(loop=state.event_loop))
+    state.main_loop.start()
+
+    async def connect_and_run():
+        state.connections.start_connection('127.0.0.1', port)
+        result = await until()
+
+        state.connections.disconnect()
+        return result
+
+    try:
+        return state.event_loop.run_until_complete(connect_and_run())
+    finally:
+        # let the connection's tasks see they were cancelled
+        tasks = asyncio.all_tasks(state.event_loop)
+        for task in tasks:
+            task.cancel()
+        state.event_loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+        state.main_loop.stop()
+        state.event_loop.close()
+        state.message_store.close()
+
+
+@benchmark('e2e', 'the whole client against a fake server process: connect-to-ready, ingest, render latency, peak RSS', [
+    ('--contacts', int, 5000, 'number of contacts'),
+    ('--messages', int, 50000, 'number of messages in the history synced on connect'),
+    ('--live', int, 200, 'number of live messages to time rendering of'),
+    ('--interval', float, 0.02, 'seconds between bursts of live messages'),
+    ('--burst', int, 1, 'number of live messages in a burst')
+])
+def bench_e2e(args):
+    async def until_ready():
+        start = time.perf_counter()
+        connection_handler = state.connections.get()
+        while connection_handler.connect_task is None:
+            await asyncio.sleep(0)
+        await connection_handler.connect_task
+
+        return time.perf_counter() - start
+
+    def connect_to_ready(store_path, num_messages):
+        server, port = start_fake_server('--contacts', str(args.contacts), '--messages', str(num_messages), '--no-bursts')
+        try:
+            return run_client(store_path, port, until_ready)
+        finally:
+            server.terminate()
+            server.wait()
+
+    # every live message is newer than everything before it, a draw shows the ones past the newest seen so far
+    latencies = []
+    newest_drawn = [0]
+
+    def record_drawn():
+        now = time.time()
+        newest = newest_drawn[0]
+
+        # not just the shown views, there are only so many of those
+        for view in state.contact_views.values():
+            for view_message in reversed(view.listwalker):
+                if view_message.timestamp <= newest_drawn[0]:
+                    break
+                latencies.append((now - view_message.timestamp) * 1000)
+                newest = max(newest, view_message.timestamp)
+
+        newest_drawn[0] = newest
+
+    async def until_live_drawn():
+        await until_ready()
+        newest_drawn[0] = time.time()
+        del latencies[:]
+
+        deadline = time.monotonic() + 10 + args.live / args.burst * args.interval * 2
+        while len(latencies) < args.live and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    print('contacts: {}, history: {} messages, live: {} messages, {} every {} s'.format(
+        args.contacts, args.messages, args.live, args.burst, args.interval))
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        contacts_only = connect_to_ready(os.path.join(store_dir, 'contacts.db'), 0)
+        print('  connect-to-ready, contacts only:    {:10.1f} ms'.format(contacts_only * 1000))
+
+        store_path = os.path.join(store_dir, MessageStore.STORE_FILE_NAME)
+        with_history = connect_to_ready(store_path, args.messages)
+        print('  connect-to-ready, with history:     {:10.1f} ms'.format(with_history * 1000))
+        print('  ingest:                             {:10.0f} messages/s'.format(
+            args.messages / max(with_history - contacts_only, 1e-9)))
+
+        # same contacts and a synced store, so only the live messages come through
+        server, port = start_fake_server('--contacts', str(args.contacts), '--count', str(args.live),
+                                         '--interval', str(args.interval), '--burst', str(args.burst))
+        try:
+            run_client(store_path, port, until_live_drawn, record_drawn)
+        finally:
+            server.terminate()
+            server.wait()
+
+    if latencies:
+        latencies.sort()
+        print('  render latency, {:4d} messages:     {:10.1f} ms median {:8.1f} ms p99 {:8.1f} ms max'.format(
+            len(latencies),
+            statistics.median(latencies),
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            latencies[-1]
+        ))
+    else:
+        print('  render latency:                     no live messages drawn')
+
+    # ru_maxrss is in kilobytes on linux
+    print('  peak RSS:                           {:10.1f} MB ({:.1f} MB at start)'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, start_rss / 1024))
+
+
+@benchmark('delivery', 'time for the chunks of a long message to be acked by a fake server, as the screen shows them', [
+    ('--chunks', int, 40, 'number of chunks the message is split into')
+])
+def bench_delivery(args):
+    done_states = (ViewMessage.STATE_ACKED, ViewMessage.STATE_FAILED)
+
+    async def until_delivered():
+        connection_handler = state.connections.get()
+        while connection_handler.connect_task is None:
+            await asyncio.sleep(0)
+        await connection_handler.connect_task
+
+        contact_view = next(iter(state.contact_views.values()))
+        state.main_window.add_new_view(contact_view)
+        state.main_window.switch_view(contact_view.view_id)
+
+        start = time.perf_counter()
+        connection_handler.send_message('x' * MAX_MESSAGE_LEN * args.chunks)
+        while len(contact_view.listwalker) < args.chunks or \
+                any(view_message.delivery_state not in done_states for view_message in contact_view.listwalker):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+        # what's drawn next has to show the chunks' states, not canvases cached from before they changed
+        draws = state.render_scheduler.redraw_count
+        state.render_scheduler.mark_dirty()
+        while state.render_scheduler.redraw_count == draws:
+            await asyncio.sleep(0.01)
+
+        text = b'\n'.join(state.main_loop.screen.canvas.text).decode()
+        for delivery_state in (ViewMessage.STATE_QUEUED, ViewMessage.STATE_SENT):
+            assert '[' + delivery_state + ']' not in text, text
+        assert '[' + ViewMessage.STATE_ACKED + ']' in text, text
+
+        return elapsed
+
+    server, port = start_fake_server('--no-bursts')
+    try:
+        with tempfile.TemporaryDirectory() as store_dir:
+            elapsed = run_client(os.path.join(store_dir, MessageStore.STORE_FILE_NAME), port, until_delivered)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print('chunks: {}, {} characters'.format(args.chunks, MAX_MESSAGE_LEN * args.chunks))
+    print('  all acked: {:10.1f} ms {:10.1f} chunks/s'.format(elapsed * 1000, args.chunks / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m smscliclient.benchmark')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    for name, (func, help_text, arguments) in BENCHMARKS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flag, arg_type, default, arg_help in arguments:
+            subparser.add_argument(flag, type=arg_type, default=default, help=arg_help)
+        subparser.set_defaults(func=func)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+    Headless smscli-client
+
+    holds the connection to the phone and keeps every message in its own
+    store. Frontends (the urwid ui, scripts) attach over a unix socket and
+    are served the same protocol the phone speaks, so attaching is a delta
+    resync against a local process rather than a contact dump over wifi
+
+    usage: smscli-client --daemon <ip> <port>
+"""
+
+import os
+import json
+import time
+import zlib
+import asyncio
+
+from smscliclient.smscliclient import ConnectionHandler, JSONHelper, JSONCodec, MsgpackCodec, MessageStore
+from smscliclient.server import ProtocolServer
+
+
+class Daemon(ProtocolServer):
+    """
+        A client to the phone and a server to frontends
+
+        contacts and messages from the phone are stored, dated and
+        pushed to every attached frontend, sms from a frontend go to
+        the phone and are shown on the other frontends
+    """
+
+    STORE_FILE_NAME = 'daemon.db'
+    SOCKET_MODE = 0o600
+    REMOTE_TIME_FORMAT_STR = '%I:%M:%S %p'
+
+    UPSTREAM_CONTACTS_VERSION_KEY = 'upstreamContactsVersion'
+
+    MESSAGE_LISTENING = 'Listening for frontends on {path}'
+    MESSAGE_CONNECTED = 'Connected to {ip} on {port}, {contacts} contacts'
+    MESSAGE_LOST = 'Lost connection to {ip}, reconnecting in {delay:.1f}s'
+    ERROR_RUNNING = 'A daemon is already listening on {path}'
+    ERROR_STORE = 'Failed to open {path}, messages will not be kept'
+
+    def __init__(self, ip_address, port, store_path, heartbeat_interval, liveness_timeout):
+        # compressing for a local socket would only cost cpu
+        super().__init__([feature for feature in ConnectionHandler.get_client_features()
+                          if feature != ConnectionHandler.FEATURE_ZLIB])
+
+        self.ip_address = ip_address
+        self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.liveness_timeout = liveness_timeout
+
+        self.store = MessageStore()
+        if self.store.open(store_path) is not None:
+            print(Daemon.ERROR_STORE.format(path=store_path))
+
+        self.contacts = self.store.get_contact_dicts()
+        self.contacts_version = Daemon.hash_contacts(self.contacts)
+
+        # connection to the phone
+        self.reader = None
+        self.writer = None
+        self.server_features = set()
+        self.compression = False
+        self.codec = JSONCodec()
+        self.last_received = 0
+
+        self.next_uid = 0
+        self.pending_acks = {}      # uid sent to the phone -> (frontend writer, the frontend's uid, contact id, our date)
+
+    @staticmethod
+    def hash_contacts(contacts):
+        """ frontends compare this to skip the contact list, it has to survive restarts so it's a hash """
+        return format(zlib.crc32(json.dumps(contacts, sort_keys=True).encode()), 'x')
+
+    @staticmethod
+    def view_message_to_dict(view_message):
+        """ back to a message as the phone sends it, dated so frontends can resync from it """
+
+        return {
+            JSONHelper.JSON_MESSAGE_TIME_KEY: time.strftime(Daemon.REMOTE_TIME_FORMAT_STR, time.localtime(view_message.timestamp)),
+            JSONHelper.JSON_MESSAGE_BODY_KEY: view_message.body,
+            JSONHelper.JSON_MESSAGE_ID_KEY: view_message.related_view_id,
+            JSONHelper.JSON_MESSAGE_TYPE_KEY: view_message.message_type,
+            JSONHelper.JSON_MESSAGE_DATE_KEY: round(view_message.timestamp * 1000)
+        }
+
+    def get_contacts(self):
+        return self.contacts
+
+    def get_contacts_version(self):
+        return self.contacts_version
+
+    def messages_since(self, since):
+        return [Daemon.view_message_to_dict(view_message) for view_message in self.store.load_messages_since(since)]
+
+    async def run(self, socket_path):
+        """ serve frontends on socket_path while staying connected to the phone """
+
+        if os.path.exists(socket_path):
+            try:
+                _, writer = await asyncio.open_unix_connection(socket_path)
+                writer.close()
+                print(Daemon.ERROR_RUNNING.format(path=socket_path))
+                return
+            except ConnectionError:
+                os.unlink(socket_path)      # left over from a daemon that didn't exit cleanly
+
+        await self.start_unix(socket_path)
+        os.chmod(socket_path, Daemon.SOCKET_MODE)
+        print(Daemon.MESSAGE_LISTENING.format(path=socket_path))
+
+        try:
+            await self.run_upstream()
+        finally:
+            await self.stop()
+            os.unlink(socket_path)
+            self.store.close()
+
+    async def run_upstream(self):
+        """ stay connected to the phone, backing off like the ui does """
+
+        attempt = 0
+
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.ip_address, self.port),
+                    ConnectionHandler.TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError):
+                attempt += 1
+            else:
+                attempt = 0
+                ConnectionHandler.set_keepalive(self.writer)
+                heartbeat_task = None
+
+                try:
+                    await self.sync_upstream()
+                    print(Daemon.MESSAGE_CONNECTED.format(ip=self.ip_address, port=self.port, contacts=len(self.contacts)))
+
+                    if ConnectionHandler.FEATURE_HEARTBEAT in self.server_features:
+                        heartbeat_task = asyncio.get_running_loop().create_task(self.heartbeat_upstream())
+
+                    while True:
+                        await self.handle_upstream_frame(await self.read_upstream())
+                except (asyncio.IncompleteReadError, ConnectionError, zlib.error):
+                    pass
+                finally:
+                    if heartbeat_task is not None:
+                        heartbeat_task.cancel()
+                    self.writer.close()
+                    self.writer = None
+                    await self.fail_pending_acks()
+
+            delay = ConnectionHandler.get_reconnect_delay(max(attempt, 1))
+            print(Daemon.MESSAGE_LOST.format(ip=self.ip_address, delay=delay))
+            await asyncio.sleep(delay)
+
+    async def read_upstream(self):
+        frame = await ProtocolServer.read_frame(self.reader, self.codec)
+        self.last_received = time.monotonic()
+        return frame
+
+    async def write_upstream(self, obj):
+        self.writer.write(ProtocolServer.encode_frame(obj, self.compression, self.codec))
+        await self.writer.drain()
+
+    async def sync_upstream(self):
+        """ handshake with the phone and take in whatever changed, or everything from an old phone """
+
+        self.server_features = set()
+        self.compression = False
+        self.codec = JSONCodec()
+
+        frame = await self.read_upstream()
+        if JSONHelper.JSON_HANDSHAKE_KEY not in frame:
+            self.set_contacts(frame, full=True)
+            return
+
+        self.server_features = set(frame[JSONHelper.JSON_HANDSHAKE_KEY].get(JSONHelper.JSON_FEATURES_KEY, []))
+
+        hello = {
+            JSONHelper.JSON_VERSION_KEY: ConnectionHandler.PROTOCOL_VERSION,
+            JSONHelper.JSON_FEATURES_KEY: ConnectionHandler.get_client_features()
+        }
+        if ConnectionHandler.FEATURE_DELTA in self.server_features:
+            hello[JSONHelper.JSON_SINCE_KEY] = self.store.get_sync_marks()
+            if self.contacts:
+                hello[JSONHelper.JSON_CONTACTS_VERSION_KEY] = self.store.get_sync_value(Daemon.UPSTREAM_CONTACTS_VERSION_KEY)
+        await self.write_upstream({JSONHelper.JSON_HELLO_KEY: hello})
+
+        self.compression = ConnectionHandler.FEATURE_ZLIB in self.server_features
+        if MsgpackCodec.NAME in self.server_features and MsgpackCodec.is_available():
+            self.codec = MsgpackCodec()
+
+        frame = await self.read_upstream()
+        if JSONHelper.JSON_DELTA_KEY not in frame:
+            self.set_contacts(frame, full=True)
+            frame = await self.read_upstream()
+
+        self.apply_delta(frame[JSONHelper.JSON_DELTA_KEY])
+
+    def set_contacts(self, contacts, full=False):
+        """ take in a full contact list or changed contacts, frontends get the changes """
+
+        if not contacts and not full:
+            return
+
+        if full:
+            changed = {contact_id: contact for contact_id, contact in contacts.items() if self.contacts.get(contact_id) != contact}
+            self.contacts = dict(contacts)
+        else:
+            changed = contacts
+            self.contacts.update(contacts)
+
+        self.store.add_contact_dicts(changed.values())
+        self.contacts_version = Daemon.hash_contacts(self.contacts)
+
+        if changed:
+            self.broadcast({JSONHelper.JSON_DELTA_KEY: {
+                JSONHelper.JSON_CONTACTS_VERSION_KEY: self.contacts_version,
+                JSONHelper.JSON_CONTACTS_KEY: changed
+            }})
+
+    def apply_delta(self, delta):
+        self.set_contacts(delta.get(JSONHelper.JSON_CONTACTS_KEY, {}))
+
+        if JSONHelper.JSON_CONTACTS_VERSION_KEY in delta:
+            self.store.set_sync_value(Daemon.UPSTREAM_CONTACTS_VERSION_KEY, delta[JSONHelper.JSON_CONTACTS_VERSION_KEY])
+
+        messages = delta.get(JSONHelper.JSON_MESSAGES_KEY, [])
+        if messages:
+            self.receive_messages(messages)
+
+    async def handle_upstream_frame(self, frame):
+        if JSONHelper.JSON_ACK_KEY in frame:
+            writer, uid, contact_id, date = self.pending_acks.pop(frame[JSONHelper.JSON_ACK_KEY], (None,) * 4)
+            ok = frame.get(JSONHelper.JSON_ACK_OK_KEY, True)
+
+            # we already have the sms, don't take it again on the next resync
+            if ok and JSONHelper.JSON_MESSAGE_DATE_KEY in frame and contact_id is not None:
+                self.store.update_sync_marks({contact_id: frame[JSONHelper.JSON_MESSAGE_DATE_KEY]})
+
+            if writer in self.writers:
+                await self.ack(writer, uid, ok, date)
+        elif JSONHelper.JSON_PING_KEY in frame:
+            await self.write_upstream({JSONHelper.JSON_PONG_KEY: frame[JSONHelper.JSON_PING_KEY]})
+        elif JSONHelper.JSON_DELTA_KEY in frame:
+            self.apply_delta(frame[JSONHelper.JSON_DELTA_KEY])
+        elif JSONHelper.JSON_PONG_KEY not in frame:
+            self.receive_messages([frame])
+
+    def receive_messages(self, message_dicts, skip_writer=None):
+        """ store messages and push them to the frontends, all but skip_writer """
+
+        now = round(time.time() * 1000)
+        sync_marks = {}
+
+        for message_dict in message_dicts:
+            if JSONHelper.JSON_MESSAGE_DATE_KEY in message_dict:
+                contact_id = message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]
+                sync_marks[contact_id] = max(sync_marks.get(contact_id, 0), message_dict[JSONHelper.JSON_MESSAGE_DATE_KEY])
+            else:
+                message_dict[JSONHelper.JSON_MESSAGE_DATE_KEY] = now        # old phones don't date messages
+
+        self.store.add_messages(JSONHelper.dicts_to_view_messages(message_dicts))
+        if skip_writer is None:
+            self.store.update_sync_marks(sync_marks)        # those are phone dates, ours aren't
+
+        for writer, (compression, codec) in self.writers.items():
+            if writer is not skip_writer:
+                for message_dict in message_dicts:
+                    frame = ProtocolServer.encode_frame(message_dict, compression, codec)
+                    self.bytes_sent += len(frame)
+                    writer.write(frame)
+
+    async def handle_message(self, frame, writer):
+        """ a frontend sent a sms, pass it on to the phone and show it on the other frontends """
+
+        uid = frame.pop(JSONHelper.JSON_MESSAGE_UID_KEY, None)
+
+        if self.writer is None:
+            if uid is not None:
+                await self.ack(writer, uid, False)
+            return
+
+        upstream_frame = dict(frame)
+
+        now = time.time()
+        date = round(now * 1000)
+        frame[JSONHelper.JSON_MESSAGE_TIME_KEY] = time.strftime(Daemon.REMOTE_TIME_FORMAT_STR, time.localtime(now))
+        frame[JSONHelper.JSON_MESSAGE_DATE_KEY] = date
+
+        acked_upstream = uid is not None and ConnectionHandler.FEATURE_ACK in self.server_features
+        if acked_upstream:
+            self.next_uid += 1
+            upstream_frame[JSONHelper.JSON_MESSAGE_UID_KEY] = str(self.next_uid)
+            self.pending_acks[str(self.next_uid)] = (writer, uid, frame[JSONHelper.JSON_MESSAGE_ID_KEY], date)
+
+        await self.write_upstream(upstream_frame)
+        self.receive_messages([frame], skip_writer=writer)
+
+        if uid is not None and not acked_upstream:
+            # the phone won't ack, pace like the ui does for it and ack ourselves
+            await asyncio.sleep(ConnectionHandler.WRITE_PAUSE_TIME)
+            await self.ack(writer, uid, date=date)
+
+    async def fail_pending_acks(self):
+        for writer, uid, _, _ in self.pending_acks.values():
+            if writer in self.writers:
+                await self.ack(writer, uid, False)
+        self.pending_acks.clear()
+
+    async def heartbeat_upstream(self):
+        """ same liveness rules as ConnectionHandler.heartbeat_loop """
+
+        last_ping = 0
+
+        while True:
+            now = time.monotonic()
+            idle = now - self.last_received
+
+            if idle >= self.liveness_timeout:
+                self.writer.transport.abort()
+                return
+
+            if idle >= self.heartbeat_interval and now - last_ping >= self.heartbeat_interval:
+                last_ping = now
+                await self.write_upstream({JSONHelper.JSON_PING_KEY: int(now)})
+
+            await asyncio.sleep(min(self.heartbeat_interval, self.liveness_timeout - idle))
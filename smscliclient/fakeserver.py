@@ -0,0 +1,197 @@
+"""
+    A local stand-in for the android smscli-server
+
+    speaks the same length prefixed JSON protocol, either as an
+    old server (contact list, then messages) or as a version 2
+    server (handshake, delta resync, acks), see ConnectionHandler
+
+    can make up load too, any number of contacts, a message history
+    for clients to sync and bursts of incoming messages
+
+    usage: python -m smscliclient.fakeserver [options]
+"""
+
+import time
+import random
+import asyncio
+import argparse
+
+from smscliclient.smscliclient import ConnectionHandler, JSONHelper, JSONCodec, ViewMessage
+from smscliclient.server import ProtocolServer
+
+
+class FakeServer(ProtocolServer):
+    """ Holds some fake contacts and messages and serves them to any client that connects """
+
+    REMOTE_TIME_FORMAT_STR = '%I:%M:%S %p'
+
+    HISTORY_SPACING_MS = 1000
+
+    def __init__(self, num_contacts=10, legacy=False, features=None, bandwidth=None, num_messages=0):
+        super().__init__(features)
+
+        self.legacy = legacy
+        self.bandwidth = bandwidth      # bytes per second to throttle writes to, None for unthrottled
+        self.silent = False             # stop answering without closing, like a phone that dropped off wifi
+
+        self.contacts = {}
+        self.contacts_version = 0
+        for i in range(1, num_contacts + 1):
+            self.add_contact(str(i), 'Contact {}'.format(i), '555{:07d}'.format(i))
+
+        self.messages = []      # message dicts, oldest first
+        self.received = []      # message dicts clients sent us
+        self.add_history(num_messages)
+
+    async def send(self, writer, frame):
+        """ write a frame, at no more than bandwidth bytes a second if throttled """
+
+        if self.bandwidth is None:
+            await super().send(writer, frame)
+            return
+
+        self.bytes_sent += len(frame)
+
+        chunk_size = max(1, int(self.bandwidth / 100))
+        for i in range(0, len(frame), chunk_size):
+            chunk = frame[i:i + chunk_size]
+            writer.write(chunk)
+            await writer.drain()
+            await asyncio.sleep(len(chunk) / self.bandwidth)
+
+    def add_contact(self, contact_id, display_name, phone_number):
+        self.contacts[contact_id] = {
+            JSONHelper.JSON_CONTACT_ID_KEY: contact_id,
+            JSONHelper.JSON_CONTACT_DISPLAY_KEY: display_name,
+            JSONHelper.JSON_CONTACT_PHONE_KEY: phone_number
+        }
+        self.contacts_version += 1
+
+    def get_contacts(self):
+        return self.contacts
+
+    def get_contacts_version(self):
+        return str(self.contacts_version)
+
+    def make_message(self, contact_id, body, message_type=ViewMessage.TYPE_INCOMING, date=None):
+        date = int(time.time() * 1000) if date is None else date
+
+        return {
+            JSONHelper.JSON_MESSAGE_TIME_KEY: time.strftime(FakeServer.REMOTE_TIME_FORMAT_STR, time.localtime(date / 1000)),
+            JSONHelper.JSON_MESSAGE_BODY_KEY: body,
+            JSONHelper.JSON_MESSAGE_ID_KEY: contact_id,
+            JSONHelper.JSON_MESSAGE_TYPE_KEY: message_type,
+            JSONHelper.JSON_MESSAGE_DATE_KEY: date
+        }
+
+    def add_history(self, count):
+        """ count made up messages from the past, spread over every contact, without pushing them """
+
+        contact_ids = list(self.contacts)
+        start_date = int(time.time() * 1000) - count * FakeServer.HISTORY_SPACING_MS
+
+        for i in range(count):
+            self.messages.append(self.make_message(
+                contact_ids[i % len(contact_ids)],
+                'history message number {}'.format(i),
+                ViewMessage.TYPE_INCOMING if i % 3 else ViewMessage.TYPE_OUTGOING,
+                start_date + i * FakeServer.HISTORY_SPACING_MS
+            ))
+
+    def add_burst(self, count):
+        """ count incoming messages at once from random contacts, like a busy group chat """
+
+        for _ in range(count):
+            contact_id = random.choice(list(self.contacts))
+            self.add_message(self.make_message(contact_id, 'fake message at ' + time.strftime('%X')))
+
+    def add_message(self, message):
+        """ record a message and push it to every connected client """
+
+        self.messages.append(message)
+        if not self.silent:
+            self.broadcast(self.strip_message(message))
+
+    def strip_message(self, message):
+        """ old servers don't send dates """
+
+        if self.legacy:
+            return {key: value for key, value in message.items() if key != JSONHelper.JSON_MESSAGE_DATE_KEY}
+        return message
+
+    def messages_since(self, since):
+        """ every message newer than the client's high water mark for its contact, all of them for a new client """
+
+        if not since:
+            return [self.strip_message(message) for message in self.messages]
+
+        floor = max(since.values())
+        return [message for message in self.messages
+                if message[JSONHelper.JSON_MESSAGE_DATE_KEY] > since.get(message[JSONHelper.JSON_MESSAGE_ID_KEY], floor)]
+
+    async def start_session(self, reader, writer):
+        if not self.legacy:
+            return await super().start_session(reader, writer)
+
+        # old servers just send the contact list, there's no history to sync
+        await self.send(writer, FakeServer.encode_frame(self.contacts))
+        return False, JSONCodec()
+
+    async def handle_frame(self, frame, writer):
+        if not self.silent:
+            await super().handle_frame(frame, writer)
+
+    async def handle_message(self, frame, writer):
+        """ pretend to send it """
+
+        self.received.append(frame)
+        message = self.make_message(
+            frame[JSONHelper.JSON_MESSAGE_ID_KEY],
+            frame[JSONHelper.JSON_MESSAGE_BODY_KEY],
+            ViewMessage.TYPE_OUTGOING
+        )
+        self.messages.append(message)
+
+        if ConnectionHandler.FEATURE_ACK in self.features and JSONHelper.JSON_MESSAGE_UID_KEY in frame:
+            await self.ack(writer, frame[JSONHelper.JSON_MESSAGE_UID_KEY], date=message[JSONHelper.JSON_MESSAGE_DATE_KEY])
+
+
+async def serve(args):
+    server = FakeServer(args.contacts, args.legacy, bandwidth=args.bandwidth, num_messages=args.messages)
+    port = await server.start(args.host, args.port)
+    print('Serving {} contacts and {} messages on {}:{}'.format(len(server.contacts), len(server.messages), args.host, port),
+          flush=True)
+
+    # fake messages only go out while someone is connected
+    sent = 0
+    while not args.no_bursts and (not args.count or sent < args.count):
+        await asyncio.sleep(args.interval)
+        if server.writers:
+            burst = args.burst if not args.count else min(args.burst, args.count - sent)
+            server.add_burst(burst)
+            sent += burst
+
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m smscliclient.fakeserver')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--contacts', type=int, default=10, help='number of fake contacts')
+    parser.add_argument('--messages', type=int, default=0, help='number of fake messages in the history clients sync')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between bursts of fake incoming messages')
+    parser.add_argument('--burst', type=int, default=1, help='number of fake incoming messages in a burst')
+    parser.add_argument('--count', type=int, default=0, help='stop after this many fake incoming messages, 0 for never')
+    parser.add_argument('--no-bursts', action='store_true', help='send no fake incoming messages, only the history')
+    parser.add_argument('--legacy', action='store_true', help='behave like a server without handshake support')
+    parser.add_argument('--bandwidth', type=float, default=None, help='throttle writes to this many bytes a second')
+
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+    The server half of the smscli protocol
+
+    what the android smscli-server does, see ConnectionHandler for
+    the protocol. Used by the fake server and by the daemon, which
+    serves frontends the same way the phone serves it
+"""
+
+import zlib
+import asyncio
+
+from smscliclient.smscliclient import ConnectionHandler, JSONHelper, JSONCodec, MsgpackCodec
+
+
+class ProtocolServer:
+    """
+        Serves any number of clients, over TCP or a unix socket
+
+        subclasses say where the contacts and messages come from
+        and what to do with the sms clients send
+    """
+
+    def __init__(self, features=None):
+        self.features = list(ConnectionHandler.get_client_features() if features is None else features)
+        self.bytes_sent = 0
+
+        self.writers = {}       # writer -> (whether that client negotiated compression, its codec)
+        self.client_tasks = set()
+
+        self.server = None
+
+    @staticmethod
+    def encode_frame(obj, compression=False, codec=JSONCodec()):
+        data = codec.encode(obj)
+        length = len(data)
+
+        if compression and length >= ConnectionHandler.COMPRESS_MIN_SIZE:
+            data = zlib.compress(data, ConnectionHandler.COMPRESS_LEVEL)
+            length = len(data) | ConnectionHandler.FRAME_COMPRESSED_FLAG
+
+        return length.to_bytes(ConnectionHandler.LEN_BYTE_SIZE, ConnectionHandler.LEN_STRUCT_INT_TYPE) + data
+
+    @staticmethod
+    async def read_frame(reader, codec=JSONCodec()):
+        length = int.from_bytes(
+            await reader.readexactly(ConnectionHandler.LEN_BYTE_SIZE),
+            ConnectionHandler.LEN_STRUCT_INT_TYPE
+        )
+
+        data = await reader.readexactly(length & ConnectionHandler.FRAME_LENGTH_MASK)
+        if length & ConnectionHandler.FRAME_COMPRESSED_FLAG:
+            data = zlib.decompress(data)
+
+        return codec.decode(data)
+
+    def get_contacts(self):
+        """ contact id -> contact dict """
+        raise NotImplementedError
+
+    def get_contacts_version(self):
+        raise NotImplementedError
+
+    def messages_since(self, since):
+        """ message dicts a client with the high water marks since is missing """
+        raise NotImplementedError
+
+    async def handle_message(self, frame, writer):
+        """ a client sent a sms """
+        raise NotImplementedError
+
+    async def send(self, writer, frame):
+        self.bytes_sent += len(frame)
+        writer.write(frame)
+        await writer.drain()
+
+    def broadcast(self, obj):
+        """ push obj to every connected client """
+
+        for writer, (compression, codec) in self.writers.items():
+            frame = ProtocolServer.encode_frame(obj, compression, codec)
+            self.bytes_sent += len(frame)
+            writer.write(frame)
+
+    async def ack(self, writer, uid, ok=True, date=None):
+        frame = {JSONHelper.JSON_ACK_KEY: uid, JSONHelper.JSON_ACK_OK_KEY: ok}
+        if date is not None:
+            frame[JSONHelper.JSON_MESSAGE_DATE_KEY] = date
+
+        await self.send(writer, ProtocolServer.encode_frame(frame, *self.writers[writer]))
+
+    async def start(self, host='127.0.0.1', port=0):
+        """ listen on TCP, returns the port """
+
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start_unix(self, path):
+        self.server = await asyncio.start_unix_server(self.handle_client, path)
+
+    async def stop(self):
+        for task in self.client_tasks:
+            task.cancel()
+        await asyncio.gather(*self.client_tasks)
+
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        self.client_tasks.add(asyncio.current_task())
+
+        try:
+            session = await self.start_session(reader, writer)
+            self.writers[writer] = session
+
+            while True:
+                await self.handle_frame(await ProtocolServer.read_frame(reader, session[1]), writer)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.client_tasks.discard(asyncio.current_task())
+            self.writers.pop(writer, None)
+            writer.close()
+
+    async def start_session(self, reader, writer):
+        """
+            handshake, then the contact list if the client needs it and the delta
+            returns (compression, codec) agreed on
+        """
+
+        contacts_version = self.get_contacts_version()
+
+        await self.send(writer, ProtocolServer.encode_frame({JSONHelper.JSON_HANDSHAKE_KEY: {
+            JSONHelper.JSON_VERSION_KEY: ConnectionHandler.PROTOCOL_VERSION,
+            JSONHelper.JSON_FEATURES_KEY: self.features,
+            JSONHelper.JSON_CONTACTS_VERSION_KEY: contacts_version
+        }}))
+
+        hello = (await ProtocolServer.read_frame(reader))[JSONHelper.JSON_HELLO_KEY]
+        client_features = hello.get(JSONHelper.JSON_FEATURES_KEY, [])
+        compression = ConnectionHandler.FEATURE_ZLIB in self.features and ConnectionHandler.FEATURE_ZLIB in client_features
+
+        codec = JSONCodec()
+        if MsgpackCodec.NAME in self.features and MsgpackCodec.NAME in client_features:
+            codec = MsgpackCodec()
+
+        delta = {JSONHelper.JSON_CONTACTS_VERSION_KEY: contacts_version}
+        if hello.get(JSONHelper.JSON_CONTACTS_VERSION_KEY) != contacts_version:
+            await self.send(writer, ProtocolServer.encode_frame(self.get_contacts(), compression, codec))
+
+        delta[JSONHelper.JSON_MESSAGES_KEY] = self.messages_since(hello.get(JSONHelper.JSON_SINCE_KEY))
+        await self.send(writer, ProtocolServer.encode_frame({JSONHelper.JSON_DELTA_KEY: delta}, compression, codec))
+
+        return compression, codec
+
+    async def handle_frame(self, frame, writer):
+        """ answer pings, anything else is a sms """
+
+        if JSONHelper.JSON_PING_KEY in frame:
+            await self.send(writer, ProtocolServer.encode_frame(
+                {JSONHelper.JSON_PONG_KEY: frame[JSONHelper.JSON_PING_KEY]}, *self.writers[writer]
+            ))
+        elif JSONHelper.JSON_PONG_KEY not in frame:
+            await self.handle_message(frame, writer)
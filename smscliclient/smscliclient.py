@@ -1,28 +1,65 @@
 #/usr/bin/python
 
-from builtins import AssertionError, str
+import time
+IMPORT_START = time.perf_counter()      # for --profile-startup
 
 import json
 import os
 import re
+import zlib
+import mmap
 import struct
+import bisect
 import signal
+import sys
 import socket
+import sqlite3
+import asyncio
 import datetime
-import threading
 import collections
 import configparser
-import time
+import argparse
+import random
+import queue
+import threading
+import importlib.util
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-import gi
-gi.require_version('Notify', '0.7')
-from gi.repository import Notify
 import urwid
 
+IMPORT_END = time.perf_counter()
+
 MAX_MESSAGE_LEN = 300
 
-class ViewMessage(urwid.Padding):
-    """ Represents a single message in a view """ 
+
+def intern_str(value):
+    """ intern strings, leave anything else (like TYPE_LOG) alone """
+    return sys.intern(value) if type(value) is str else value
+
+class ViewMessage:
+    """
+        Represents a single message in a view
+
+        plain data, the widget that displays it is a
+        MessageWidget, only built when it's on screen
+
+        there can be millions of these so they are kept small,
+        slots instead of a dict and the few distinct strings
+        (contact ids, names, times, types) are interned so
+        every message shares the same copy
+    """ 
+
+    __slots__ = ('message_time', 'body', 'related_view_id', 'sender_name', 'message_type',
+                 'timestamp', 'delivery_state')
 
     TYPE_LOG = 0
     TYPE_OUTGOING = 'OUTBOX'
@@ -31,41 +68,197 @@ class ViewMessage(urwid.Padding):
     TIME_FORMAT_STR = '%H:%M:%S'
     USER_DISPLAY_NAME = 'Me'
 
+    # delivery states of outgoing messages
+    STATE_QUEUED = 'queued'
+    STATE_SENT = 'sent'
+    STATE_ACKED = 'acked'
+    STATE_FAILED = 'failed'
+
+    def __init__(self, message_time, body, related_view_id, sender_name, message_type, timestamp=None):
+        self.message_time = intern_str(message_time)        # expects properly formatted time
+        self.body = body
+        self.related_view_id = intern_str(related_view_id)
+        self.sender_name = intern_str(sender_name)
+        self.message_type = intern_str(message_type)
+        self.timestamp = time.time() if timestamp is None else timestamp     # when we got it, for ordering
+        self.delivery_state = None
+
+    def set_delivery_state(self, delivery_state):
+        """ the view it's in is told, so its next redraw shows the new state """
+
+        self.delivery_state = delivery_state
+
+        contact_view = state.contact_views.get(self.related_view_id)
+        if contact_view is not None:
+            contact_view.listwalker.message_changed(self)
+
+
+class MessageWidget(urwid.Padding):
+    """ Displays a single ViewMessage """
+
     # attributes for theming
     TYPE_LOG_ATTR = 'log'
     TYPE_OUTGOING_ATTR = 'outgoing'
     TYPE_INCOMING_ATTR = 'incoming'
 
+    SENDER_ATTRS = {
+        ViewMessage.TYPE_LOG: TYPE_LOG_ATTR,
+        ViewMessage.TYPE_OUTGOING: TYPE_OUTGOING_ATTR,
+        ViewMessage.TYPE_INCOMING: TYPE_INCOMING_ATTR
+    }
+
     TIME_ATTR = 'message_time'
     BODY_ATTR = 'body'
+    DELIVERY_ATTR = 'delivery'
 
-    def __init__(self, message_time, body, related_view_id, sender_name, message_type):
-        self.message_time = message_time        # expects properly formatted time
-        self.body = body
-        self.related_view_id = related_view_id
-        self.sender_name = sender_name
-        self.message_type = message_type
-
-        self.alignment = MainWindow.MESSAGE_ALIGNMENT
-        self.width_type = MainWindow.MESSAGE_WIDTH_TYPE
-        self.width_size = MainWindow.MESSAGE_WIDTH_PERCENT
-
-        if self.message_type == ViewMessage.TYPE_LOG:
-            self.sender_attr = ViewMessage.TYPE_LOG_ATTR
-        elif self.message_type == ViewMessage.TYPE_OUTGOING:
-            self.sender_attr = ViewMessage.TYPE_OUTGOING_ATTR
-        elif self.message_type == ViewMessage.TYPE_INCOMING:
-            self.sender_attr = ViewMessage.TYPE_INCOMING_ATTR
-
-        super().__init__(urwid.Text([
-                (ViewMessage.TIME_ATTR, self.message_time + ' - '),
-                (self.sender_attr, self.sender_name + ': '),
-                (ViewMessage.BODY_ATTR, self.body)
-            ]),
-            align=self.alignment,
-            width=(self.width_type, self.width_size)
+    def __init__(self, view_message):
+        self.view_message = view_message
+        self.delivery_state = view_message.delivery_state       # state last rendered
+
+        super().__init__(urwid.Text(self.get_markup()),
+            align=MainWindow.MESSAGE_ALIGNMENT,
+            width=(MainWindow.MESSAGE_WIDTH_TYPE, MainWindow.MESSAGE_WIDTH_PERCENT)
         )
 
+    def get_markup(self):
+        markup = [
+            (MessageWidget.TIME_ATTR, self.view_message.message_time + ' - '),
+            (MessageWidget.SENDER_ATTRS.get(self.view_message.message_type), self.view_message.sender_name + ': '),
+            (MessageWidget.BODY_ATTR, self.view_message.body)
+        ]
+
+        if self.delivery_state is not None:
+            markup.append((MessageWidget.DELIVERY_ATTR, ' [' + self.delivery_state + ']'))
+
+        return markup
+
+    def refresh(self):
+        """ re-render if the message changed since it was built """
+
+        if self.delivery_state != self.view_message.delivery_state:
+            self.delivery_state = self.view_message.delivery_state
+            self.original_widget.set_text(self.get_markup())
+
+
+class MessageListWalker(urwid.ListWalker):
+    """
+        ListWalker over ViewMessages
+
+        only keeps the messages themselves, widgets are built
+        when the ListBox asks for a position (so only for the
+        visible window plus whatever it looks ahead at) and
+        kept in a LRU cache, so long conversations cost no
+        more to open or scroll than short ones
+    """
+
+    WIDGET_CACHE_SIZE = 256
+
+    def __init__(self, view_messages):
+        self.view_messages = list(view_messages)
+        self.focus = 0
+        self.widget_cache = collections.OrderedDict()    # ViewMessage -> MessageWidget, least recently used first
+
+    def __len__(self):
+        return len(self.view_messages)
+
+    def __getitem__(self, position):
+        return self.view_messages[position]
+
+    def get_widget(self, position):
+        view_message = self.view_messages[position]
+
+        widget = self.widget_cache.get(view_message)
+        if widget is None:
+            widget = MessageWidget(view_message)
+            self.widget_cache[view_message] = widget
+
+            if len(self.widget_cache) > MessageListWalker.WIDGET_CACHE_SIZE:
+                self.widget_cache.popitem(last=False)
+        else:
+            self.widget_cache.move_to_end(view_message)
+            widget.refresh()
+
+        return widget
+
+    def get_focus(self):
+        if not self.view_messages:
+            return None, None
+
+        return self.get_widget(self.focus), self.focus
+
+    def set_focus(self, position):
+        if not 0 <= position < len(self.view_messages):
+            raise IndexError(position)
+
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
+        if position + 1 >= len(self.view_messages):
+            return None, None
+
+        return self.get_widget(position + 1), position + 1
+
+    def get_prev(self, position):
+        if position <= 0:
+            return None, None
+
+        return self.get_widget(position - 1), position - 1
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.view_messages) - 1, -1, -1)
+        return range(len(self.view_messages))
+
+    def append(self, view_message):
+        self.view_messages.append(view_message)
+        self._modified()
+
+    def extend(self, view_messages):
+        self.view_messages.extend(view_messages)
+        self._modified()
+
+    def prepend(self, view_messages):
+        """ add older messages to the top, focus stays on the same message """
+
+        self.view_messages[0:0] = view_messages
+        if len(self.view_messages) > len(view_messages):
+            self.focus += len(view_messages)
+        self._modified()
+
+    def drop_oldest(self, count):
+        """ take count messages off the top and return them, focus stays on the same message if it's still here """
+
+        dropped = self.view_messages[:count]
+        del self.view_messages[:count]
+        for view_message in dropped:
+            self.widget_cache.pop(view_message, None)
+
+        self.focus = max(0, self.focus - count)
+        self._modified()
+        return dropped
+
+    def message_changed(self, view_message):
+        """ view_message was changed in place, urwid keeps canvases so its widget has to be redone """
+
+        widget = self.widget_cache.get(view_message)
+        if widget is not None:
+            widget.refresh()
+        self._modified()
+
+    def replace(self, position, view_message):
+        self.widget_cache.pop(self.view_messages[position], None)
+        self.view_messages[position] = view_message
+        self._modified()
+
+    def reset(self, view_messages):
+        """ swap in entirely new content, focused on the top """
+
+        self.view_messages = list(view_messages)
+        self.focus = 0
+        self.widget_cache.clear()
+        self._modified()
+
 
 class View:
     """
@@ -75,25 +268,141 @@ class View:
         so we can easily switch views and add to them
 
         content is a list of ViewMessages
+
+        with max_messages set only the newest that many are kept
+        in memory, older ones are evicted off the top and paged
+        back in when scrolled up to, by views that override
+        evict/load_older to keep them somewhere
     """
 
+    max_messages = 0        # 0 for no limit
+    TRIM_SLACK = 8          # trim once over the limit by 1/TRIM_SLACK of it, not on every message
+    PAGE_SIZE = 100         # messages paged back in at a time
+
     def __init__(self, view_id, view_name, content):
         self.view_id = view_id
         self.view_name = view_name
-        self.listwalker = urwid.SimpleFocusListWalker(content)
+        self.listwalker = MessageListWalker(content)
         self.listbox = urwid.ListBox(self.listwalker)
 
+        self.evicted = 0        # messages before the first one in memory
+
+        # incoming messages since the view was last looked at, and how many of them mention a highlight word
+        self.unread = 0
+        self.mentions = 0
+
     def scroll_to_bottom(self):
         self.listbox.set_focus(len(self.listwalker) - 1)
 
     def add_message(self, view_message):
         self.listwalker.append(view_message)
+        self.trim()
         self.scroll_to_bottom()
 
     def add_messages(self, view_messages):
-        self.listwalker += view_messages
+        start = time.perf_counter()
+
+        self.listwalker.extend(view_messages)
+        self.trim()
         self.scroll_to_bottom()
 
+        state.metrics.observe(Metrics.ADD_MESSAGES, time.perf_counter() - start)
+        state.metrics.inc(Metrics.MESSAGES_ADDED, len(view_messages))
+
+    def trim(self):
+        if self.max_messages and len(self.listwalker) > self.max_messages + self.max_messages // View.TRIM_SLACK:
+            count = len(self.listwalker) - self.max_messages
+            self.evict(self.listwalker.drop_oldest(count))
+            self.evicted += count
+
+    def evict(self, view_messages):
+        """ view_messages were trimmed off the top """
+        pass
+
+    def load_older(self, count):
+        """ the count messages before the first one in memory, oldest first """
+        return []
+
+    def page_in(self, count=PAGE_SIZE):
+        """ bring back up to count evicted messages, returns how many """
+
+        older = self.load_older(min(count, self.evicted))
+        if older:
+            self.listwalker.prepend(older)
+            self.evicted -= len(older)
+
+        return len(older)
+
+    def scroll(self, lines):
+        """ move the focus by lines, scrolling up past the top pages evicted messages back in """
+
+        if not len(self.listwalker):
+            return
+
+        position = self.listbox.focus_position + lines
+        if position < 0 and self.evicted:
+            position += self.page_in(max(-position, View.PAGE_SIZE))
+
+        self.listbox.set_focus(max(0, min(position, len(self.listwalker) - 1)))
+
+    def focus_message(self, position):
+        """ focus the message at position, counting evicted ones, paging it in if needed """
+
+        if position < self.evicted:
+            self.page_in(self.evicted - position)
+
+        if len(self.listwalker):
+            self.listbox.set_focus(max(0, min(position - self.evicted, len(self.listwalker) - 1)))
+
+    def load_history(self):
+        """ called when the view is first switched to, views with stored history override this """
+        pass
+
+
+class ScrollbackFile:
+    """
+        Lines trimmed off the log view, kept so they can be paged back in
+
+        a json [time, text] per line. Once the file is over MAX_BYTES it
+        is moved aside (replacing the last one moved aside) and a new one
+        started, so there's never more than about twice that on disk
+    """
+
+    FILE_NAME = 'log.txt'
+    ROTATED_SUFFIX = '.1'
+    MAX_BYTES = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, view_messages):
+        # losing scrollback isn't worth an error in the log it was trimmed from
+        try:
+            with open(self.path, 'a') as scrollback_file:
+                for view_message in view_messages:
+                    scrollback_file.write(json.dumps([view_message.message_time, view_message.body]) + '\n')
+                size = scrollback_file.tell()
+
+            if size > ScrollbackFile.MAX_BYTES:
+                os.replace(self.path, self.path + ScrollbackFile.ROTATED_SUFFIX)
+        except OSError:
+            pass
+
+    def read(self, skip, count):
+        """ up to count lines before the newest skip, oldest first """
+
+        lines = []
+        for path in (self.path + ScrollbackFile.ROTATED_SUFFIX, self.path):
+            try:
+                with open(path) as scrollback_file:
+                    lines.extend(scrollback_file.readlines())
+            except OSError:
+                pass
+
+        end = max(0, len(lines) - skip)
+        return [ViewMessage(*json.loads(line), LogView.VIEW_NAME, LogView.VIEW_NAME, ViewMessage.TYPE_LOG)
+                for line in lines[max(0, end - count):end]]
+
 
 class LogView(View):
     """
@@ -106,14 +415,55 @@ class LogView(View):
     def __init__(self, content):
         super().__init__(self.VIEW_ID, self.VIEW_NAME, content)
 
+        self.progress_position = None       # position of the line print_progress keeps rewriting
+
+        self.scrollback = None
+        self.paged_in = 0       # lines at the top that were paged back in, so are in the scrollback file already
+
+    def set_scrollback(self, max_messages, path):
+        """ keep only the newest max_messages lines, the rest go to the file at path """
+
+        self.max_messages = max_messages
+        self.scrollback = ScrollbackFile(path)
+        self.trim()
+
+    def evict(self, view_messages):
+        if self.progress_position is not None:
+            self.progress_position -= len(view_messages)
+            if self.progress_position < 0:
+                self.progress_position = None
+
+        already_written = min(self.paged_in, len(view_messages))
+        self.paged_in -= already_written
+        self.scrollback.write(view_messages[already_written:])
+
+    def load_older(self, count):
+        older = self.scrollback.read(self.paged_in, count)
+        self.paged_in += len(older)
+        return older
+
     def print_message(self, message):
-        self.add_message(ViewMessage(
+        self.progress_position = None
+        self.add_message(LogView.make_log_message(message))
+
+    def print_progress(self, message):
+        """ like print_message, but successive calls rewrite the same line """
+
+        if self.progress_position is None:
+            self.add_message(LogView.make_log_message(message))
+            self.progress_position = len(self.listwalker) - 1
+        else:
+            self.listwalker.replace(self.progress_position, LogView.make_log_message(message))
+
+    @staticmethod
+    def make_log_message(message):
+        return ViewMessage(
             datetime.datetime.now().time().strftime(ViewMessage.TIME_FORMAT_STR),
             message,
             LogView.VIEW_NAME,
             LogView.VIEW_NAME,
             ViewMessage.TYPE_LOG
-        ))
+        )
 
 
 class ContactView(View):
@@ -123,13 +473,328 @@ class ContactView(View):
 
         Holds contact data along with urwid widgets
         to represent it as a view
+
+        device is the phone the contact came from, '' for the
+        untagged one, the others are named in the view name
     """
 
-    def __init__(self, view_id, name, address, content):
+    TAGGED_NAME = '{name}@{device}'
+
+    def __init__(self, view_id, name, address, content, device='', history_end_id=None):
         self.address = address
         self.display_name = name
+        self.device = device
+
+        # anything stored up to now is history, loaded once the view is opened
+        # anything after is added live so must not be loaded again
+        # making a lot of views at once, the caller can look it up once for all of them
+        self.history_end_id = state.message_store.get_last_message_id() if history_end_id is None else history_end_id
+        self.history_loaded = False
         
-        super().__init__(view_id, name, content)
+        super().__init__(view_id, ContactView.make_view_name(name, device), content)
+
+    @staticmethod
+    def make_view_name(name, device):
+        return ContactView.TAGGED_NAME.format(name=name, device=device) if device else name
+
+    def rename(self, name):
+        self.display_name = name
+        self.view_name = ContactView.make_view_name(name, self.device)
+
+    def load_history(self):
+        if not self.history_loaded:
+            self.history_loaded = True
+
+            if self.max_messages:
+                # only the newest of it, the rest is paged in from the store if scrolled up to
+                history_count = state.message_store.count_messages(self.view_id, self.history_end_id)
+                self.evicted = max(0, history_count - self.max_messages)
+                history = state.message_store.load_message_range(self.view_id, self.history_end_id,
+                                                                 self.evicted, history_count - self.evicted)
+            else:
+                history = state.message_store.load_messages(self.view_id, self.history_end_id)
+
+            if history:
+                self.listwalker.prepend(history)
+                self.scroll_to_bottom()
+
+    def load_older(self, count):
+        # evicted messages are all in the store
+        return state.message_store.load_message_range(self.view_id, self.history_end_id, self.evicted - count, count)
+
+
+class SearchView(View):
+    """
+        Results of the last /search, newest first
+
+        each result is numbered, /jump <number> opens it
+        in its conversation
+    """
+
+    VIEW_ID = 'search'
+    VIEW_NAME = 'search'
+
+    RESULT_SENDER = '{number}) {contact}'
+    MESSAGE_RESULTS = '{count} results for "{query}"'
+
+    def __init__(self):
+        super().__init__(SearchView.VIEW_ID, SearchView.VIEW_NAME, [])
+
+        self.results = []       # (message id, contact id) of every result, as numbered
+
+    def show_results(self, query, results):
+        """ results are (message id, ViewMessage) pairs from MessageStore.search """
+
+        self.results = [(message_id, view_message.related_view_id) for message_id, view_message in results]
+
+        view_messages = [LogView.make_log_message(SearchView.MESSAGE_RESULTS.format(count=len(results), query=query))]
+        for number, (_, view_message) in enumerate(results, 1):
+            contact_view = state.contact_views.get(view_message.related_view_id)
+            view_message.sender_name = SearchView.RESULT_SENDER.format(
+                number=number,
+                contact=view_message.related_view_id if contact_view is None else contact_view.display_name
+            )
+            view_messages.append(view_message)
+
+        self.listwalker.reset(view_messages)
+
+
+class ContactIndex:
+    """
+        Finds contacts by name or phone number without scanning them all
+
+        names are case folded once and kept in a sorted array so exact
+        and prefix lookups are a bisect, phone numbers are reduced to
+        their last digits so +1 (555) 000-0001 matches 5550000001
+    """
+
+    PHONE_MATCH_DIGITS = 10
+    BULK_SIZE = 64              # batches bigger than this are sorted in, not inserted one by one
+    NON_DIGITS = re.compile('[^0-9]')
+    LETTERS = re.compile('[a-zA-Z]')
+
+    def __init__(self):
+        self.names = []             # sorted (folded name, view id)
+        self.folded_names = {}      # view id -> its folded name in names
+        self.numbers = {}           # normalized phone number -> set of view ids
+        self.view_numbers = {}      # view id -> its normalized phone number
+
+    @staticmethod
+    def normalize_number(number):
+        return ContactIndex.NON_DIGITS.sub('', number)[-ContactIndex.PHONE_MATCH_DIGITS:]
+
+    def add_contacts(self, contact_views):
+        """ index new contacts, or reindex ones whose name or number changed """
+
+        if len(contact_views) > ContactIndex.BULK_SIZE:
+            view_ids = {contact_view.view_id for contact_view in contact_views}
+            self.names = [entry for entry in self.names if entry[1] not in view_ids]
+            for view_id in view_ids:
+                self.folded_names.pop(view_id, None)
+                self.remove_number(view_id)
+
+            self.names.extend(self.index_contact(contact_view) for contact_view in contact_views)
+            self.names.sort()
+        else:
+            for contact_view in contact_views:
+                self.remove(contact_view.view_id)
+                bisect.insort(self.names, self.index_contact(contact_view))
+
+    def index_contact(self, contact_view):
+        """ record everything but the sorted name entry, which is returned """
+
+        folded_name = contact_view.display_name.casefold()
+        self.folded_names[contact_view.view_id] = folded_name
+
+        number = ContactIndex.normalize_number(contact_view.address)
+        if number:
+            self.numbers.setdefault(number, set()).add(contact_view.view_id)
+            self.view_numbers[contact_view.view_id] = number
+
+        return folded_name, contact_view.view_id
+
+    def remove(self, view_id):
+        folded_name = self.folded_names.pop(view_id, None)
+        if folded_name is not None:
+            del self.names[bisect.bisect_left(self.names, (folded_name, view_id))]
+
+        self.remove_number(view_id)
+
+    def remove_number(self, view_id):
+        number = self.view_numbers.pop(view_id, None)
+        if number is not None:
+            self.numbers[number].discard(view_id)
+            if not self.numbers[number]:
+                del self.numbers[number]
+
+    def iter_prefix(self, prefix):
+        """ yields (folded name, view id) of every name starting with prefix, in order """
+
+        prefix = prefix.casefold()
+        for i in range(bisect.bisect_left(self.names, (prefix,)), len(self.names)):
+            if not self.names[i][0].startswith(prefix):
+                break
+            yield self.names[i]
+
+    def find(self, name):
+        """ view ids of contacts called name, or with name as their number if it has no letters """
+
+        folded_name = name.casefold()
+        view_ids = [view_id for entry_name, view_id in self.iter_prefix(folded_name) if entry_name == folded_name]
+
+        if not view_ids and ContactIndex.LETTERS.search(name) is None:
+            number = ContactIndex.normalize_number(name)
+            view_ids = sorted(self.numbers.get(number, ())) if number else []
+
+        return view_ids
+
+    def complete(self, prefix):
+        """ distinct display names starting with prefix, in order """
+
+        names = []
+        for _, view_id in self.iter_prefix(prefix):
+            display_name = state.contact_views[view_id].display_name
+            if not names or names[-1] != display_name:
+                names.append(display_name)
+
+        return names
+
+
+class ViewManager:
+    """
+        The shown views, in the order they were opened
+
+        a list for lookups by index and a view_id -> index dict for
+        lookups by id, so both are O(1), and it iterates like the dict
+        of view_id -> view it replaces. Closing a view is O(n) in the
+        views after it, they all move down an index
+    """
+
+    def __init__(self, init_view):
+        self.views = []
+        self.positions = {}     # view_id -> index in views
+        self.add(init_view)
+
+    def __len__(self):
+        return len(self.views)
+
+    def __contains__(self, view_id):
+        return view_id in self.positions
+
+    def __getitem__(self, view_id):
+        return self.views[self.positions[view_id]]
+
+    def __iter__(self):
+        return (view.view_id for view in self.views)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return list(self.views)
+
+    def items(self):
+        return [(view.view_id, view) for view in self.views]
+
+    def add(self, view):
+        self.positions[view.view_id] = len(self.views)
+        self.views.append(view)
+
+    def remove(self, view_id):
+        """ returns the index the view was at """
+
+        index = self.positions.pop(view_id)
+        del self.views[index]
+
+        for i in range(index, len(self.views)):
+            self.positions[self.views[i].view_id] = i
+
+        return index
+
+    def index(self, view_id):
+        return self.positions[view_id]
+
+    def at(self, index):
+        return self.views[index]
+
+
+class StatusBar(urwid.Text):
+    """
+        The divider line: connection status, then a segment per shown view
+
+        segments are formatted by MainWindow only when their view changes
+        and kept here. When they don't all fit, the bar scrolls to keep
+        the current view's segment on screen, only the visible ones are
+        laid out
+    """
+
+    SEPARATOR = ' '
+    MORE_LEFT = '<'
+    MORE_RIGHT = '>'
+    STATUS = '[{status}]'
+
+    def __init__(self):
+        super().__init__('', wrap='clip')
+
+        self.status = ''
+        self.segments = []          # text of each view's segment, in view order
+        self.current = 0
+        self.first = 0              # first segment on screen, moves as the bar scrolls
+        self.laid_out_width = None  # width the text was last laid out for, None when something changed
+
+    def set_status(self, status):
+        self.status = status
+        self.invalidate_layout()
+
+    def set_segments(self, segments):
+        self.segments = segments
+        self.invalidate_layout()
+
+    def set_segment(self, index, segment):
+        self.segments[index] = segment
+        self.invalidate_layout()
+
+    def set_current(self, index):
+        self.current = index
+        self.invalidate_layout()
+
+    def invalidate_layout(self):
+        self.laid_out_width = None
+        self._invalidate()
+
+    def render(self, size, focus=False):
+        if size[0] != self.laid_out_width:
+            self.layout_segments(size[0])
+        return super().render(size, focus)
+
+    def layout_segments(self, width):
+        status = StatusBar.STATUS.format(status=self.status)
+        separator_len = len(StatusBar.SEPARATOR)
+        available = width - len(status) - 2 * (separator_len + len(StatusBar.MORE_LEFT))
+        current = min(self.current, len(self.segments) - 1)
+
+        # scroll left to the current segment, or right until it fits
+        first = min(self.first, max(current, 0))
+        used = sum(separator_len + len(segment) for segment in self.segments[first:current + 1])
+        while used > available and first < current:
+            used -= separator_len + len(self.segments[first])
+            first += 1
+
+        last = current
+        while last + 1 < len(self.segments) and used + separator_len + len(self.segments[last + 1]) <= available:
+            last += 1
+            used += separator_len + len(self.segments[last])
+
+        parts = [status]
+        if first > 0:
+            parts.append(StatusBar.MORE_LEFT)
+        parts.extend(self.segments[first:last + 1])
+        if last + 1 < len(self.segments):
+            parts.append(StatusBar.MORE_RIGHT)
+
+        self.first = first
+        self.laid_out_width = width
+        self.set_text(StatusBar.SEPARATOR.join(parts))
 
 
 class MainWindow(urwid.Frame):
@@ -153,20 +818,25 @@ class MainWindow(urwid.Frame):
     FOCUS_ATTR = 'footer'
 
     EDIT_CAPTION = '> '
-    MAX_VIEWS = 6                    # TODO: deal with this properly
-    ERROR_MAX_VIEWS = 'Cant open anymore views'
+
+    SEGMENT = '[{index}:{name}{counts}]'
+    SEGMENT_CURRENT = '-{index}:{name}{counts}-'
+    SEGMENT_UNREAD = ' +{unread}'
+    SEGMENT_MENTIONS = ' @{mentions}'
 
     def __init__(self, init_view):
+        self.status_bar = StatusBar()
+        self.highlight_words = []       # casefolded, incoming messages containing one count as mentions
         self.init_views(init_view)
 
         self.title_bar = urwid.AttrMap(urwid.Text(MainWindow.TITLE_BAR_TEXT), MainWindow.TITLE_BAR_ATTR)
-        self.divider = urwid.AttrMap(urwid.Text(''), MainWindow.DIVIDER_ATTR)
+        self.divider = urwid.AttrMap(self.status_bar, MainWindow.DIVIDER_ATTR)
         self.refresh_divider()
 
         self.input_line = urwid.Edit(MainWindow.EDIT_CAPTION)
 
         inner_frame = urwid.Frame(
-                list(self.shown_views.items())[0][1].listbox,
+                self.shown_views.at(0).listbox,
                 header=self.title_bar,
                 footer=self.divider
         )
@@ -180,17 +850,15 @@ class MainWindow(urwid.Frame):
             initialise the views
             make this a method so we can call it when connecting to reset
         """
-        self.shown_views = collections.OrderedDict({init_view.view_id: init_view})    # subset of views being shown
-        self.max_views = MainWindow.MAX_VIEWS
+        self.shown_views = ViewManager(init_view)    # subset of views being shown
         self.current_view = init_view.view_id
 
     def add_new_view(self, view):
-        if len(self.shown_views) <= self.max_views:
-            self.shown_views[view.view_id] = view
+        # history is loaded once the view is looked at, a sync can open hundreds that never are
+        self.shown_views.add(view)
 
-            self.refresh_divider()
-        else:
-            state.log_view.print_message(MainWindow.ERROR_MAX_VIEWS)
+        self.status_bar.segments.append(self.gen_segment(len(self.shown_views) - 1, view))
+        self.status_bar.invalidate_layout()
 
     def switch_view(self, view_id):
         """
@@ -199,19 +867,76 @@ class MainWindow(urwid.Frame):
             contents['body'][0].contents['body'] -> (listbox, attr)
         """
 
-        self.contents['body'][0].contents['body'] = (self.shown_views[view_id].listbox, None)
+        view = self.shown_views[view_id]
+        view.load_history()
+        self.contents['body'][0].contents['body'] = (view.listbox, None)
+
+        previous_view = self.current_view
         self.current_view = view_id
-        self.refresh_divider()
+        view.unread = view.mentions = 0
+
+        if previous_view in self.shown_views:
+            self.refresh_segment(previous_view)
+        self.refresh_segment(view_id)
+        self.status_bar.set_current(self.shown_views.index(view_id))
 
     def close_view(self, view_id):
 
-        if not list(self.shown_views.values())[0] == self.shown_views[view_id]:  # can never close first view (log view)
+        if self.shown_views.index(view_id) > 0:  # can never close first view (log view)
             # shift current view down, delete old current view then switch
-            keys = list(self.shown_views.keys())
-            new_shown = keys[keys.index(view_id) - 1]
+            index = self.shown_views.remove(view_id)
+            del self.status_bar.segments[index]
+
+            # the ones after it moved down an index
+            for i in range(index, len(self.shown_views)):
+                self.status_bar.segments[i] = self.gen_segment(i, self.shown_views.at(i))
+
+            self.switch_view(self.shown_views.at(index - 1).view_id)
+
+    def close_device_views(self, device):
+        """ close every contact view of a phone, for when its contact list was replaced """
 
-            del(self.shown_views[view_id])
-            self.switch_view(new_shown)
+        kept = [view for view in self.shown_views.values()
+                if not isinstance(view, ContactView) or view.device != device]
+        if len(kept) == len(self.shown_views):
+            return
+
+        self.shown_views = ViewManager(kept[0])
+        for view in kept[1:]:
+            self.shown_views.add(view)
+
+        if self.current_view not in self.shown_views:
+            self.switch_view(kept[0].view_id)
+        self.refresh_divider()
+
+    def count_unread(self, view, view_messages):
+        """ view_messages were just added to view, counts them if it's not the one being looked at """
+
+        if view.view_id == self.current_view or view.view_id not in self.shown_views:
+            return
+
+        incoming = [view_message for view_message in view_messages if view_message.message_type == ViewMessage.TYPE_INCOMING]
+        if not incoming:
+            return
+
+        view.unread += len(incoming)
+        if self.highlight_words:
+            view.mentions += sum(1 for view_message in incoming
+                                 if any(word in view_message.body.casefold() for word in self.highlight_words))
+
+        self.refresh_segment(view.view_id)
+
+    def next_view(self, step, unread_only=False):
+        """ switch to the view step places along, wrapping around, or the next with unread messages """
+
+        count = len(self.shown_views)
+        index = self.shown_views.index(self.current_view)
+
+        for i in range(1, count):
+            view = self.shown_views.at((index + step * i) % count)
+            if not unread_only or view.unread:
+                self.switch_view(view.view_id)
+                return
 
     def get_input(self):
         return self.input_line.get_edit_text()
@@ -220,484 +945,2626 @@ class MainWindow(urwid.Frame):
         self.input_line.set_edit_text('')
 
     def refresh_divider(self):
-        """ change divider text """
-
-        self.divider.original_widget.set_text(self.gen_divider_text())
-
-    def gen_divider_text(self):
         """
-            generate divider text using current show views
-            looks like: '[connected]    [0:contact_name1] [1:contact_name2]'
+            regenerate the whole divider, for when views were reset or renamed
+            looks like: '[connected] [0:smscli] -1:contact_name1- [2:contact_name2 +3]'
         """
 
-        if state.connection_handler.connected:
-            divider_text = '[{status}]'.format(status=ConnectionHandler.STATUS_CONNECTED)
-        else:
-            divider_text = '[{status}]'.format(status=ConnectionHandler.STATUS_DISCONNECTED)
-
-        # do it this way so we can get indices
-        for i, keypair in enumerate(self.shown_views.items()):
-            if keypair[0] == self.current_view:
-                divider_text += ' -' + str(i) + ':' + keypair[1].view_name + '-'
-            else:
-                divider_text += ' [' + str(i) + ':' + keypair[1].view_name + ']'
+        self.status_bar.set_status(state.connections.get_status())
+        self.status_bar.set_segments([self.gen_segment(i, view) for i, view in enumerate(self.shown_views.values())])
+        self.status_bar.set_current(self.shown_views.index(self.current_view) if self.current_view in self.shown_views else 0)
 
-        return divider_text
+    def refresh_status(self):
+        self.status_bar.set_status(state.connections.get_status())
 
+    def refresh_segment(self, view_id):
+        index = self.shown_views.index(view_id)
+        self.status_bar.set_segment(index, self.gen_segment(index, self.shown_views.at(index)))
 
-class ConnectionHandler:
-    """
-        Handles all connection with the server
+    def gen_segment(self, index, view):
+        counts = ''
+        if view.unread:
+            counts += MainWindow.SEGMENT_UNREAD.format(unread=view.unread)
+        if view.mentions:
+            counts += MainWindow.SEGMENT_MENTIONS.format(mentions=view.mentions)
 
-        protocol with server:
-            communicate in messages
-            messages are JSON strings
+        segment = MainWindow.SEGMENT_CURRENT if view.view_id == self.current_view else MainWindow.SEGMENT
+        return segment.format(index=index, name=view.view_name, counts=counts)
 
-            messages can be sent either to or from
-            server/client at any message_time
 
-            initial data: large contact list with sms conversations
-                          encapsulated
+class RenderScheduler:
+    """
+        Coalesces redraws
 
-            messages after: sms messages belonging to a 
-                            conversation
+        instead of drawing the screen for every message, the screen
+        is marked dirty and redrawn at most max_fps times a second.
+        Messages arriving in between are held per view and added
+        with a single add_messages call when the frame is due
 
-            on connection: client reads initial data
-            write: send message length in bytes - size 4 bytes
-                   send data of size s
-            read:  read 4 bytes to get length len
-                   read len bytes
+        urwid redraws after every alarm callback, so a flush is a redraw
     """
 
-    LEN_BYTE_SIZE = 4               # byte size of message length
-    LEN_STRUCT_FORMAT = '! i'       # format chars for struct holding message length
-    LEN_STRUCT_INT_TYPE = 'big'
-    TIMEOUT = 15
+    DEFAULT_MAX_FPS = 20
 
-    MIN_PORT = 1
-    MAX_PORT = 65535
+    MESSAGE_STATS = 'Render: {redraws} redraws, {messages} messages in {batches} batches, max {max_fps} fps'
 
-    WRITE_PAUSE_TIME = 0.2
+    def __init__(self, max_fps=DEFAULT_MAX_FPS):
+        self.set_max_fps(max_fps)
 
-    ERROR_MESSAGE_TIMEOUT = 'Connection timed out'
-    ERROR_MESSAGE_REFUSED = 'Connection was refused'
-    ERROR_MESSAGE_INVALID = 'Invalid command argument'
-    ERROR_MESSAGE_GENERIC = 'Connection failed'
-    ERROR_LOST_CONNECTION = 'Lost connection'
+        self.pending_messages = collections.OrderedDict()     # view_id -> (view, [ViewMessage], [the live ones])
+        self.alarm = None
+        self.last_flush = 0
+
+        # counters so coalescing can be checked
+        self.redraw_count = 0
+        self.message_count = 0
+        self.batch_count = 0
+
+    def set_max_fps(self, max_fps):
+        self.max_fps = max_fps
+        self.frame_time = 1 / max_fps
+
+    def queue_messages(self, view, view_messages, live=True):
+        """ hold messages for view until the next frame, only live ones count as unread """
+
+        if view.view_id not in self.pending_messages:
+            self.pending_messages[view.view_id] = (view, [], [])
+
+        self.pending_messages[view.view_id][1].extend(view_messages)
+        if live:
+            self.pending_messages[view.view_id][2].extend(view_messages)
+
+        self.message_count += len(view_messages)
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        """ schedule a flush for the next free frame, if one isn't already """
+
+        if self.alarm is None:
+            delay = max(0, self.last_flush + self.frame_time - time.monotonic())
+            self.alarm = state.main_loop.set_alarm_in(delay, self.flush)
+
+    def flush(self, main_loop=None, user_data=None):
+        self.alarm = None
+
+        for view, view_messages, live_messages in self.pending_messages.values():
+            view.add_messages(view_messages)
+            state.main_window.count_unread(view, live_messages)
+            self.batch_count += 1
+        self.pending_messages.clear()
+
+        self.last_flush = time.monotonic()
+        self.redraw_count += 1
+
+    def get_stats(self):
+        return RenderScheduler.MESSAGE_STATS.format(
+            redraws=self.redraw_count,
+            messages=self.message_count,
+            batches=self.batch_count,
+            max_fps=self.max_fps
+        )
+
+
+class Histogram:
+    """ Latencies counted into fixed buckets, the way prometheus wants them """
+
+    BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+               0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)      # upper bounds in seconds, anything over is +Inf
+
+    __slots__ = ('bucket_counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(Histogram.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(Histogram.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """ upper bound of the bucket the q quantile falls in, max for the last one """
+
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(Histogram.BUCKETS[i], self.max) if i < len(Histogram.BUCKETS) else self.max
+
+        return self.max
+
+
+class Metrics:
+    """
+        Counters and latency histograms of the hot paths
+
+        socket reads and writes, decoding, turning dicts into messages,
+        adding them to views and redraws, so it's clear which one is slow.
+        Shown by /stats and, if the metrics_file setting is set, written
+        every metrics_interval seconds in the prometheus text format for
+        node_exporter's textfile collector to pick up
+    """
+
+    # counters
+    FRAMES_RECEIVED = 'frames_received'
+    BYTES_RECEIVED = 'bytes_received'
+    FRAMES_SENT = 'frames_sent'
+    BYTES_SENT = 'bytes_sent'
+    WRITES = 'writes'
+    MESSAGES_CONVERTED = 'messages_converted'
+    MESSAGES_ADDED = 'messages_added'
+
+    # histograms
+    READ_SERVER = 'read_server'
+    DECODE = 'decode'
+    CONVERT = 'convert'
+    ADD_MESSAGES = 'add_messages'
+    DRAW_SCREEN = 'draw_screen'
+    WRITE_SERVER = 'write_server'
+
+    COUNTERS = [FRAMES_RECEIVED, BYTES_RECEIVED, FRAMES_SENT, BYTES_SENT, WRITES, MESSAGES_CONVERTED, MESSAGES_ADDED]
+    HISTOGRAMS = [READ_SERVER, DECODE, CONVERT, ADD_MESSAGES, DRAW_SCREEN, WRITE_SERVER]
+
+    MESSAGE_COUNTERS = 'Counters: {counters}'
+    MESSAGE_COUNTER = '{name} {value}'
+    MESSAGE_HISTOGRAM = '{name}: {count} calls, mean {mean:.3f} ms, p50 <= {p50:.3f} ms, p99 <= {p99:.3f} ms, max {max:.3f} ms'
+    ERROR_EXPORT = 'Failed to write metrics to {path}, will keep trying: {error}'
+
+    PROMETHEUS_PREFIX = 'smscli_'
+    PROMETHEUS_TEMP_SUFFIX = '.tmp'
+
+    def __init__(self):
+        self.counters = collections.OrderedDict((name, 0) for name in Metrics.COUNTERS)
+        self.histograms = collections.OrderedDict((name, Histogram()) for name in Metrics.HISTOGRAMS)
+
+    def inc(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    def get_stats(self):
+        """ lines for /stats """
+
+        lines = [Metrics.MESSAGE_COUNTERS.format(counters=', '.join(
+            Metrics.MESSAGE_COUNTER.format(name=name, value=value) for name, value in self.counters.items()
+        ))]
+
+        for name, histogram in self.histograms.items():
+            if histogram.count:
+                lines.append(Metrics.MESSAGE_HISTOGRAM.format(
+                    name=name,
+                    count=histogram.count,
+                    mean=histogram.total / histogram.count * 1000,
+                    p50=histogram.quantile(0.5) * 1000,
+                    p99=histogram.quantile(0.99) * 1000,
+                    max=histogram.max * 1000
+                ))
+
+        return lines
+
+    def to_prometheus(self):
+        lines = []
+
+        for name, value in self.counters.items():
+            metric = Metrics.PROMETHEUS_PREFIX + name + '_total'
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+
+        for name, histogram in self.histograms.items():
+            metric = Metrics.PROMETHEUS_PREFIX + name + '_seconds'
+            lines.append('# TYPE {} histogram'.format(metric))
+
+            cumulative = 0
+            for bound, bucket_count in zip(Histogram.BUCKETS + ('+Inf',), histogram.bucket_counts):
+                cumulative += bucket_count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+
+            lines.append('{}_sum {}'.format(metric, histogram.total))
+            lines.append('{}_count {}'.format(metric, histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        """ write to a temp file and rename it over path, so a scrape never sees half a file """
+
+        temp_path = path + Metrics.PROMETHEUS_TEMP_SUFFIX
+        with open(temp_path, 'w') as metrics_file:
+            metrics_file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    async def export_loop(self, path, interval):
+        """ export every interval seconds, a failure (full disk, directory rotated away) is retried on the next one """
+
+        failing = False     # only the first failure of a run of them is logged
+
+        while True:
+            try:
+                self.export(path)
+                failing = False
+            except OSError as e:
+                if not failing:
+                    state.log_view.print_message(Metrics.ERROR_EXPORT.format(path=path, error=e.strerror))
+                failing = True
+
+            await asyncio.sleep(interval)
+
+
+class MainLoop(urwid.MainLoop):
+    """ urwid's main loop with its redraws timed """
+
+    def draw_screen(self):
+        start = time.perf_counter()
+        super().draw_screen()
+        state.metrics.observe(Metrics.DRAW_SCREEN, time.perf_counter() - start)
+
+
+class OutgoingQueue:
+    """
+        Sends outgoing messages in the background
+
+        every chunk gets a uid and a delivery state
+        (queued -> sent -> acked, or failed) shown in its view
+
+        pacing is driven by server acks: up to window chunks may
+        be unacked at once, the window grows with every ack and
+        halves when an ack times out. Whatever fits in the window
+        is written together, one write for the lot. Acks are on if the
+        server's handshake lists them, otherwise once it acks anything anyway.
+        Until then the window stays at one and we fall back to pausing
+        WRITE_PAUSE_TIME between chunks, an ack after the pause still counts
+    """
+
+    MAX_WINDOW = 8
+    ACK_TIMEOUT = 10
+
+    def __init__(self, connection_handler):
+        self.connection_handler = connection_handler
+        self.queue = collections.deque()
+        self.in_flight = collections.OrderedDict()     # uid -> (ViewMessage, ack timeout handle)
+        self.next_uid = 0
+        self.window = 1
+        self.acks_supported = False
+        self.late_acks = {}     # uid -> (ViewMessage, expiry handle), paused past but may still be acked
+
+        self.wakeup = None
+        self.task = None
+
+    def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = state.event_loop.create_task(self.send_loop())
+
+    def stop(self):
+        """ connection is gone, anything not yet acked can't be anymore """
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        for view_message, handle in self.in_flight.values():
+            if handle is not None:
+                handle.cancel()
+                view_message.set_delivery_state(ViewMessage.STATE_FAILED)
+        self.in_flight.clear()
+
+        # those went out, whether they made it we won't know
+        for _, handle in self.late_acks.values():
+            handle.cancel()
+        self.late_acks.clear()
+
+        while self.queue:
+            self.queue.popleft().set_delivery_state(ViewMessage.STATE_FAILED)
+
+        self.window = 1
+        self.acks_supported = False
+        state.render_scheduler.mark_dirty()
+
+    def put(self, view_messages):
+        for view_message in view_messages:
+            view_message.set_delivery_state(ViewMessage.STATE_QUEUED)
+            self.queue.append(view_message)
+
+        self.wakeup.set()
+
+    async def send_loop(self):
+        while True:
+            while not self.queue or len(self.in_flight) >= self.window:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+
+            # everything the window has room for goes out in one write
+            batch = []
+            while self.queue and len(self.in_flight) + len(batch) < self.window:
+                batch.append((str(self.next_uid), self.queue.popleft()))
+                self.next_uid += 1
+
+            if not await self.connection_handler.write_frames(
+                    [self.connection_handler.outgoing_dict(view_message, uid) for uid, view_message in batch]):
+                for _, view_message in batch:
+                    view_message.set_delivery_state(ViewMessage.STATE_FAILED)
+                state.render_scheduler.mark_dirty()
+                continue
+
+            for _, view_message in batch:
+                view_message.set_delivery_state(ViewMessage.STATE_SENT)
+            state.render_scheduler.mark_dirty()
+
+            if self.acks_supported:
+                for uid, view_message in batch:
+                    handle = state.event_loop.call_later(OutgoingQueue.ACK_TIMEOUT, self.ack_timeout, uid)
+                    self.in_flight[uid] = (view_message, handle)
+            else:
+                # the window is one until the first ack, so is the batch.
+                # an ack arriving during the pause ends it, and switches us over to ack pacing
+                uid, view_message = batch[0]
+                self.in_flight[uid] = (view_message, None)
+                deadline = time.monotonic() + ConnectionHandler.WRITE_PAUSE_TIME
+
+                while uid in self.in_flight and time.monotonic() < deadline:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), deadline - time.monotonic())
+                    except asyncio.TimeoutError:
+                        break
+
+                if self.in_flight.pop(uid, None) is not None:
+                    self.late_acks[uid] = (view_message, state.event_loop.call_later(
+                        OutgoingQueue.ACK_TIMEOUT, self.late_acks.pop, uid, None
+                    ))
+
+    def handle_ack(self, uid, ok, date=None):
+        """ date is when the server has the sms as sent, our copy is newer than any resync then """
+
+        entry = self.in_flight.pop(uid, None) or self.late_acks.pop(uid, None)
+        if entry is None:
+            return
+
+        view_message, handle = entry
+        if handle is not None:
+            handle.cancel()
+
+        self.acks_supported = True
+        if ok:
+            view_message.set_delivery_state(ViewMessage.STATE_ACKED)
+            self.window = min(self.window + 1, OutgoingQueue.MAX_WINDOW)
+            if date is not None:
+                state.message_store.update_sync_marks({view_message.related_view_id: date})
+        else:
+            view_message.set_delivery_state(ViewMessage.STATE_FAILED)
+
+        self.wakeup.set()
+        state.render_scheduler.mark_dirty()
+
+    def ack_timeout(self, uid):
+        entry = self.in_flight.pop(uid, None)
+        if entry is None:
+            return
+
+        entry[0].set_delivery_state(ViewMessage.STATE_FAILED)
+        self.window = max(1, self.window // 2)
+
+        self.wakeup.set()
+        state.render_scheduler.mark_dirty()
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """
+        Receives frames from the server straight into one reusable buffer
+
+        the event loop recv_into()s as much as the socket has into the
+        free end of the buffer, then every complete frame in it is handed
+        to on_frame as a memoryview of the buffer, no copies. Until the
+        read loop sets on_frame they are copied out and kept for
+        read_frame. What's left of a partial frame is moved to the front
+        when room is needed, the buffer only grows for a frame bigger than it
+
+        a memoryview given to on_frame is only good until it returns
+
+        writes go through an asyncio.StreamWriter on top of this, its
+        drain() waits on _drain_helper while the transport has paused writing
+    """
+
+    BUFFER_SIZE = 256 * 1024
+    MIN_FREE = 16 * 1024        # make room once less than this is free at the end
+
+    def __init__(self):
+        super().__init__()
+
+        self.buffer = bytearray(FrameProtocol.BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0      # first byte not parsed yet
+        self.end = 0        # end of what has been received
+
+        self.on_frame = None
+        self.frames = collections.deque()       # frames waiting for read_frame
+        self.frame_waiter = None
+        self.lost = asyncio.get_running_loop().create_future()
+
+        self.write_paused = False
+        self.drain_waiters = collections.deque()
+
+        self.transport = None
+        self.last_received = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if not self.lost.done():
+            self.lost.set_result(None)
+        if self.frame_waiter is not None and not self.frame_waiter.done():
+            self.frame_waiter.set_result(None)
+
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(exc or ConnectionResetError('Connection lost'))
+
+    def pause_writing(self):
+        self.write_paused = True
+
+    def resume_writing(self):
+        self.write_paused = False
+
+        for waiter in self.drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _drain_helper(self):
+        """ what StreamWriter.drain() awaits, returns once the transport takes writes again """
+
+        if self.lost.done():
+            raise ConnectionResetError('Connection lost')
+        if not self.write_paused:
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.drain_waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            self.drain_waiters.remove(waiter)
+
+    def _get_close_waiter(self, stream):
+        """ what StreamWriter.wait_closed() awaits """
+
+        return self.lost
+
+    def get_buffer(self, sizehint):
+        if len(self.buffer) - self.end < FrameProtocol.MIN_FREE:
+            self.make_room()
+
+        return self.view[self.end:]
+
+    def make_room(self):
+        """ move the partial frame to the front, into a bigger buffer if it won't fit this one """
+
+        pending = self.end - self.start
+        needed = pending + FrameProtocol.MIN_FREE
+        if pending >= ConnectionHandler.LEN_BYTE_SIZE:
+            length = int.from_bytes(self.view[self.start:self.start + ConnectionHandler.LEN_BYTE_SIZE],
+                                    ConnectionHandler.LEN_STRUCT_INT_TYPE)
+            needed = max(needed, ConnectionHandler.LEN_BYTE_SIZE + (length & ConnectionHandler.FRAME_LENGTH_MASK))
+
+        partial = bytes(self.view[self.start:self.end])
+        if needed > len(self.buffer):
+            self.buffer = bytearray(max(needed, 2 * len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+        self.buffer[:pending] = partial
+        self.start, self.end = 0, pending
+
+    def buffer_updated(self, nbytes):
+        start_time = time.perf_counter()
+        self.last_received = time.monotonic()
+
+        view = self.view
+        position = self.start
+        end = self.end = self.end + nbytes
+
+        frames = []
+        try:
+            while end - position >= ConnectionHandler.LEN_BYTE_SIZE:
+                length = int.from_bytes(view[position:position + ConnectionHandler.LEN_BYTE_SIZE],
+                                        ConnectionHandler.LEN_STRUCT_INT_TYPE)
+                frame_end = position + ConnectionHandler.LEN_BYTE_SIZE + (length & ConnectionHandler.FRAME_LENGTH_MASK)
+                if frame_end > end:
+                    break
+
+                payload = view[position + ConnectionHandler.LEN_BYTE_SIZE:frame_end]
+                if length & ConnectionHandler.FRAME_COMPRESSED_FLAG:
+                    payload = zlib.decompress(payload)
+
+                frames.append(payload)
+                position = frame_end
+        except zlib.error:
+            self.transport.abort()
+            return
+
+        # all parsed, the next read can start at the front again
+        if position == end:
+            position = end = 0
+        self.start, self.end = position, end
+
+        state.metrics.inc(Metrics.FRAMES_RECEIVED, len(frames))
+        state.metrics.inc(Metrics.BYTES_RECEIVED, nbytes)
+        state.metrics.observe(Metrics.READ_SERVER, time.perf_counter() - start_time)
+
+        for payload in frames:
+            if self.on_frame is not None:
+                self.on_frame(payload)
+            else:
+                self.frames.append(bytes(payload))
+
+        if frames and self.frame_waiter is not None and not self.frame_waiter.done():
+            self.frame_waiter.set_result(None)
+
+    async def read_frame(self):
+        """ the next frame, empty once the connection is lost """
+
+        while not self.frames and not self.lost.done():
+            self.frame_waiter = asyncio.get_running_loop().create_future()
+            await self.frame_waiter
+
+        return self.frames.popleft() if self.frames else b''
+
+
+class ConnectionHandler:
+    """
+        Handles all connection with the server
+
+        protocol with server:
+            communicate in messages
+            messages are JSON strings, or MessagePack if
+            negotiated, see JSONHelper for the codecs
+
+            messages can be sent either to or from
+            server/client at any message_time
+
+            initial data: large contact list with sms conversations
+                          encapsulated
+
+            messages after: sms messages belonging to a 
+                            conversation
+
+            outgoing messages carry a uid, servers that support
+            it answer each one with {"ack": uid, "ok": bool, "date"}
+                date is optional, the server side date of the sent sms so
+                resyncs don't send our own messages back to us
+
+            handshake (version 2 servers):
+                server sends {"handshake": {"version", "features", "contactsVersion"}}
+                client answers {"hello": {"version", "features", "contactsVersion", "since"}}
+                    since maps contact id -> date of the newest message we have from it
+                    contactsVersion is only sent if we still hold that contact list
+                server sends the full contact list if contactsVersion doesn't match,
+                then {"delta": {"contactsVersion", "contacts", "messages"}} with the
+                changed contacts and every message newer than since
+                messages from these servers carry a "date" in ms
+
+                older servers skip all of this and just send the contact list
+
+            compression:
+                if both sides list the zlib feature, every frame after the
+                hello may be zlib compressed, marked by FRAME_COMPRESSED_FLAG
+                in its length. small frames are left as they are
+
+            heartbeat:
+                if both sides list the heartbeat feature, either side may send
+                {"ping": n} and the other answers {"pong": n}. we ping whenever
+                the server has been quiet for heartbeat_interval and drop the
+                connection if nothing arrives within liveness_timeout.
+                without it we only have TCP keepalive to find dead peers
+
+            devices:
+                there is a ConnectionHandler per phone, see ConnectionManager.
+                contact ids are only unique on their own phone, so those of a
+                tagged device are prefixed with its name and DEVICE_SEPARATOR
+                here, and the prefix is taken off again for anything sent to it.
+                the phone never sees it
+
+            on connection: client reads initial data
+            write: send message length in bytes - size 4 bytes
+                   send data of size s
+            read:  read 4 bytes to get length len
+                   read len bytes
+    """
+
+    LEN_BYTE_SIZE = 4               # byte size of message length
+    LEN_STRUCT_FORMAT = '! i'       # format chars for struct holding message length
+    LEN_STRUCT_INT_TYPE = 'big'
+    TIMEOUT = 15
+
+    FRAME_COMPRESSED_FLAG = 0x40000000      # set in the length of compressed frames
+    FRAME_LENGTH_MASK = 0x3fffffff
+    COMPRESS_MIN_SIZE = 512                 # frames smaller than this aren't worth compressing
+    COMPRESS_LEVEL = 6
+
+    MIN_PORT = 1
+    MAX_PORT = 65535
+
+    PROTOCOL_VERSION = 2
+    FEATURE_DELTA = 'delta'
+    FEATURE_ACK = 'ack'
+    FEATURE_ZLIB = 'zlib'
+    FEATURE_HEARTBEAT = 'heartbeat'
+    CLIENT_FEATURES = [FEATURE_DELTA, FEATURE_ACK, FEATURE_ZLIB, FEATURE_HEARTBEAT]
+
+    # kernel side dead peer detection, for servers without heartbeats: probe after
+    # KEEPALIVE_IDLE quiet seconds, every KEEPALIVE_INTERVAL, give up after KEEPALIVE_COUNT
+    KEEPALIVE_IDLE = 10
+    KEEPALIVE_INTERVAL = 5
+    KEEPALIVE_COUNT = 3
+    USER_TIMEOUT_MS = 20000         # how long sent data may go unacknowledged before the kernel gives up
+
+    RECONNECT_BASE_DELAY = 1
+    RECONNECT_MAX_DELAY = 60
+
+    WRITE_PAUSE_TIME = 0.2
+    OUTPUT_BUFFER_LIMIT = 65536     # buffered output bytes that get written without waiting for a flush
+    CONTACT_BATCH_SIZE = 200        # contacts decoded between handing control back to the ui
+
+    ERROR_MESSAGE_TIMEOUT = 'Connection timed out'
+    ERROR_MESSAGE_REFUSED = 'Connection was refused'
+    ERROR_MESSAGE_INVALID = 'Invalid command argument'
+    ERROR_MESSAGE_GENERIC = 'Connection failed'
+    ERROR_MESSAGE_NO_DAEMON = 'No daemon is running'
+    ERROR_LOST_CONNECTION = 'Lost connection'
+    ERROR_NO_HEARTBEAT = 'Server stopped responding'
 
     MESSAGE_CONNECTING = 'Connecting to {ip}...'
     MESSAGE_ONCONNECT = 'Connected to {ip} on {port}'
+    MESSAGE_ONATTACH = 'Attached to the daemon at {path}'
+    MESSAGE_LOADING_CONTACTS = 'Loading contacts... {count}'
+    MESSAGE_LOADED_CONTACTS = 'Loaded {count} contacts'
+    MESSAGE_RESYNCED = 'Resynced {contacts} contacts and {messages} messages'
+    MESSAGE_RECONNECTING = 'Reconnecting in {delay:.1f}s'
 
     STATUS_CONNECTED = 'connected'
     STATUS_DISCONNECTED = 'disconnected'
+    STATUS_CONNECTING = 'connecting'
+    STATUS_RECONNECTING = 'reconnecting, attempt {attempt}'
 
-    def __init__(self):
+    DEVICE_SEPARATOR = ':'      # configparser doesn't allow it in alias names
+    DEVICE_MESSAGE = '{device}: {message}'
+
+    def __init__(self, device=''):
+        self.device = device
         self.connected = False
 
-    def setup_connection(self, ip_address, port):
+        self.protocol = None
+        self.writer = None
+        self.connect_task = None
+        self.read_task = None
+        self.heartbeat_task = None
+        self.outgoing_queue = OutgoingQueue(self)
+        self.server_features = set()
+        self.compression = False
+        self.codec = JSONCodec()
+
+        self.output = []                # headers and payloads not yet handed to the transport
+        self.output_size = 0
+        self.flush_scheduled = False
+
+        self.status = ConnectionHandler.STATUS_DISCONNECTED
+        self.auto_reconnect = False     # set once connected, cleared when the user disconnects
+        self.reconnect_attempt = 0
+        self.last_ping = 0
+        self.ping_count = 0
+
+    @staticmethod
+    def tag_id(device, contact_id):
+        """ the view id of a contact of device """
+        return device + ConnectionHandler.DEVICE_SEPARATOR + contact_id if device else contact_id
+
+    @staticmethod
+    def get_device(view_id):
+        """ the device a view id was tagged with, '' if untagged """
+
+        device, separator, _ = view_id.partition(ConnectionHandler.DEVICE_SEPARATOR)
+        return device if separator else ''
+
+    def local_id(self, contact_id):
+        return ConnectionHandler.tag_id(self.device, contact_id)
+
+    def remote_id(self, view_id):
+        """ the contact id the phone knows view_id by """
+        return view_id[len(self.device) + len(ConnectionHandler.DEVICE_SEPARATOR):] if self.device else view_id
+
+    def log(self, message):
+        """ print to the log view, naming the device if it's tagged """
+        state.log_view.print_message(ConnectionHandler.DEVICE_MESSAGE.format(device=self.device, message=message)
+                                     if self.device else message)
+
+    def log_progress(self, message):
+        state.log_view.print_progress(ConnectionHandler.DEVICE_MESSAGE.format(device=self.device, message=message)
+                                      if self.device else message)
+
+    def start_connection(self, ip_address, port):
+        """
+            schedules setup_connection on the event loop
+            so the ui keeps running while we connect,
+            a pending reconnect is replaced by this
+        """
+
+        if self.connect_task is not None and not self.connect_task.done():
+            if self.reconnect_attempt == 0:
+                return
+            self.connect_task.cancel()
+
+        self.reconnect_attempt = 0
+        self.connect_task = state.event_loop.create_task(self.setup_connection(ip_address, port))
+
+    def set_status(self, status):
+        self.status = status
+        state.main_window.refresh_status()
+        state.render_scheduler.mark_dirty()
+
+    async def setup_connection(self, ip_address, port):
         """
             connects to server, reads initial data
-            starts up read loop thread
+            starts up read loop task
         """
 
-        self.connect(ip_address, port)
+        self.set_status(ConnectionHandler.STATUS_CONNECTING)
+        await self.connect(ip_address, port)
+
+        if not self.connected:
+            self.set_status(ConnectionHandler.STATUS_DISCONNECTED)
+        else:
+            ConnectionHandler.set_keepalive(self.writer)
+            self.outgoing_queue.start()
+
+            self.log(ConnectionHandler.MESSAGE_CONNECTING.format(ip=self.ip_address))
+            state.render_scheduler.mark_dirty()
+
+            self.server_features = set()
+            self.compression = False
+            self.codec = JSONHelper.get_json_codec(state.config_handler.get_setting('codec'))
+            full_dump, delta = False, None
+
+            await state.contact_snapshot.wait_restored()
+            initial_data = await self.read_server()
+            if initial_data and self.codec.is_frame(initial_data, JSONHelper.JSON_HANDSHAKE_KEY):
+                full_dump, delta = await self.handshake(initial_data)
+            elif initial_data:
+                await self.ingest_contacts(initial_data)
+                full_dump = True
+
+            if not initial_data or not self.connected:
+                # the server hung up before we were set up, read_server has said so
+                self.close_connection()
+                return
+
+            self.outgoing_queue.acks_supported = ConnectionHandler.FEATURE_ACK in self.server_features
 
-        if self.connected:
-            state.log_view.print_message(ConnectionHandler.MESSAGE_CONNECTING.format(ip=self.ip_address))
-            state.main_loop.draw_screen()     # gets blocked by connection stuff otherwise
+            self.read_task = state.event_loop.create_task(self.read_loop())
+            if ConnectionHandler.FEATURE_HEARTBEAT in self.server_features:
+                self.heartbeat_task = state.event_loop.create_task(self.heartbeat_loop())
 
-            initial_data = self.read_server()
-            JSONHelper.setup_contact_views(initial_data)        # TODO: have this return
+            self.auto_reconnect = state.config_handler.get_setting('reconnect', ConfigHandler.to_bool)
+            self.reconnect_attempt = 0
+            self.set_status(ConnectionHandler.STATUS_CONNECTED)
 
-            self.read_looper = threading.Thread(target=self.read_loop)
-            self.read_looper.start()
+            if full_dump:
+                # ensure this phone's views are closed so we don't have out of date views on reconnects
+                state.main_window.close_device_views(self.device)
 
-            # ensure all views except log are closed so we don't have out of date views on reconnects
-            state.main_window.init_views(state.log_view)
-            state.main_window.refresh_divider()
+            if delta is not None:
+                self.apply_delta(delta)
 
-            state.log_view.print_message(ConnectionHandler.MESSAGE_ONCONNECT.format(ip=self.ip_address, port=self.port))
+            if full_dump:
+                self.save_contacts()
 
-    def connect(self, ip_address, port):
-        if ConnectionHandler.is_valid_ipv4_address(ip_address) and ConnectionHandler.is_valid_port(port):
+            if self.port is None:
+                self.log(ConnectionHandler.MESSAGE_ONATTACH.format(path=self.ip_address))
+            else:
+                self.log(ConnectionHandler.MESSAGE_ONCONNECT.format(ip=self.ip_address, port=self.port))
+            state.render_scheduler.mark_dirty()
+
+    async def connect(self, ip_address, port):
+        """ port None means ip_address is the unix socket of a daemon """
+
+        if port is None or (ConnectionHandler.is_valid_ipv4_address(ip_address) and ConnectionHandler.is_valid_port(port)):
             self.ip_address = ip_address
             self.port = port
 
+            loop = asyncio.get_running_loop()
+
             try:
+                transport, self.protocol = await asyncio.wait_for(
+                    loop.create_connection(FrameProtocol, ip_address, int(port)) if port is not None
+                    else loop.create_unix_connection(FrameProtocol, ip_address),
+                    ConnectionHandler.TIMEOUT
+                )
+                self.writer = asyncio.StreamWriter(transport, self.protocol, None, loop)
+                self.output = []
+                self.output_size = 0
+                self.connected = True
+            except asyncio.TimeoutError:
+                self.log(ConnectionHandler.ERROR_MESSAGE_TIMEOUT)
+                self.connected = False
+            except socket.error as e:
+                if e.errno == socket.errno.ETIMEDOUT:
+                    error_message = ConnectionHandler.ERROR_MESSAGE_TIMEOUT
+                elif e.errno == socket.errno.ECONNREFUSED:
+                    error_message = ConnectionHandler.ERROR_MESSAGE_REFUSED
+                elif e.errno == socket.errno.ENOENT:
+                    error_message = ConnectionHandler.ERROR_MESSAGE_NO_DAEMON
+                else:
+                    # unreachable networks and such, common while the phone is changing networks
+                    error_message = ConnectionHandler.ERROR_MESSAGE_GENERIC
+
+                self.log(error_message)
+                self.connected = False
+        else:
+            self.log(ConnectionHandler.ERROR_MESSAGE_INVALID)
+            self.connected = False
+
+    async def handshake(self, handshake_data):
+        """
+            negotiate with a version 2 server and ask for only what changed
+            returns (whether a full contact list was sent, the delta)
+        """
+
+        handshake = self.codec.decode(handshake_data)[JSONHelper.JSON_HANDSHAKE_KEY]
+        self.server_features = set(handshake.get(JSONHelper.JSON_FEATURES_KEY, []))
+
+        hello = {
+            JSONHelper.JSON_VERSION_KEY: ConnectionHandler.PROTOCOL_VERSION,
+            JSONHelper.JSON_FEATURES_KEY: ConnectionHandler.get_client_features()
+        }
+
+        if ConnectionHandler.FEATURE_DELTA in self.server_features:
+            hello[JSONHelper.JSON_SINCE_KEY] = self.get_sync_marks()
+
+            # contacts we no longer hold can't be resynced, let the server send them all
+            if any(contact_view.device == self.device for contact_view in state.contact_views.values()):
+                hello[JSONHelper.JSON_CONTACTS_VERSION_KEY] = \
+                    state.message_store.get_sync_value(self.local_id(JSONHelper.JSON_CONTACTS_VERSION_KEY))
+
+        await self.write_frame({JSONHelper.JSON_HELLO_KEY: hello})
+
+        # everything after the hello may be compressed and in the negotiated codec
+        self.compression = ConnectionHandler.FEATURE_ZLIB in self.server_features
+        if MsgpackCodec.NAME in self.server_features and MsgpackCodec.is_available() and \
+                state.config_handler.get_setting('codec') in (JSONHelper.CODEC_AUTO, MsgpackCodec.NAME):
+            self.codec = MsgpackCodec()
+
+        full_dump = False
+        frame = await self.read_server()
+        if frame and not self.codec.is_frame(frame, JSONHelper.JSON_DELTA_KEY):
+            await self.ingest_contacts(frame)
+            full_dump = True
+            frame = await self.read_server()
+
+        if not frame:
+            return full_dump, None
+
+        return full_dump, self.codec.decode(frame)[JSONHelper.JSON_DELTA_KEY]
+
+    def save_contacts(self):
+        """ snapshot this phone's contacts and their version, for the next startup """
+
+        state.contact_snapshot.save(
+            self.device,
+            state.message_store.get_sync_value(self.local_id(JSONHelper.JSON_CONTACTS_VERSION_KEY)),
+            [contact_view for contact_view in state.contact_views.values() if contact_view.device == self.device]
+        )
+
+    def get_sync_marks(self):
+        """ the high water marks of this phone's contacts, by the ids it knows them by """
+
+        return {self.remote_id(view_id): date for view_id, date in state.message_store.get_sync_marks().items()
+                if ConnectionHandler.get_device(view_id) == self.device}
+
+    def apply_delta(self, delta):
+        """ merge changed contacts and catch up on missed messages, open views are kept """
+
+        contact_view_dicts = delta.get(JSONHelper.JSON_CONTACTS_KEY, {})
+        changed_views = []
+        history_end_id = state.message_store.get_last_message_id()
+
+        for view_id, contact_view_dict in contact_view_dicts.items():
+            view_id = self.local_id(view_id)
+
+            if view_id in state.contact_views:
+                contact_view = state.contact_views[view_id]
+                contact_view.rename(contact_view_dict[JSONHelper.JSON_CONTACT_DISPLAY_KEY])
+                contact_view.address = contact_view_dict[JSONHelper.JSON_CONTACT_PHONE_KEY]
+            else:
+                contact_view = JSONHelper.dict_to_contact_view(contact_view_dict, self.device, history_end_id)
+                state.contact_views[view_id] = contact_view
+
+            changed_views.append(contact_view)
+
+        state.contact_index.add_contacts(changed_views)
+        state.message_store.add_contacts(changed_views)
+
+        if JSONHelper.JSON_CONTACTS_VERSION_KEY in delta:
+            state.message_store.set_sync_value(
+                self.local_id(JSONHelper.JSON_CONTACTS_VERSION_KEY),
+                delta[JSONHelper.JSON_CONTACTS_VERSION_KEY]
+            )
+
+        if changed_views:
+            self.save_contacts()
+
+        messages = delta.get(JSONHelper.JSON_MESSAGES_KEY, [])
+        if messages:
+            self.receive_messages(messages, live=False)
+
+        state.main_window.refresh_divider()
+        self.log(ConnectionHandler.MESSAGE_RESYNCED.format(
+            contacts=len(changed_views),
+            messages=len(messages)
+        ))
+
+    async def ingest_contacts(self, contacts_data):
+        """
+            decode the initial contact dump a batch at a time,
+            contacts become usable as soon as they are decoded
+            and the ui gets to run between batches
+        """
+
+        count = 0
+        batch = []
+        view_ids = set()
+        history_end_id = state.message_store.get_last_message_id()
+        for view_id, contact_view_dict in self.codec.iter_items(contacts_data):
+            contact_view = JSONHelper.dict_to_contact_view(contact_view_dict, self.device, history_end_id)
+            state.contact_views[contact_view.view_id] = contact_view
+            view_ids.add(contact_view.view_id)
+            batch.append(contact_view)
+            count += 1
+
+            if count % ConnectionHandler.CONTACT_BATCH_SIZE == 0:
+                state.contact_index.add_contacts(batch)
+                state.message_store.add_contacts(batch)
+                batch = []
+
+                self.log_progress(ConnectionHandler.MESSAGE_LOADING_CONTACTS.format(count=count))
+                state.render_scheduler.mark_dirty()
+                await asyncio.sleep(0)
+
+        state.contact_index.add_contacts(batch)
+        state.message_store.add_contacts(batch)
+        self.log(ConnectionHandler.MESSAGE_LOADED_CONTACTS.format(count=count))
+
+        # restored contacts the phone doesn't have anymore
+        for view_id in state.contact_snapshot.restored.pop(self.device, set()) - view_ids:
+            state.contact_views.pop(view_id, None)
+            state.contact_index.remove(view_id)
+
+    @staticmethod
+    def set_keepalive(writer):
+        """ have the kernel probe a TCP connection, options it doesn't know are skipped """
+
+        sock = writer.get_extra_info('socket')
+        if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (('TCP_KEEPIDLE', ConnectionHandler.KEEPALIVE_IDLE),
+                              ('TCP_KEEPINTVL', ConnectionHandler.KEEPALIVE_INTERVAL),
+                              ('TCP_KEEPCNT', ConnectionHandler.KEEPALIVE_COUNT),
+                              ('TCP_USER_TIMEOUT', ConnectionHandler.USER_TIMEOUT_MS)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+    def disconnect(self):
+        """ closes the connection, the read loop will notice and finish up, stops any reconnecting """
+
+        self.auto_reconnect = False
+        if self.reconnect_attempt and self.connect_task is not None:
+            self.connect_task.cancel()
+            self.reconnect_attempt = 0
+            self.set_status(ConnectionHandler.STATUS_DISCONNECTED)
+
+        self.connected = False
+        if self.writer is not None:
+            self.flush_output()
+            self.writer.close()
+
+    def drop_connection(self, reason):
+        """ the server is gone without closing the connection, abort it rather than wait on a flush """
+
+        self.log(reason)
+        self.connected = False
+        self.writer.transport.abort()
+
+    async def heartbeat_loop(self):
+        """ ping the server when it goes quiet, drop the connection once it misses the liveness deadline """
+
+        interval = state.config_handler.get_setting('heartbeat_interval', float)
+        deadline = state.config_handler.get_setting('liveness_timeout', float)
+
+        while self.connected:
+            now = time.monotonic()
+            idle = now - self.protocol.last_received
+
+            if idle >= deadline:
+                self.drop_connection(ConnectionHandler.ERROR_NO_HEARTBEAT)
+                break
+
+            if idle >= interval and now - self.last_ping >= interval:
+                self.last_ping = now
+                self.ping_count += 1
+                await self.write_frame({JSONHelper.JSON_PING_KEY: self.ping_count})
+
+            await asyncio.sleep(min(interval, deadline - idle))
+
+    async def reconnect(self):
+        """ keep trying the last server, backing off exponentially with jitter so clients don't retry in step """
+
+        while self.auto_reconnect and not self.connected:
+            self.reconnect_attempt += 1
+            self.set_status(ConnectionHandler.STATUS_RECONNECTING.format(attempt=self.reconnect_attempt))
+
+            delay = ConnectionHandler.get_reconnect_delay(self.reconnect_attempt)
+            self.log(ConnectionHandler.MESSAGE_RECONNECTING.format(delay=delay))
+            state.render_scheduler.mark_dirty()
+
+            await asyncio.sleep(delay)
+            await self.setup_connection(self.ip_address, self.port)
+
+    async def read_server(self):
+        """ waits for the next frame from the server, returns its payload, empty if the connection was lost """
+
+        message = await self.protocol.read_frame()
+
+        if not message:
+            self.log(ConnectionHandler.ERROR_LOST_CONNECTION)
+            self.connected = False
+
+        return message
+
+    def buffer_frame(self, data):
+        """
+            add a frame payload to the output buffer, header first
+
+            we use the struct module to correctly send
+            the integer size, using network byte order.
+            nothing is written until flush_output, unless
+            the buffer is past OUTPUT_BUFFER_LIMIT
+        """
+
+        length = len(data)
+
+        if self.compression and length >= ConnectionHandler.COMPRESS_MIN_SIZE:
+            data = zlib.compress(data, ConnectionHandler.COMPRESS_LEVEL)
+            length = len(data) | ConnectionHandler.FRAME_COMPRESSED_FLAG
+
+        self.output.append(struct.pack(ConnectionHandler.LEN_STRUCT_FORMAT, length))
+        self.output.append(data)
+        self.output_size += ConnectionHandler.LEN_BYTE_SIZE + len(data)
+
+        state.metrics.inc(Metrics.FRAMES_SENT)
+        state.metrics.inc(Metrics.BYTES_SENT, ConnectionHandler.LEN_BYTE_SIZE + len(data))
+
+        if self.output_size >= ConnectionHandler.OUTPUT_BUFFER_LIMIT:
+            self.flush_output()
+
+    def flush_output(self):
+        """
+            hand everything buffered to the transport in one gather write,
+            a single sendmsg() on python 3.12+ and one joined send() before that
+            instead of a send() per header and per payload
+        """
+
+        self.flush_scheduled = False
+        if not self.output:
+            return
+
+        if self.writer is None or self.writer.is_closing():
+            # the connection is going, this never gets out and whoever wrote it has to hear so
+            self.connected = False
+        else:
+            self.writer.writelines(self.output)
+            state.metrics.inc(Metrics.WRITES)
+
+        self.output = []
+        self.output_size = 0
+
+    def queue_frame(self, obj):
+        """ write obj without waiting on it, it goes out with whatever else is written this loop iteration """
+
+        self.buffer_frame(self.codec.encode(obj))
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            state.event_loop.call_soon(self.flush_output)
+
+    async def write_server(self, *payloads):
+        """ write frame payloads to the server, together in as few writes as the output buffer allows """
+
+        start = time.perf_counter()
+
+        try:
+            for data in payloads:
+                self.buffer_frame(data)
+            self.flush_output()
+            if self.connected:
+                await self.writer.drain()
+        except socket.error:
+            self.log(ConnectionHandler.ERROR_LOST_CONNECTION)
+            self.connected = False
+
+        state.metrics.observe(Metrics.WRITE_SERVER, time.perf_counter() - start)
+
+        return self.connected
+
+    async def write_frame(self, obj):
+        """ encode obj with the current codec and write it """
+        return await self.write_server(self.codec.encode(obj))
+
+    async def write_frames(self, objs):
+        """ encode every obj with the current codec and write them in one go """
+        return await self.write_server(*[self.codec.encode(obj) for obj in objs])
+
+    async def read_loop(self):
+        """ handles frames as the protocol parses them, until the connection is lost """
+
+        # anything that came in along with the initial data first
+        while self.protocol.frames:
+            self.handle_frame(self.protocol.frames.popleft())
+
+        self.protocol.on_frame = self.handle_frame
+        await self.protocol.lost
+        self.protocol.on_frame = None
+
+        self.log(ConnectionHandler.ERROR_LOST_CONNECTION)
+        self.close_connection()
+
+    def close_connection(self):
+        """ clean up after a lost connection, and start reconnecting unless we're doing that already """
+
+        self.connected = False
+
+        self.writer.close()
+        self.outgoing_queue.stop()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+
+        self.set_status(ConnectionHandler.STATUS_DISCONNECTED)
+
+        if self.auto_reconnect and not self.reconnect_attempt:
+            self.connect_task = state.event_loop.create_task(self.reconnect())
+
+    def handle_frame(self, frame):
+        """ dispatch a frame from the server, either an ack or a sms message """
+
+        start = time.perf_counter()
+        frame_dict = self.codec.decode(frame)
+        state.metrics.observe(Metrics.DECODE, time.perf_counter() - start)
+
+        if JSONHelper.JSON_ACK_KEY in frame_dict:
+            self.outgoing_queue.handle_ack(
+                frame_dict[JSONHelper.JSON_ACK_KEY],
+                frame_dict.get(JSONHelper.JSON_ACK_OK_KEY, True),
+                frame_dict.get(JSONHelper.JSON_MESSAGE_DATE_KEY)
+            )
+        elif JSONHelper.JSON_PING_KEY in frame_dict:
+            self.queue_frame({JSONHelper.JSON_PONG_KEY: frame_dict[JSONHelper.JSON_PING_KEY]})
+        elif JSONHelper.JSON_PONG_KEY in frame_dict:
+            pass        # being received is all a pong is for
+        elif JSONHelper.JSON_DELTA_KEY in frame_dict:
+            # contacts changed while we were connected, daemons push these
+            self.apply_delta(frame_dict[JSONHelper.JSON_DELTA_KEY])
+        else:
+            self.receive_message(frame_dict)
+
+    def receive_message(self, view_message_dict):
+        self.receive_messages([view_message_dict])
+
+    def receive_messages(self, view_message_dicts, live=True):
+        """
+            take in a batch of messages from the server, they are stored in one
+            transaction and queued to each contact's view with one call, so a
+            sync of thousands costs about as much as a handful
+
+            live messages open their contact's view and only the newest incoming
+            message of each contact is notified, messages caught up on by a resync
+            are only added, like the history of a contact dump
+        """
+
+        if self.device:
+            for view_message_dict in view_message_dicts:
+                view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY] = self.local_id(view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY])
+
+        view_messages = JSONHelper.dicts_to_view_messages(view_message_dicts)
+
+        contact_messages = collections.OrderedDict()     # view_id -> [ViewMessage], in arrival order
+        for view_message in view_messages:
+            contact_messages.setdefault(view_message.related_view_id, []).append(view_message)
+
+        # make new contacts for any not known
+        new_views = [ContactView(view_id, self.remote_id(view_id), self.remote_id(view_id), [], self.device)
+                     for view_id in contact_messages if view_id not in state.contact_views]
+        if new_views:
+            for contact_view in new_views:
+                state.contact_views[contact_view.view_id] = contact_view
+            state.contact_index.add_contacts(new_views)
+            state.message_store.add_contacts(new_views)
+
+        state.message_store.add_messages(view_messages)
+
+        sync_marks = {}
+        for view_message_dict in view_message_dicts:
+            if JSONHelper.JSON_MESSAGE_DATE_KEY in view_message_dict:
+                view_id = view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]
+                sync_marks[view_id] = max(sync_marks.get(view_id, 0), view_message_dict[JSONHelper.JSON_MESSAGE_DATE_KEY])
+        if sync_marks:
+            state.message_store.update_sync_marks(sync_marks)
+
+        for view_id, view_messages in contact_messages.items():
+            contact_view = state.contact_views[view_id]
+            state.render_scheduler.queue_messages(contact_view, view_messages, live)
+
+            if not live:
+                continue
+
+            if view_id not in state.main_window.shown_views:
+                state.main_window.add_new_view(contact_view)
+
+            incoming = [view_message for view_message in view_messages if view_message.message_type == ViewMessage.TYPE_INCOMING]
+            if incoming:
+                state.notifier.notify(contact_view.display_name, incoming[-1].body)
+
+    def outgoing_dict(self, view_message, uid):
+        """ view_message as the phone knows it, by its own contact id """
+
+        view_message_dict = JSONHelper.view_message_to_dict(view_message, uid)
+        view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY] = self.remote_id(view_message.related_view_id)
+
+        return view_message_dict
+
+    def send_message(self, message):
+        """
+            create a ViewMessage given message  body and current view then send and add to view
+        """
+
+        if len(message) > MAX_MESSAGE_LEN:
+            # break message into MAX_MESSAGE_LEN chunks
+            message_chunk = [message[i:i+MAX_MESSAGE_LEN] for i in range(0, len(message), MAX_MESSAGE_LEN)]
+        else:
+            message_chunk = [message]
+
+        # convert each message string chunk into a view message
+        view_message_chunk = [ViewMessage(datetime.datetime.now().time().strftime(ViewMessage.TIME_FORMAT_STR),
+                                          message, state.main_window.current_view, ViewMessage.USER_DISPLAY_NAME,
+                                          ViewMessage.TYPE_OUTGOING)
+                              for message in message_chunk]
+
+        # chunks are written in the background
+        self.outgoing_queue.put(view_message_chunk)
+        state.message_store.add_messages(view_message_chunk)
+
+        # finally add them to the current view, through the scheduler so they stay behind any pending incoming ones
+        state.render_scheduler.queue_messages(state.main_window.shown_views[state.main_window.current_view], view_message_chunk)
+        state.main_window.clear_input()
+
+    @staticmethod
+    def get_client_features():
+        """ CLIENT_FEATURES plus the binary codecs we have installed """
+
+        features = list(ConnectionHandler.CLIENT_FEATURES)
+        if MsgpackCodec.is_available():
+            features.append(MsgpackCodec.NAME)
+
+        return features
+
+    @staticmethod
+    def get_reconnect_delay(attempt):
+        """ exponential backoff, jittered so clients that dropped together don't retry together """
+
+        delay = min(ConnectionHandler.RECONNECT_MAX_DELAY, ConnectionHandler.RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    @staticmethod
+    def is_valid_ipv4_address(ip_address):
+        try:
+            socket.inet_aton(ip_address)
+        except socket.error:
+            return False
+
+        # though this is not technically needed for a valid ip we will impose it anyway
+        return ip_address.count('.') == 3
+
+    @staticmethod
+    def is_valid_port(port):
+        try:
+            port = int(port)
+
+            if ConnectionHandler.MIN_PORT <= port <= ConnectionHandler.MAX_PORT:
+                return True
+            else:
+                return False
+        except ValueError:
+            return False
+
+
+class ConnectionManager:
+    """
+        The connections to every phone, a ConnectionHandler each
+
+        they all share the one event loop, a phone costs a socket and a
+        few tasks. A phone connected to by alias is a device named after
+        the alias, and its contacts are tagged with it. One connected to by
+        address, or the daemon, is the untagged device. Sends go to the
+        device the conversation's contact came from
+    """
+
+    STATUS_DEVICE = '{device} {status}'
+    STATUS_SEPARATOR = ', '
+    UNTAGGED_NAME = 'phone'     # what the untagged device is called in the status bar
+
+    def __init__(self):
+        self.handlers = collections.OrderedDict()      # device -> ConnectionHandler, in the order they were connected
+
+    def get(self, device=''):
+        if device not in self.handlers:
+            self.handlers[device] = ConnectionHandler(device)
+        return self.handlers[device]
+
+    def start_connection(self, ip_address, port, device=''):
+        self.get(device).start_connection(ip_address, port)
+
+    def is_connected(self, device=None):
+        """ whether device is connected, or any of them for None """
+
+        if device is None:
+            return any(connection_handler.connected for connection_handler in self.handlers.values())
+        return device in self.handlers and self.handlers[device].connected
+
+    def get_default_device(self):
+        """ the device new conversations go to, the first connected """
+        return next((device for device, connection_handler in self.handlers.items() if connection_handler.connected), '')
+
+    def for_view(self, view_id):
+        """ the connected ConnectionHandler of the contact view_id, None if there isn't one """
+
+        contact_view = state.contact_views.get(view_id)
+        if contact_view is None:
+            return None
+
+        connection_handler = self.handlers.get(contact_view.device)
+        return connection_handler if connection_handler is not None and connection_handler.connected else None
+
+    def disconnect(self, devices=None):
+        """ disconnect devices, all of them for None, they are forgotten until connected again """
+
+        for device in list(self.handlers) if devices is None else devices:
+            connection_handler = self.handlers.pop(device, None)
+            if connection_handler is not None:
+                connection_handler.disconnect()
+
+        state.main_window.refresh_status()
+        state.render_scheduler.mark_dirty()
+
+    def get_status(self):
+        """ the untagged device's status when it's the only one, otherwise every device's by name """
+
+        if not self.handlers:
+            return ConnectionHandler.STATUS_DISCONNECTED
+        if list(self.handlers) == ['']:
+            return self.handlers[''].status
+
+        return ConnectionManager.STATUS_SEPARATOR.join(
+            ConnectionManager.STATUS_DEVICE.format(device=device or ConnectionManager.UNTAGGED_NAME,
+                                                   status=connection_handler.status)
+            for device, connection_handler in self.handlers.items()
+        )
+
+
+class LibnotifyBackend:
+    """ Desktop notifications through libnotify, gi is only imported once the first one is shown """
+
+    NAME = 'libnotify'
+    APP_NAME = 'smscli'
+    NOTIFY_VERSION = '0.7'
+
+    def __init__(self):
+        import gi
+        gi.require_version('Notify', LibnotifyBackend.NOTIFY_VERSION)
+        from gi.repository import Notify
+
+        if not Notify.init(LibnotifyBackend.APP_NAME):
+            raise ImportError(LibnotifyBackend.NAME)
+        self.notify = Notify
+
+    @staticmethod
+    def is_available():
+        # without importing it, that's the expensive part
+        return importlib.util.find_spec('gi') is not None
+
+    def show(self, title, body):
+        self.notify.Notification.new(title, body).show()
+
+
+class BellBackend:
+    """ Rings the terminal bell """
+
+    NAME = 'bell'
+    BELL = '\a'
+
+    @staticmethod
+    def is_available():
+        return sys.stdout.isatty()
+
+    def show(self, title, body):
+        # the screen writes escape sequences from the event loop, the bell goes out between them, not in the middle of one
+        state.event_loop.call_soon_threadsafe(BellBackend.ring)
+
+    @staticmethod
+    def ring():
+        state.main_loop.screen.write(BellBackend.BELL)
+        state.main_loop.screen.flush()
+
+
+class NullBackend:
+    """ Notifications turned off """
+
+    NAME = 'none'
+
+    @staticmethod
+    def is_available():
+        return True
+
+    def show(self, title, body):
+        pass
+
+
+class Notifier:
+    """
+        Shows notifications of incoming sms on a worker thread
+
+        notify only queues, so a slow backend never holds up reading from
+        the server. Everything that arrives within window seconds of the
+        first message is shown together, one notification per burst
+        ("5 new messages from X"), and no more than one every min_interval
+        seconds, whatever comes in between is folded into the next one
+
+        the backend is picked by the notifications setting and only
+        loaded when the first notification is due, auto takes the
+        first one that works in BACKENDS order
+    """
+
+    BACKENDS = [LibnotifyBackend, BellBackend, NullBackend]
+    AUTO = 'auto'
+    STOP = None
+
+    MESSAGE_COALESCED = '{count} new messages from {title}'
+    SUMMARY_TITLE = '{count} new messages'
+    SUMMARY_BODY = 'from {titles}'
+    SUMMARY_OTHERS = '{titles} and {count} more'
+    SUMMARY_MAX_TITLES = 3
+
+    ERROR_BACKEND = 'Notifications through {name} are unavailable, turning them off'
+    ERROR_SHOW = 'Failed to show notification, turning them off: {error}'
+
+    def __init__(self):
+        self.preferred = Notifier.AUTO
+        self.window = 0
+        self.min_interval = 0
+
+        self.backend = None
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.last_shown = 0
+
+    def configure(self, preferred, window, min_interval):
+        self.preferred = preferred
+        self.window = window
+        self.min_interval = min_interval
+        self.backend = None
+
+    def notify(self, title, body):
+        """ called from the event loop, never blocks """
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='notifier', daemon=True)
+            self.thread.start()
+
+        self.queue.put((title, body))
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(Notifier.STOP)
+            self.thread = None
+
+    @staticmethod
+    def log(message):
+        # widgets belong to the event loop thread
+        state.event_loop.call_soon_threadsafe(state.log_view.print_message, message)
+
+    def load_backend(self):
+        for backend_class in Notifier.BACKENDS:
+            if self.preferred in (Notifier.AUTO, backend_class.NAME) and backend_class.is_available():
+                try:
+                    return backend_class()
+                except (ImportError, ValueError):
+                    pass        # gi without libnotify and such
+
+        if self.preferred != Notifier.AUTO:
+            Notifier.log(Notifier.ERROR_BACKEND.format(name=self.preferred))
+        return NullBackend()
+
+    def run(self):
+        pending = collections.OrderedDict()       # title -> (message count, latest body)
+        deadline = None
+
+        while True:
+            try:
+                item = self.queue.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+
+            if item is Notifier.STOP:
+                return
+
+            if item:
+                title, body = item
+                pending[title] = (pending[title][0] + 1 if title in pending else 1, body)
+
+                if deadline is None:
+                    deadline = max(time.monotonic() + self.window, self.last_shown + self.min_interval)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                self.show(pending)
+                self.last_shown = time.monotonic()
+                pending.clear()
+                deadline = None
+
+    def show(self, pending):
+        """ everything pending as one notification """
+
+        if len(pending) == 1:
+            title, (count, body) = next(iter(pending.items()))
+            if count > 1:
+                body = Notifier.MESSAGE_COALESCED.format(count=count, title=title)
+        else:
+            titles = list(pending)
+            shown_titles = ', '.join(titles[:Notifier.SUMMARY_MAX_TITLES])
+            if len(titles) > Notifier.SUMMARY_MAX_TITLES:
+                shown_titles = Notifier.SUMMARY_OTHERS.format(titles=shown_titles,
+                                                              count=len(titles) - Notifier.SUMMARY_MAX_TITLES)
+
+            title = Notifier.SUMMARY_TITLE.format(count=sum(count for count, _ in pending.values()))
+            body = Notifier.SUMMARY_BODY.format(titles=shown_titles)
+
+        if self.backend is None:
+            self.backend = self.load_backend()
+
+        try:
+            self.backend.show(title, body)
+        except Exception as e:      # whatever the backend raises, the thread has to keep draining the queue
+            Notifier.log(Notifier.ERROR_SHOW.format(error=e))
+            self.backend = NullBackend()
+
+
+class StartupProfiler:
+    """ Times the steps of startup for --profile-startup """
+
+    REPORT_LINE = '  {name:32} {ms:8.1f} ms'
+    REPORT_TOTAL = 'total'
+
+    def __init__(self):
+        self.steps = [('imports', IMPORT_END - IMPORT_START)]
+        self.last = time.perf_counter()
+
+    def mark(self, name):
+        """ the step called name just finished """
+
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        lines = [StartupProfiler.REPORT_LINE.format(name=name, ms=seconds * 1000) for name, seconds in self.steps]
+        lines.append(StartupProfiler.REPORT_LINE.format(
+            name=StartupProfiler.REPORT_TOTAL,
+            ms=sum(seconds for _, seconds in self.steps) * 1000
+        ))
+        return '\n'.join(lines)
+
+
+class CommandHandler:
+    """
+        Parses and handles commands
+    """
+    COMMAND_PREFIX = '/'        # all commands start with /
+    COMMAND_METHOD_PREFIX = 'do_'
+    HELP_MESSAGE_PREFIX = 'help_'
+    DEFAULT_HELP_MESSAGE = 'Usage: /<command> <args>'
+
+    # help messages
+    HELP_CONNECT = 'Usage: /connect <ip> <port> or /connect <alias> [alias...]'
+    HELP_MSG = 'Usage: /msg <contact_name/phone_number>, or <alias>:<phone_number> for a given phone'
+    HELP_DISCONNECT = 'Usage: /disconnect [alias...]'
+    HELP_DAEMON = 'Usage: smscli-client --daemon <ip> <port>'
+    HELP_LIST = 'Usage: /list'
+    HELP_STATS = 'Usage: /stats'
+    HELP_SEARCH = 'Usage: /search <terms>, end a term with * to match words starting with it'
+    HELP_JUMP = 'Usage: /jump <search result number>'
+    HELP_ATTACH = 'Usage: /attach [daemon socket path]'
+
+    # command specific constants
+
+    # connect command
+    CONNECT_COMMAND_NAME = 'connect'
+    CONNECT_CONNECTION_EXIST = 'Already connected'
+    CONNECT_DEVICE_EXIST = 'Already connected to {device}'
+    CONNECT_UNKNOWN_ALIAS = 'No alias called {alias}'
+    ATTACH_COMMAND_NAME = 'attach'
+
+    # msg command
+    MSG_COMMAND_NAME = 'msg'
+    MSG_DISCONNECTED = 'Not connected'
+    MSG_INVALID_CONTACT = 'Invalid phone number or contact doesnt exist'
+    MSG_UNKNOWN_DEVICE = 'Not connected to {device}'
+
+    # search and jump commands
+    SEARCH_COMMAND_NAME = 'search'
+    JUMP_COMMAND_NAME = 'jump'
+    JUMP_UNKNOWN_CONTACT = 'Contact is not loaded, connect first'
+
+    # list command
+    LIST_COMMAND_LIST_TITLE = 'Commands:'
+    LIST_COMMAND_LIST_INDENT = 2
+
+    def parse_command(self, command):
+        # break up command
+        try:
+            command_parts = command[1:].split()     # grab everything after the slash and split on space
+            command_name, command_args = command_parts[0], command_parts[1:]
+
+            # get method associated to command
+            command_method_str = CommandHandler.COMMAND_METHOD_PREFIX + command_name
+            command_method = getattr(self, command_method_str)
+        except IndexError:
+            # command was to short, something like /
+            self.do_help([])
+            return False
+        except AttributeError:
+            # command does not exist
+            self.do_help([])
+            return False
+        else:
+            # now call it, do this here so we don't catch other attr errors inside command_method
+            command_method(command_args)
+
+        return True
+
+    def do_connect(self, args):
+        """
+            /connect <ip> <port>
+            /connect <alias> [alias...]
+            connects to a smscli-server on the given ip and port, or to the
+            phones of any number of aliases at once, each one a device its
+            contacts are tagged with
+        """
+
+        if len(args) == 2 and ConnectionHandler.is_valid_port(args[1]):
+            self.connect_device('', args)
+        elif len(args) > 0:
+            for alias in args:
+                conn_set = state.config_handler.get_alias(alias)
+
+                if conn_set is not None and len(conn_set) == 2:
+                    self.connect_device(alias, conn_set)
+                else:
+                    state.log_view.print_message(CommandHandler.CONNECT_UNKNOWN_ALIAS.format(alias=alias))
+        else:
+            self.do_help([CommandHandler.CONNECT_COMMAND_NAME])
+
+    def connect_device(self, device, conn_set):
+        if not state.connections.is_connected(device):
+            state.connections.start_connection(conn_set[0], conn_set[1], device)
+        elif device:
+            state.log_view.print_message(CommandHandler.CONNECT_DEVICE_EXIST.format(device=device))
+        else:
+            state.log_view.print_message(CommandHandler.CONNECT_CONNECTION_EXIST)
+
+    def do_attach(self, args):
+        """
+            /attach [daemon socket path]
+            attaches to a running smscli-client --daemon, which holds the connection to the phone
+        """
+
+        if not state.connections.is_connected(''):
+            if len(args) <= 1:
+                state.connections.start_connection(args[0] if args else ConfigHandler.DAEMON_SOCKET_PATH, None)
+            else:
+                self.do_help([CommandHandler.ATTACH_COMMAND_NAME])
+        else:
+            state.log_view.print_message(CommandHandler.CONNECT_CONNECTION_EXIST)
+
+    def do_msg(self, args):
+        """
+            /msg <contact_name/phone_number>
+            opens a new contact view if contact doesnt exist, will create one using given phone number
+            a phone number also matches a contact saved with that number, tab completes contact names
+            a new number goes to the first connected phone, or the one named as in <alias>:<number>
+            contacts restored from the last connection can be opened before connecting
+
+            invalid phone numbers and such are left for the server to deal with
+        """
+        if state.connections.is_connected() or state.contact_views:
+            if len(args):
+                name = ' '.join(args)     # names can have spaces in them
+                matched_ids = state.contact_index.find(name)
+
+                if len(matched_ids):
+                    for view_id in matched_ids:     # could be multiple contacts with same name -just open all
+                        if view_id not in state.main_window.shown_views:
+                            state.main_window.add_new_view(state.contact_views[view_id])
+                else:
+                    # unmatched contact, assume name is a phone number, first ensure it has no letters
+                    device, _, number = name.rpartition(ConnectionHandler.DEVICE_SEPARATOR)
+
+                    if device and not state.connections.is_connected(device):
+                        state.log_view.print_message(CommandHandler.MSG_UNKNOWN_DEVICE.format(device=device))
+                    elif number and ContactIndex.LETTERS.search(number) is None:
+                        device = device or state.connections.get_default_device()
+                        view_id = ConnectionHandler.tag_id(device, number)
+
+                        state.contact_views[view_id] = ContactView(
+                            view_id,
+                            number,
+                            number,
+                            [],
+                            device
+                        )
+
+                        contact_view = state.contact_views[view_id]
+                        state.contact_index.add_contacts([contact_view])
+                        state.main_window.add_new_view(contact_view)
+                        state.main_window.switch_view(contact_view.view_id)
+                    else:
+                        state.log_view.print_message(CommandHandler.MSG_INVALID_CONTACT)
+            else:
+                self.do_help([CommandHandler.MSG_COMMAND_NAME])
+        else:
+            state.log_view.print_message(CommandHandler.MSG_DISCONNECTED)
+
+    def do_disconnect(self, args):
+        """
+            /disconnect [alias...]
+            disconnects the given phones, or all of them, also calls off reconnecting
+        """
+        state.connections.disconnect(args or None)
+
+    def do_quit(self, args):
+        exit()      # TODO: bugged out for some reason
+
+    def do_list(self, args):
+        state.log_view.print_message(CommandHandler.LIST_COMMAND_LIST_TITLE)
+        for command in CommandHandler.get_commands():
+            state.log_view.print_message(' ' * CommandHandler.LIST_COMMAND_LIST_INDENT + command)
+
+    def do_stats(self, args):
+        """
+            /stats
+            prints runtime counters and latencies to the log view
+        """
+
+        state.log_view.print_message(state.render_scheduler.get_stats())
+        for line in state.metrics.get_stats():
+            state.log_view.print_message(line)
+
+    def do_search(self, args):
+        """
+            /search <terms>
+            lists stored messages containing all the terms in the search view
+        """
+
+        if len(args):
+            if state.search_view is None:
+                state.search_view = SearchView()
+
+            state.search_view.show_results(' '.join(args), state.message_store.search(args))
+
+            if SearchView.VIEW_ID not in state.main_window.shown_views:
+                state.main_window.add_new_view(state.search_view)
+            if SearchView.VIEW_ID in state.main_window.shown_views:
+                state.main_window.switch_view(SearchView.VIEW_ID)
+        else:
+            self.do_help([CommandHandler.SEARCH_COMMAND_NAME])
+
+    def do_jump(self, args):
+        """
+            /jump <search result number>
+            opens the conversation of a search result, focused on the message
+        """
+
+        results = [] if state.search_view is None else state.search_view.results
+
+        if len(args) == 1 and args[0].isdigit() and 1 <= int(args[0]) <= len(results):
+            message_id, contact_id = results[int(args[0]) - 1]
+            contact_view = state.contact_views.get(contact_id)
+
+            if contact_view is None:
+                state.log_view.print_message(CommandHandler.JUMP_UNKNOWN_CONTACT)
+                return
+
+            if contact_id not in state.main_window.shown_views:
+                state.main_window.add_new_view(contact_view)
+            if contact_id in state.main_window.shown_views:
+                state.main_window.switch_view(contact_id)
+
+                contact_view.focus_message(
+                    state.message_store.get_message_position(contact_id, message_id, contact_view.history_end_id)
+                )
+                if len(contact_view.listwalker):
+                    contact_view.listbox.set_focus_valign('middle')
+        else:
+            self.do_help([CommandHandler.JUMP_COMMAND_NAME])
+
+    def do_help(self, args):
+        if len(args) == 0:
+            state.log_view.print_message(CommandHandler.DEFAULT_HELP_MESSAGE)
+        else:
+            help_message = (CommandHandler.HELP_MESSAGE_PREFIX + args[0]).upper()
+            state.log_view.print_message(getattr(CommandHandler, help_message))
+
+    @staticmethod
+    def get_commands():
+        pattern = r'^' + re.escape(CommandHandler.COMMAND_METHOD_PREFIX) + r'.*'
+        return [method.split('_')[1]
+                for method in dir(CommandHandler)
+                if callable(getattr(CommandHandler, method)) and re.search(pattern, method, re.IGNORECASE)]
+
+
+class JSONCodec:
+    """
+        Converts between frame payloads and python objects
+        using the standard json module
+
+        codecs are what JSONHelper and ConnectionHandler use to
+        read and write frames, so the wire format can be swapped
+    """
+
+    NAME = 'json'
+
+    JSON_DECODER = json.JSONDecoder()
+    JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+    JSON_FRAME_KEY = re.compile(rb'\s*\{\s*"(\w+)"')
+
+    @staticmethod
+    def is_available():
+        return True
+
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        # json won't take a memoryview, bytes() of bytes is the same object so only those are copied
+        return json.loads(bytes(data))
+
+    def is_frame(self, data, key):
+        """ whether a frame is a {key: ...} control frame, without decoding all of it """
+
+        match = JSONCodec.JSON_FRAME_KEY.match(data)
+        return match is not None and match.group(1) == key.encode('utf-8')
+
+    def iter_items(self, data):
+        """
+            Incrementally decode a frame holding an object, yielding
+            (key, value) pairs one at a time instead of loading the
+            whole thing up front
+        """
+
+        text = str(data, 'utf-8')
+        decoder = JSONCodec.JSON_DECODER
+        skip_whitespace = JSONCodec.JSON_WHITESPACE.match
+
+        def expect(char, pos):
+            pos = skip_whitespace(text, pos).end()
+            if text[pos:pos + 1] != char:
+                raise json.JSONDecodeError('Expecting ' + repr(char), text, pos)
+            return pos + 1
+
+        pos = expect('{', 0)
+        if text[skip_whitespace(text, pos).end():].startswith('}'):
+            return
+
+        while True:
+            key, pos = decoder.raw_decode(text, skip_whitespace(text, pos).end())
+            pos = expect(':', pos)
+            value, pos = decoder.raw_decode(text, skip_whitespace(text, pos).end())
+
+            yield key, value
+
+            pos = skip_whitespace(text, pos).end()
+            if text[pos:pos + 1] == '}':
+                return
+            pos = expect(',', pos)
+
+
+class FastJSONCodec(JSONCodec):
+    """
+        Same wire format as JSONCodec, using orjson if it's installed
+
+        it decodes a whole contact dump faster than JSONCodec
+        can step through it, so iter_items doesn't bother being incremental
+    """
+
+    NAME = 'fastjson'
+
+    @staticmethod
+    def is_available():
+        return orjson is not None
+
+    def encode(self, obj):
+        return orjson.dumps(obj)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+    def iter_items(self, data):
+        return iter(orjson.loads(data).items())
+
+
+class MsgpackCodec:
+    """
+        Compact binary MessagePack frames, used when msgpack is
+        installed and the server lists it in its features
+    """
+
+    NAME = 'msgpack'
+
+    @staticmethod
+    def is_available():
+        return msgpack is not None
+
+    def encode(self, obj):
+        return msgpack.packb(obj)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+    def is_frame(self, data, key):
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+
+        try:
+            return unpacker.read_map_header() == 1 and unpacker.unpack() == key
+        except (msgpack.UnpackException, ValueError):
+            return False
+
+    def iter_items(self, data):
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+
+        for _ in range(unpacker.read_map_header()):
+            key = unpacker.unpack()
+            yield key, unpacker.unpack()
+
+
+class JSONHelper:
+    """ Util methods for converting between frames and objects used here """
+
+    REMOTE_TIME_FORMAT_STR = '%I:%M:%S %p'
+    REMOTE_TIME_PATTERN = re.compile('(0[1-9]|1[0-2])(:[0-5][0-9]:[0-5][0-9]) (AM|PM)')
+    TIME_CACHE_SIZE = 2 * 12 * 60 * 60      # every time REMOTE_TIME_FORMAT_STR can give
+    time_cache = {}     # remote time -> formatted time
+
+    CODECS = [JSONCodec, FastJSONCodec, MsgpackCodec]
+    CODEC_AUTO = 'auto'
+
+    JSON_MESSAGE_TIME_KEY = 'time'
+    JSON_MESSAGE_BODY_KEY = 'body'
+    JSON_MESSAGE_ID_KEY = 'relatedContactId'
+    JSON_MESSAGE_TYPE_KEY = 'smsMessageType'
+    JSON_MESSAGE_UID_KEY = 'uid'
+    JSON_MESSAGE_DATE_KEY = 'date'
+
+    JSON_ACK_KEY = 'ack'
+    JSON_ACK_OK_KEY = 'ok'
+    JSON_PING_KEY = 'ping'
+    JSON_PONG_KEY = 'pong'
+
+    JSON_HANDSHAKE_KEY = 'handshake'
+    JSON_HELLO_KEY = 'hello'
+    JSON_DELTA_KEY = 'delta'
+    JSON_VERSION_KEY = 'version'
+    JSON_FEATURES_KEY = 'features'
+    JSON_CONTACTS_VERSION_KEY = 'contactsVersion'
+    JSON_SINCE_KEY = 'since'
+    JSON_CONTACTS_KEY = 'contacts'
+    JSON_MESSAGES_KEY = 'messages'
+
+    JSON_CONTACT_ID_KEY = 'id'
+    JSON_CONTACT_DISPLAY_KEY = 'displayName'
+    JSON_CONTACT_PHONE_KEY = 'phoneNumber'
+
+    @staticmethod
+    def get_codecs():
+        """ the codecs that can be used here, slowest first """
+        return [codec for codec in JSONHelper.CODECS if codec.is_available()]
+
+    @staticmethod
+    def get_json_codec(preferred=CODEC_AUTO):
+        """ the codec to use for JSON frames, the fast one unless told otherwise """
+
+        if preferred in (JSONHelper.CODEC_AUTO, FastJSONCodec.NAME) and FastJSONCodec.is_available():
+            return FastJSONCodec()
+        return JSONCodec()
+
+    @staticmethod
+    def format_time(remote_time):
+        """
+            java client formats time all weird out, fix it here
+
+            there are only so many distinct times, each is converted once and cached
+        """
+
+        formatted_time = JSONHelper.time_cache.get(remote_time)
+
+        if formatted_time is None:
+            formatted_time = JSONHelper.convert_time(remote_time)
+
+            # strptime is lenient (case, padding), so odd spellings could keep adding entries
+            if len(JSONHelper.time_cache) >= JSONHelper.TIME_CACHE_SIZE:
+                JSONHelper.time_cache.clear()
+            JSONHelper.time_cache[remote_time] = formatted_time
+
+        return formatted_time
+
+    @staticmethod
+    def convert_time(remote_time):
+        """
+            REMOTE_TIME_FORMAT_STR to TIME_FORMAT_STR, the usual hh:mm:ss AM
+            is rearranged by hand, strptime deals with anything else
+        """
+
+        match = JSONHelper.REMOTE_TIME_PATTERN.fullmatch(remote_time)
+
+        if match is None:
+            return datetime.datetime\
+                .strptime(remote_time, JSONHelper.REMOTE_TIME_FORMAT_STR)\
+                .strftime(ViewMessage.TIME_FORMAT_STR)
+
+        hour = int(match.group(1)) % 12 + (12 if match.group(3) == 'PM' else 0)
+        return '{:02d}{}'.format(hour, match.group(2))
+
+    @staticmethod
+    def view_message_to_dict(view_message, uid=None):
+        view_message_dict = {
+                JSONHelper.JSON_MESSAGE_TIME_KEY: view_message.message_time,
+                JSONHelper.JSON_MESSAGE_BODY_KEY: view_message.body,
+                JSONHelper.JSON_MESSAGE_ID_KEY: view_message.related_view_id,
+                JSONHelper.JSON_MESSAGE_TYPE_KEY: view_message.message_type
+        }
+
+        if uid is not None:
+            view_message_dict[JSONHelper.JSON_MESSAGE_UID_KEY] = uid
+
+        return view_message_dict
+
+    @staticmethod
+    def dict_to_view_message(view_message_dict):
+        return JSONHelper.dicts_to_view_messages([view_message_dict])[0]
+
+    @staticmethod
+    def dicts_to_view_messages(view_message_dicts):
+        """ convert a batch of message dicts, display names are looked up once per contact """
+
+        start = time.perf_counter()
+        format_time = JSONHelper.format_time
+        display_names = {}      # view_id -> display name
+        view_messages = []
+
+        for view_message_dict in view_message_dicts:
+            related_view_id = view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]
+            message_type = view_message_dict[JSONHelper.JSON_MESSAGE_TYPE_KEY]
+
+            if message_type == ViewMessage.TYPE_OUTGOING:
+                display_name = ViewMessage.USER_DISPLAY_NAME
+            else:
+                display_name = display_names.get(related_view_id)
+                if display_name is None:
+                    contact_view = state.contact_views.get(related_view_id)
+                    display_name = related_view_id if contact_view is None else contact_view.display_name
+                    display_names[related_view_id] = display_name
+
+            # phone side date if the server sends one, otherwise now
+            date = view_message_dict.get(JSONHelper.JSON_MESSAGE_DATE_KEY)
+
+            view_messages.append(ViewMessage(
+                format_time(view_message_dict[JSONHelper.JSON_MESSAGE_TIME_KEY]),
+                view_message_dict[JSONHelper.JSON_MESSAGE_BODY_KEY],
+                related_view_id,
+                display_name,
+                message_type,
+                None if date is None else date / 1000
+            ))
+
+        state.metrics.observe(Metrics.CONVERT, time.perf_counter() - start)
+        state.metrics.inc(Metrics.MESSAGES_CONVERTED, len(view_messages))
+
+        return view_messages
+
+    @staticmethod
+    def dict_to_contact_view(contact_view_dict, device='', history_end_id=None):
+        """ Convert a contact view dict from device to a ContactView object, see ContactView for history_end_id """
+
+        return ContactView(
+                ConnectionHandler.tag_id(device, contact_view_dict[JSONHelper.JSON_CONTACT_ID_KEY]),
+                contact_view_dict[JSONHelper.JSON_CONTACT_DISPLAY_KEY],
+                contact_view_dict[JSONHelper.JSON_CONTACT_PHONE_KEY],
+                [],
+                device,
+                history_end_id
+        )
+
+
+class MessageStore:
+    """
+        Local sqlite store of contacts and their messages
+
+        everything received, sent or set up is written through to here
+        so history survives restarts, contact views read it back lazily
+    """
+
+    STORE_FILE_NAME = 'messages.db'
+    MEMORY_PATH = ':memory:'
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS contacts (
+            id TEXT PRIMARY KEY,
+            display_name TEXT NOT NULL,
+            address TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            contact_id TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            message_time TEXT NOT NULL,
+            body TEXT NOT NULL,
+            sender_name TEXT NOT NULL,
+            message_type TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_contact_timestamp ON messages (contact_id, timestamp, id);
+        CREATE TABLE IF NOT EXISTS sync_marks (
+            contact_id TEXT PRIMARY KEY,
+            remote_date INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    '''
+
+    # full text index over message bodies, kept up to date by sqlite itself as messages are inserted,
+    # only the index is stored, the text stays in messages
+    SEARCH_SCHEMA = '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_search USING fts5 (
+            body, content='messages', content_rowid='id', tokenize='unicode61', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS messages_search_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_search (rowid, body) VALUES (new.id, new.body);
+        END;
+    '''
+    SEARCH_LIMIT = 100
+    SEARCH_PREFIX = '*'
+
+    ERROR_OPEN = 'Failed to open message store, history will not be saved: '
+
+    def __init__(self):
+        self.connection = None
+        self.search_indexed = False     # whether sqlite has fts5, if not search falls back to scanning
+
+    def open(self, path):
+        """ open the store at path, falling back to an in memory one so callers never have to check """
+
+        try:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(MessageStore.SCHEMA)
+            self.setup_search()
+        except sqlite3.Error as e:
+            self.connection = sqlite3.connect(MessageStore.MEMORY_PATH)
+            self.connection.executescript(MessageStore.SCHEMA)
+            self.setup_search()
+            return MessageStore.ERROR_OPEN + str(e)
+
+        return None
+
+    def setup_search(self):
+        """ create the search index, indexing anything stored before it existed """
+
+        exists = self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_search'"
+        ).fetchone() is not None
+
+        try:
+            with self.connection:
+                self.connection.executescript(MessageStore.SEARCH_SCHEMA)
+                if not exists:
+                    self.connection.execute("INSERT INTO messages_search (messages_search) VALUES ('rebuild')")
+            self.search_indexed = True
+        except sqlite3.OperationalError:
+            # sqlite built without fts5
+            self.search_indexed = False
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def add_contacts(self, contact_views):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO contacts (id, display_name, address) VALUES (?, ?, ?)',
+                [(contact_view.view_id, contact_view.display_name, contact_view.address)
+                 for contact_view in contact_views]
+            )
+
+    def add_messages(self, view_messages):
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO messages (contact_id, timestamp, message_time, body, sender_name, message_type) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(view_message.related_view_id, view_message.timestamp, view_message.message_time,
+                  view_message.body, view_message.sender_name, view_message.message_type)
+                 for view_message in view_messages]
+            )
 
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.settimeout(ConnectionHandler.TIMEOUT)
+    def add_contact_dicts(self, contact_dicts):
+        """ add_contacts for contacts as the server sends them """
 
-                self.socket.connect((ip_address, int(port)))
-                self.connected = True
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO contacts (id, display_name, address) VALUES (?, ?, ?)',
+                [(contact_dict[JSONHelper.JSON_CONTACT_ID_KEY], contact_dict[JSONHelper.JSON_CONTACT_DISPLAY_KEY],
+                  contact_dict[JSONHelper.JSON_CONTACT_PHONE_KEY]) for contact_dict in contact_dicts]
+            )
 
-                self.socket.settimeout(socket.getdefaulttimeout())
-            except socket.error as e:
-                if e.errno == socket.errno.ETIMEDOUT:
-                    error_message = ConnectionHandler.ERROR_MESSAGE_TIMEOUT
-                elif e.errno == socket.errno.ECONNREFUSED:
-                    error_message = ConnectionHandler.ERROR_MESSAGE_REFUSED
-                else:
-                    # error_message = ConnectionHandler.ERROR_MESSAGE_GENERIC
-                    # error_message = str(e)
-                    raise
+    def get_contact_dicts(self):
+        """ every stored contact as the server sends them, contact id -> dict """
 
-                state.log_view.print_message(error_message)
-                self.connected = False
-        else:
-            state.log_view.print_message(ConnectionHandler.ERROR_MESSAGE_INVALID)
-            self.connected = False
+        return {
+            contact_id: {
+                JSONHelper.JSON_CONTACT_ID_KEY: contact_id,
+                JSONHelper.JSON_CONTACT_DISPLAY_KEY: display_name,
+                JSONHelper.JSON_CONTACT_PHONE_KEY: address
+            }
+            for contact_id, display_name, address in self.connection.execute('SELECT id, display_name, address FROM contacts')
+        }
 
-    def read_server(self):
-        """ reads a json string from the server """
-        
-        message = ''
+    def get_last_message_id(self):
+        return self.connection.execute('SELECT COALESCE(MAX(id), 0) FROM messages').fetchone()[0]
 
-        try:
-            length = int.from_bytes(
-                self.socket.recv(self.LEN_BYTE_SIZE, socket.MSG_WAITALL),
-                ConnectionHandler.LEN_STRUCT_INT_TYPE
-            )
+    def load_messages(self, contact_id, end_id):
+        """ all stored messages of a contact up to and including message end_id, oldest first """
 
-            message = str(self.socket.recv(length, socket.MSG_WAITALL), 'utf-8')
+        rows = self.connection.execute(
+            'SELECT message_time, body, contact_id, sender_name, message_type, timestamp FROM messages '
+            'WHERE contact_id = ? AND id <= ? ORDER BY timestamp, id',
+            (contact_id, end_id)
+        )
 
-            # clean disconnect will not raise socket.error but will return empty message
-            if not message:
-                raise socket.error
-        except socket.error:
-            state.log_view.print_message(ConnectionHandler.ERROR_LOST_CONNECTION)
-            self.connected = False
+        return [ViewMessage(*row) for row in rows]
 
-        return message
+    def count_messages(self, contact_id, end_id):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM messages WHERE contact_id = ? AND id <= ?',
+            (contact_id, end_id)
+        ).fetchone()[0]
 
-    def write_server(self, message):
+    def load_message_range(self, contact_id, end_id, start, count):
         """
-            write a json string to the server
-
-            we use the struct module to correctly send
-           the integer size, using network byte order
+            count messages of a contact view from position start on, positions as in
+            get_message_position, the history up to end_id then whatever came after
         """
 
-        try: 
-            self.socket.sendall(struct.pack(ConnectionHandler.LEN_STRUCT_FORMAT, len(message)))
-            self.socket.sendall(message.encode('utf-8'))
-        except socket.error:
-            state.log_view.print_message(ConnectionHandler.ERROR_LOST_CONNECTION)
-            self.connected = False
+        columns = 'message_time, body, contact_id, sender_name, message_type, timestamp'
 
-    def read_loop(self):
-        """ waits for messages from server """
+        view_messages = [ViewMessage(*row) for row in self.connection.execute(
+            'SELECT ' + columns + ' FROM messages WHERE contact_id = ? AND id <= ? '
+            'ORDER BY timestamp, id LIMIT ? OFFSET ?',
+            (contact_id, end_id, count, start)
+        )]
 
-        while self.connected:
-            json_message = self.read_server()
-            if json_message:
-                self.receive_message(json_message)
+        if len(view_messages) < count:
+            view_messages.extend(ViewMessage(*row) for row in self.connection.execute(
+                'SELECT ' + columns + ' FROM messages WHERE contact_id = ? AND id > ? ORDER BY id LIMIT ? OFFSET ?',
+                (contact_id, end_id, count - len(view_messages), max(0, start - self.count_messages(contact_id, end_id)))
+            ))
 
-        # if this is a shutdown, urwid raises an assertion error when we do this
-        try:
-            state.main_window.refresh_divider()
-            state.main_loop.draw_screen()
-        except AssertionError:
-            pass
+        return view_messages
 
-    def receive_message(self, message):
+    def search(self, terms, limit=SEARCH_LIMIT):
+        """
+            messages containing every term as a word, newest first,
+            a term ending in * matches words starting with it
+            returns (message id, ViewMessage) pairs
+        """
 
-        view_message = JSONHelper.json_to_view_message(message)
+        columns = 'id, message_time, body, contact_id, sender_name, message_type, timestamp'
 
-        # make new contact if contact not known
-        if view_message.related_view_id not in state.contact_views:
-            state.contact_views[view_message.related_view_id] = ContactView(
-                view_message.related_view_id,
-                view_message.related_view_id,
-                view_message.related_view_id,
-                []
+        if self.search_indexed:
+            query = ' '.join(
+                '"' + term.rstrip(MessageStore.SEARCH_PREFIX).replace('"', '""') + '"' +
+                (MessageStore.SEARCH_PREFIX if term.endswith(MessageStore.SEARCH_PREFIX) else '')
+                for term in terms
+            )
+            rows = self.connection.execute(
+                'SELECT ' + columns + ' FROM messages WHERE id IN ('
+                'SELECT rowid FROM messages_search WHERE messages_search MATCH ? ORDER BY rowid DESC LIMIT ?'
+                ') ORDER BY id DESC',
+                (query, limit)
+            )
+        else:
+            rows = self.connection.execute(
+                'SELECT ' + columns + ' FROM messages WHERE ' + ' AND '.join(["body LIKE ? ESCAPE '\\'"] * len(terms)) +
+                ' ORDER BY id DESC LIMIT ?',
+                ['%' + re.sub(r'([%_\\])', r'\\\1', term.rstrip(MessageStore.SEARCH_PREFIX)) + '%' for term in terms] + [limit]
             )
 
-        contact_view = state.contact_views[view_message.related_view_id]
-        contact_view.add_message(view_message)
+        return [(row[0], ViewMessage(*row[1:])) for row in rows]
 
-        if view_message.related_view_id not in state.main_window.shown_views:
-            state.main_window.add_new_view(contact_view)
+    def get_message_position(self, contact_id, message_id, end_id):
+        """
+            where message message_id sits in a contact view whose history ends at end_id,
+            history is in time order, anything after it was added in arrival (id) order
+        """
 
-        if view_message.message_type == ViewMessage.TYPE_INCOMING:
-            ConnectionHandler.notify(contact_view.display_name, view_message.body)
+        if message_id <= end_id:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE contact_id = ? AND id <= ? AND '
+                '(timestamp < (SELECT timestamp FROM messages WHERE id = ?) OR '
+                '(timestamp = (SELECT timestamp FROM messages WHERE id = ?) AND id < ?))',
+                (contact_id, end_id, message_id, message_id, message_id)
+            ).fetchone()[0]
 
-        # were in another thread so explicitly tell urwid to render
-        state.main_loop.draw_screen()
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM messages WHERE contact_id = ? AND id < ?',
+            (contact_id, message_id)
+        ).fetchone()[0]
 
-    def send_message(self, message):
+    def load_messages_since(self, since):
         """
-            create a ViewMessage given message  body and current view then send and add to view
+            every message newer than since[contact id] (a date in ms), oldest first,
+            contacts without a mark get the newest mark, like the phone does
+            no marks at all is a new client, it gets everything
         """
 
-        if len(message) > MAX_MESSAGE_LEN:
-            # break message into MAX_MESSAGE_LEN chunks
-            message_chunk = [message[i:i+MAX_MESSAGE_LEN] for i in range(0, len(message), MAX_MESSAGE_LEN)]
-        else:
-            message_chunk = [message]
-
-        # convert each message string chunk into a view message
-        view_message_chunk = [ViewMessage(datetime.datetime.now().time().strftime(ViewMessage.TIME_FORMAT_STR),
-                                          message, state.main_window.current_view, ViewMessage.USER_DISPLAY_NAME,
-                                          ViewMessage.TYPE_OUTGOING)
-                              for message in message_chunk]
+        if not since:
+            rows = self.connection.execute(
+                'SELECT message_time, body, contact_id, sender_name, message_type, timestamp FROM messages ORDER BY id'
+            )
+            return [ViewMessage(*row) for row in rows]
 
-        # write each chunk to server
-        for view_message in view_message_chunk:
-            self.write_server(JSONHelper.view_message_to_json(view_message))
-            time.sleep(ConnectionHandler.WRITE_PAUSE_TIME)
+        floor = max(since.values())
+        rows = self.connection.execute(
+            'SELECT message_time, body, contact_id, sender_name, message_type, timestamp FROM messages '
+            'WHERE timestamp * 1000 > ? ORDER BY id',
+            (min(since.values()),)
+        )
 
-        # finally add them to the current view
-        state.main_window.shown_views[state.main_window.current_view].add_messages(view_message_chunk)
-        state.main_window.clear_input()
+        return [ViewMessage(*row) for row in rows if round(row[5] * 1000) > since.get(row[2], floor)]
 
-    @staticmethod
-    def notify(title, body):
-        # TODO: make this optional
-        if Notify.init(title):
-            notification = Notify.Notification.new(title, body)
-            notification.show()
+    def update_sync_marks(self, sync_marks):
+        """ raise the high water marks of contacts, the newest server date we have from each, contact_id -> date """
 
-    @staticmethod
-    def is_valid_ipv4_address(ip_address):
-        try:
-            socket.inet_aton(ip_address)
-        except socket.error:
-            return False
+        with self.connection:
+            self.connection.executemany(
+                'INSERT INTO sync_marks (contact_id, remote_date) VALUES (?, ?) '
+                'ON CONFLICT (contact_id) DO UPDATE SET remote_date = MAX(remote_date, excluded.remote_date)',
+                sync_marks.items()
+            )
 
-        # though this is not technically needed for a valid ip we will impose it anyway
-        return ip_address.count('.') == 3
+    def get_sync_marks(self):
+        return dict(self.connection.execute('SELECT contact_id, remote_date FROM sync_marks'))
 
-    @staticmethod
-    def is_valid_port(port):
-        try:
-            port = int(port)
+    def set_sync_value(self, key, value):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
 
-            if ConnectionHandler.MIN_PORT <= port <= ConnectionHandler.MAX_PORT:
-                return True
-            else:
-                return False
-        except ValueError:
-            return False
+    def get_sync_value(self, key):
+        row = self.connection.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return None if row is None else row[0]
 
 
-class CommandHandler:
+class ContactSnapshot:
     """
-        Parses and handles commands
+        The contact lists of the last connections, so contacts are there from startup
+
+        a file per device under the config dir: a JSON header line with the
+        format version, the device, the contactsVersion the server gave for the
+        list and a checksum of the rest, then the contacts as separated records.
+        It is memory mapped and read at startup, the contact views are made on
+        the event loop a batch at a time, and connections wait for them before
+        the hello, where its contactsVersion goes like for contacts loaded from
+        the server. The server either confirms the list, by sending no contact
+        dump, or sends a new one, which replaces the snapshot
     """
-    COMMAND_PREFIX = '/'        # all commands start with /
-    COMMAND_METHOD_PREFIX = 'do_'
-    HELP_MESSAGE_PREFIX = 'help_'
-    DEFAULT_HELP_MESSAGE = 'Usage: /<command> <args>'
-
-    # help messages
-    HELP_CONNECT = 'Usage: /connect <ip> <port>'
-    HELP_MSG = 'Usage: /msg <contact_name/phone_number>'
-    HELP_DISCONNECT = 'Usage: /disconnect'
-    HELP_LIST = 'Usage: /list'
-
-    # command specific constants
 
-    # connect command
-    CONNECT_COMMAND_NAME = 'connect'
-    CONNECT_CONNECTION_EXIST = 'Already connected'
-
-    # msg command
-    MSG_COMMAND_NAME = 'msg'
-    MSG_DISCONNECTED = 'Not connected'
-    MSG_INVALID_CONTACT = 'Invalid phone number or contact doesnt exist'
+    FORMAT_VERSION = 1
+    FILE_PREFIX = 'contacts'
+    FILE_SUFFIX = '.snapshot'
+    TEMP_SUFFIX = '.tmp'
 
-    # list command
-    LIST_COMMAND_LIST_TITLE = 'Commands:'
-    LIST_COMMAND_LIST_INDENT = 2
+    # the ascii unit and record separators, taken out of anything written
+    FIELD_SEPARATOR = '\x1f'
+    RECORD_SEPARATOR = '\x1e'
+    RECORD_FIELDS = 3           # view id, display name, address
+    CLEAN_TABLE = str.maketrans({FIELD_SEPARATOR: ' ', RECORD_SEPARATOR: ' '})
 
-    def parse_command(self, command):
-        # break up command
-        try:
-            command_parts = command[1:].split()     # grab everything after the slash and split on space
-            command_name, command_args = command_parts[0], command_parts[1:]
+    HEADER_FORMAT = 'format'
+    HEADER_DEVICE = 'device'
+    HEADER_VERSION = 'contactsVersion'
+    HEADER_COUNT = 'count'
+    HEADER_CHECKSUM = 'crc32'
+    HEADER_END = b'\n'
+    HEADER_SIZE_LIMIT = 4096     # the header is found in this much of the start
 
-            # get method associated to command
-            command_method_str = CommandHandler.COMMAND_METHOD_PREFIX + command_name
-            command_method = getattr(self, command_method_str)
-        except IndexError:
-            # command was to short, something like /
-            self.do_help([])
-            return False
-        except AttributeError:
-            # command does not exist
-            self.do_help([])
-            return False
-        else:
-            # now call it, do this here so we don't catch other attr errors inside command_method
-            command_method(command_args)
+    MESSAGE_RESTORED = 'Loaded {count} contacts from the last connection'
+    ERROR_SAVE = 'Failed to save the contact snapshot: {error}'
 
-        return True
+    def __init__(self):
+        self.directory = None       # nothing is saved or loaded until set
+        self.restored = {}          # device -> view ids of its restored contacts, until its server sends a new list
+        self.restore_task = None
 
-    def do_connect(self, args):
-        """
-            /connect <ip> <port>
-            connects to a smscli-server on the given ip and port
-        """
+    def set_directory(self, directory):
+        self.directory = directory
 
-        if not state.connection_handler.connected:
-            if len(args) > 0:
-                if len(args) == 1:
-                    conn_set = state.config_handler.get_alias(args[0])
-                else:
-                    conn_set = args
+    def get_path(self, device):
+        # alias names can have anything in them, hex keeps the file name safe
+        return os.path.join(self.directory, ContactSnapshot.FILE_PREFIX +
+                            ('.' + device.encode().hex() if device else '') + ContactSnapshot.FILE_SUFFIX)
 
-                if conn_set is not None and len(conn_set) == 2:
-                    state.connection_handler.setup_connection(conn_set[0], conn_set[1])
-                else:
-                    self.do_help([CommandHandler.CONNECT_COMMAND_NAME])
-            else:
-                self.do_help([CommandHandler.CONNECT_COMMAND_NAME])
-        else:
-            state.log_view.print_message(CommandHandler.CONNECT_CONNECTION_EXIST)
+    @staticmethod
+    def encode(device, contacts_version, contact_views):
+        clean_table = ContactSnapshot.CLEAN_TABLE
+
+        body = ContactSnapshot.RECORD_SEPARATOR.join(
+            ContactSnapshot.FIELD_SEPARATOR.join((
+                contact_view.view_id.translate(clean_table),
+                contact_view.display_name.translate(clean_table),
+                contact_view.address.translate(clean_table)
+            ))
+            for contact_view in contact_views
+        ).encode()
+
+        header = json.dumps({
+            ContactSnapshot.HEADER_FORMAT: ContactSnapshot.FORMAT_VERSION,
+            ContactSnapshot.HEADER_DEVICE: device,
+            ContactSnapshot.HEADER_VERSION: contacts_version,
+            ContactSnapshot.HEADER_COUNT: len(contact_views),
+            ContactSnapshot.HEADER_CHECKSUM: zlib.crc32(body)
+        }).encode()
+
+        return header + ContactSnapshot.HEADER_END + body
 
-    def do_msg(self, args):
+    @staticmethod
+    def decode(data):
         """
-            /msg <contact_name/phone_number>
-            opens a new contact view if contact doesnt exist, will create one using given phone number
-
-            invalid phone numbers and such are left for the server to deal with
+            (device, contacts version, [(view id, name, address)]) from a snapshot,
+            data is any buffer, None if it's damaged or from another format version
         """
-        num_args = 1
-
-        if state.connection_handler.connected:
-            if len(args) == num_args:
-                name = args[0]
-                matched_views = [view for view in state.contact_views.values() if view.display_name.lower() == name.lower()]
 
-                if len(matched_views):
-                    for view in matched_views:      # could be multiple contacts with same name -just open all
-                        if view.view_id not in state.main_window.shown_views:
-                            state.main_window.add_new_view(view)
-                else:
-                    # unmatched contact, assume name is a phone number, first ensure it has no letters
-                    if re.search('[a-zA-Z]', name) is None:
-                        state.contact_views[name] = ContactView(
-                            name,
-                            name,
-                            name,
-                            []
-                        )
+        with memoryview(data) as view:
+            header_end = bytes(view[:ContactSnapshot.HEADER_SIZE_LIMIT]).find(ContactSnapshot.HEADER_END)
+            if header_end < 0:
+                return None
 
-                        # strip space and special characters
-                        name.strip()
-                        re.sub('[^0-9]', '', name)
+            try:
+                header = json.loads(bytes(view[:header_end]))
+            except ValueError:
+                return None
+            if not isinstance(header, dict) or header.get(ContactSnapshot.HEADER_FORMAT) != ContactSnapshot.FORMAT_VERSION:
+                return None
 
-                        contact_view = state.contact_views[name]
-                        state.main_window.add_new_view(contact_view)
-                        state.main_window.switch_view(contact_view.view_id)
-                    else:
-                        state.log_view.print_message(CommandHandler.MSG_INVALID_CONTACT)
-            else:
-                self.do_help([CommandHandler.MSG_COMMAND_NAME])
-        else:
-            state.log_view.print_message(CommandHandler.MSG_DISCONNECTED)
+            with view[header_end + 1:] as body:
+                if zlib.crc32(body) != header.get(ContactSnapshot.HEADER_CHECKSUM):
+                    return None
+                try:
+                    text = str(body, 'utf-8')
+                except UnicodeDecodeError:
+                    return None
+
+        records = [record.split(ContactSnapshot.FIELD_SEPARATOR)
+                   for record in text.split(ContactSnapshot.RECORD_SEPARATOR)] if text else []
+        if len(records) != header.get(ContactSnapshot.HEADER_COUNT) or \
+                any(len(record) != ContactSnapshot.RECORD_FIELDS for record in records):
+            return None
 
-    def do_disconnect(self, args):
-        if state.connection_handler.connected:
-            state.connection_handler.connected = False
-            state.connection_handler.socket.shutdown(socket.SHUT_RDWR)
-            state.connection_handler.socket.close()
+        return header.get(ContactSnapshot.HEADER_DEVICE, ''), header.get(ContactSnapshot.HEADER_VERSION), records
 
-    def do_quit(self, args):
-        exit()      # TODO: bugged out for some reason
+    def save(self, device, contacts_version, contact_views):
+        """ replace the snapshot of device, written to a temporary file first so it's never half written """
 
-    def do_list(self, args):
-        state.log_view.print_message(CommandHandler.LIST_COMMAND_LIST_TITLE)
-        for command in CommandHandler.get_commands():
-            state.log_view.print_message(' ' * CommandHandler.LIST_COMMAND_LIST_INDENT + command)
+        if self.directory is None:
+            return
 
-    def do_help(self, args):
-        if len(args) == 0:
-            state.log_view.print_message(CommandHandler.DEFAULT_HELP_MESSAGE)
-        else:
-            help_message = (CommandHandler.HELP_MESSAGE_PREFIX + args[0]).upper()
-            state.log_view.print_message(getattr(CommandHandler, help_message))
+        path = self.get_path(device)
+        try:
+            with open(path + ContactSnapshot.TEMP_SUFFIX, 'wb') as snapshot_file:
+                snapshot_file.write(ContactSnapshot.encode(device, contacts_version, contact_views))
+            os.replace(path + ContactSnapshot.TEMP_SUFFIX, path)
+        except OSError as e:
+            state.log_view.print_message(ContactSnapshot.ERROR_SAVE.format(error=e))
 
-    @staticmethod
-    def get_commands():
-        pattern = r'^' + re.escape(CommandHandler.COMMAND_METHOD_PREFIX) + r'.*'
-        return [method.split('_')[1]
-                for method in dir(CommandHandler)
-                if callable(getattr(CommandHandler, method)) and re.search(pattern, method, re.IGNORECASE)]
+    def load(self, path):
+        """ decode the snapshot at path straight out of the page cache, None if it can't be read """
 
+        try:
+            with open(path, 'rb') as snapshot_file:
+                with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return ContactSnapshot.decode(mapped)
+        except (OSError, ValueError):
+            # missing, unreadable or empty, which mmap won't map
+            return None
 
-class JSONHelper:
-    """ Util methods for converting between JSON strings and objects used here """
+    def load_all(self):
+        """ every device's snapshot that can be read, [(device, contacts version, records)] """
 
-    REMOTE_TIME_FORMAT_STR = '%I:%M:%S %p'
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
 
-    JSON_MESSAGE_TIME_KEY = 'time'
-    JSON_MESSAGE_BODY_KEY = 'body'
-    JSON_MESSAGE_ID_KEY = 'relatedContactId'
-    JSON_MESSAGE_TYPE_KEY = 'smsMessageType'
+        snapshots = []
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.startswith(ContactSnapshot.FILE_PREFIX) and file_name.endswith(ContactSnapshot.FILE_SUFFIX):
+                snapshot = self.load(os.path.join(self.directory, file_name))
+                if snapshot is not None:
+                    snapshots.append(snapshot)
 
-    JSON_CONTACT_ID_KEY = 'id'
-    JSON_CONTACT_DISPLAY_KEY = 'displayName'
-    JSON_CONTACT_PHONE_KEY = 'phoneNumber'
+        return snapshots
 
-    @staticmethod
-    def format_time(remote_time):
-        """ java client formats time all weird out, fix it here """
-        return datetime.datetime\
-            .strptime(remote_time, JSONHelper.REMOTE_TIME_FORMAT_STR)\
-            .strftime(ViewMessage.TIME_FORMAT_STR)
+    def start_restore(self):
+        """ read the snapshots now, their contact views are made on the event loop """
 
-    @staticmethod
-    def view_message_to_json(view_message):
-        view_message_dict = {
-                JSONHelper.JSON_MESSAGE_TIME_KEY: view_message.message_time,
-                JSONHelper.JSON_MESSAGE_BODY_KEY: view_message.body,
-                JSONHelper.JSON_MESSAGE_ID_KEY: view_message.related_view_id,
-                JSONHelper.JSON_MESSAGE_TYPE_KEY: view_message.message_type
-        }
+        snapshots = self.load_all()
+        if snapshots:
+            self.restore_task = state.event_loop.create_task(self.restore(snapshots))
 
-        return json.dumps(view_message_dict)
+    async def wait_restored(self):
+        """ connections wait for this before telling the server which contacts we hold """
 
-    @staticmethod
-    def json_to_view_message(json_view_message):
-        view_message_dict = json.loads(json_view_message)
+        if self.restore_task is not None:
+            await self.restore_task
 
-        if view_message_dict[JSONHelper.JSON_MESSAGE_TYPE_KEY] == ViewMessage.TYPE_OUTGOING:
-            display_name = ViewMessage.USER_DISPLAY_NAME
-        else:
-            if view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY] in state.contact_views:
-                display_name = state.contact_views[view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]].display_name
-            else:
-                display_name = view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY]
+    async def restore(self, snapshots):
+        """
+            make the contact views of loaded snapshots a batch at a time like
+            ConnectionHandler.ingest_contacts does, usable as soon as they're made
+        """
 
-        return ViewMessage(
-                JSONHelper.format_time(view_message_dict[JSONHelper.JSON_MESSAGE_TIME_KEY]),
-                view_message_dict[JSONHelper.JSON_MESSAGE_BODY_KEY],
-                view_message_dict[JSONHelper.JSON_MESSAGE_ID_KEY],
-                display_name,
-                view_message_dict[JSONHelper.JSON_MESSAGE_TYPE_KEY]
-        )
+        history_end_id = state.message_store.get_last_message_id()
+        count = 0
 
-    @staticmethod
-    def dict_to_contact_view(contact_view_dict):
-        """ Convert a contact view dict to a ContactView object """
+        for device, contacts_version, records in snapshots:
+            # what the hello says we hold is this list
+            if contacts_version is not None:
+                state.message_store.set_sync_value(
+                    ConnectionHandler.tag_id(device, JSONHelper.JSON_CONTACTS_VERSION_KEY), contacts_version
+                )
+            self.restored[device] = {view_id for view_id, _, _ in records}
 
-        return ContactView(
-                contact_view_dict[JSONHelper.JSON_CONTACT_ID_KEY],
-                contact_view_dict[JSONHelper.JSON_CONTACT_DISPLAY_KEY],
-                contact_view_dict[JSONHelper.JSON_CONTACT_PHONE_KEY],
-                []
-        )
+            for i in range(0, len(records), ConnectionHandler.CONTACT_BATCH_SIZE):
+                batch = [ContactView(view_id, name, address, [], device, history_end_id)
+                         for view_id, name, address in records[i:i + ConnectionHandler.CONTACT_BATCH_SIZE]]
 
-    @staticmethod
-    def setup_contact_views(json_contacts):
-        """ Convert json to a contact view list """
+                for contact_view in batch:
+                    state.contact_views[contact_view.view_id] = contact_view
+                state.contact_index.add_contacts(batch)
 
-        contact_view_dicts = json.loads(json_contacts)
+                count += len(batch)
+                await asyncio.sleep(0)
 
-        for view_id, contact_view_dict in contact_view_dicts.items():
-            state.contact_views[view_id] = JSONHelper.dict_to_contact_view(contact_view_dict)
+        if count:
+            state.log_view.print_message(ContactSnapshot.MESSAGE_RESTORED.format(count=count))
+            state.render_scheduler.mark_dirty()
 
 
 class ThemeFormatter:
@@ -722,6 +3589,7 @@ class ThemeFormatter:
         'log': 'dark blue, default',
         'incoming': 'dark blue, default',
         'outgoing': 'dark green, default',
+        'delivery': 'dark gray, default',
         'titlebar': 'black, dark blue',
         'divider': 'black, dark blue'
     }
@@ -759,8 +3627,28 @@ class ConfigHandler:
     CONFIG_FILE_NAME = 'smscli.conf'
     CONFIG_FILE_PATH = os.path.join(CONFIG_DIR_PATH, CONFIG_FILE_NAME)
 
+    DAEMON_SOCKET_NAME = 'daemon.sock'
+    DAEMON_SOCKET_PATH = os.path.join(CONFIG_DIR_PATH, DAEMON_SOCKET_NAME)
+
     SECTION_THEME = 'Theme'
     SECTION_ALIASES = 'Aliases'
+    SECTION_SETTINGS = 'Settings'
+
+    DEFAULT_SETTINGS = {
+        'max_fps': str(RenderScheduler.DEFAULT_MAX_FPS),
+        'codec': JSONHelper.CODEC_AUTO,       # auto, json, fastjson or msgpack
+        'heartbeat_interval': '5',            # seconds of quiet before pinging the server
+        'liveness_timeout': '15',             # seconds of silence before the connection is considered dead
+        'reconnect': 'yes',                   # reconnect on its own when the connection drops
+        'notifications': Notifier.AUTO,       # auto, libnotify, bell or none
+        'notification_window': '1',           # seconds of messages gathered into one notification
+        'notification_interval': '5',         # seconds between notifications at most
+        'metrics_file': '',                   # write prometheus metrics here, empty for off
+        'metrics_interval': '15',             # seconds between writes of metrics_file
+        'log_scrollback': '1000',             # log lines kept in memory, older ones go to log.txt, 0 for no limit
+        'view_scrollback': '0',               # messages a conversation keeps in memory, 0 for no limit
+        'highlight': ''                       # comma separated words that count as mentions in the status bar
+    }
 
     ERROR_CREATE = 'Failed to create config file'
     ERROR_PARSE = 'Failed to parse config file'
@@ -796,6 +3684,7 @@ class ConfigHandler:
         """ set the default values for the config object that will be written to initial config file """
 
         self.config[ConfigHandler.SECTION_THEME] = ThemeFormatter.DEFAULT_THEME
+        self.config[ConfigHandler.SECTION_SETTINGS] = ConfigHandler.DEFAULT_SETTINGS
 
         # other default settings will go here
 
@@ -803,6 +3692,26 @@ class ConfigHandler:
         if self.config.has_section(ConfigHandler.SECTION_THEME):
             return ThemeFormatter.dict_to_list_format(self.config[ConfigHandler.SECTION_THEME])
 
+    def get_setting(self, name, convert=str):
+        """ get a setting, falling back to its default if missing or invalid """
+
+        default = convert(ConfigHandler.DEFAULT_SETTINGS[name])
+        try:
+            value = convert(self.config.get(ConfigHandler.SECTION_SETTINGS, name,
+                                            fallback=ConfigHandler.DEFAULT_SETTINGS[name]))
+        except ValueError:
+            return default
+
+        return value
+
+    @staticmethod
+    def to_bool(value):
+        """ for get_setting, yes/no, on/off, true/false or 1/0 """
+
+        if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+            raise ValueError(value)
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
     def get_alias(self, alias_name):
         if self.config.has_section(ConfigHandler.SECTION_ALIASES):
             conn_set = [self.config[ConfigHandler.SECTION_ALIASES][name]
@@ -825,12 +3734,24 @@ class InputHandler:
     VIEW_KEY = 'meta'       # meta/alt key used as prefix for view commands
     VIEW_COMBO_LEN = 2      # view commands will always be a combo of 2
     VIEW_CLOSE_KEY = 'c'    # key to close the current view
+    VIEW_NEXT_KEY = 'n'     # next view, past the ones the number keys reach
+    VIEW_PREV_KEY = 'p'
+    VIEW_UNREAD_KEY = 'u'   # next view with unread messages
 
     HISTORY_BACK_KEY = 'up'
     HISTORY_FORWARD_KEY = 'down'
 
     INPUT_LINE_KEY = 'enter'
 
+    SCROLL_UP_KEY = 'page up'
+    SCROLL_DOWN_KEY = 'page down'
+    SCROLL_LINES = 20
+
+    COMPLETE_KEY = 'tab'
+    COMPLETE_COMMAND = CommandHandler.COMMAND_PREFIX + CommandHandler.MSG_COMMAND_NAME + ' '
+    COMPLETE_MAX_SHOWN = 10      # at most this many candidates printed to the log view
+    COMPLETE_MORE = '  ... {count} more'
+
     def __init__(self):
         self.history = []       # maintain a history list
         self.current_hist_item = len(self.history)
@@ -848,16 +3769,56 @@ class InputHandler:
                         self.history.append(user_input)
 
                     state.main_window.clear_input()
-                elif state.connection_handler.connected and (state.main_window.shown_views[state.main_window.current_view] != state.log_view):
-                    state.connection_handler.send_message(user_input)
+                else:
+                    # goes out through the phone the contact is from, if it's connected
+                    connection_handler = state.connections.for_view(state.main_window.current_view)
+                    if connection_handler is not None:
+                        connection_handler.send_message(user_input)
 
             # reset current history item
             self.current_hist_item = len(self.history)
         elif key == InputHandler.HISTORY_BACK_KEY or key == InputHandler.HISTORY_FORWARD_KEY:
             self.handle_history(key)
+        elif key == InputHandler.COMPLETE_KEY:
+            self.handle_completion()
+        elif key == InputHandler.SCROLL_UP_KEY:
+            state.main_window.shown_views[state.main_window.current_view].scroll(-InputHandler.SCROLL_LINES)
+        elif key == InputHandler.SCROLL_DOWN_KEY:
+            state.main_window.shown_views[state.main_window.current_view].scroll(InputHandler.SCROLL_LINES)
         elif InputHandler.VIEW_KEY in key:
             self.handle_view_command(key)
 
+    def handle_completion(self):
+        """
+            complete the contact name after /msg, as far as all candidates agree,
+            if there is more than one they are listed in the log view
+        """
+
+        user_input = state.main_window.get_input()
+        if not user_input.startswith(InputHandler.COMPLETE_COMMAND):
+            return
+
+        prefix = user_input[len(InputHandler.COMPLETE_COMMAND):]
+        names = state.contact_index.complete(prefix)
+        if not names:
+            return
+
+        if len(names) == 1:
+            completed = names[0]
+        else:
+            common = os.path.commonprefix([name.casefold() for name in names])
+            completed = names[0][:len(common)] if len(common) > len(prefix) else prefix
+
+            for name in names[:InputHandler.COMPLETE_MAX_SHOWN]:
+                state.log_view.print_message(name)
+            if len(names) > InputHandler.COMPLETE_MAX_SHOWN:
+                state.log_view.print_message(InputHandler.COMPLETE_MORE.format(
+                    count=len(names) - InputHandler.COMPLETE_MAX_SHOWN
+                ))
+
+        state.main_window.input_line.set_edit_text(InputHandler.COMPLETE_COMMAND + completed)
+        state.main_window.input_line.set_edit_pos(len(state.main_window.input_line.get_edit_text()))
+
     def handle_view_command(self, key):
         if len(key.split()) == InputHandler.VIEW_COMBO_LEN:
             action = key.split()[1]
@@ -866,6 +3827,12 @@ class InputHandler:
 
         if action == InputHandler.VIEW_CLOSE_KEY:
             state.main_window.close_view(state.main_window.current_view)
+        elif action == InputHandler.VIEW_NEXT_KEY:
+            state.main_window.next_view(1)
+        elif action == InputHandler.VIEW_PREV_KEY:
+            state.main_window.next_view(-1)
+        elif action == InputHandler.VIEW_UNREAD_KEY:
+            state.main_window.next_view(1, unread_only=True)
         else:   # switch view
             self.handle_view_switch(action)
 
@@ -878,10 +3845,9 @@ class InputHandler:
             return
 
         if view_index < len(state.main_window.shown_views):
-            # convert view_index to a view_id, this works cause shown_views is a OrderedDict
-            view_id = list(state.main_window.shown_views.keys())[view_index]
+            view_id = state.main_window.shown_views.at(view_index).view_id
 
-            if state.main_window.shown_views[view_id] != state.main_window.current_view:
+            if view_id != state.main_window.current_view:
                 state.main_window.switch_view(view_id)
 
     def handle_history(self, hist_dir):
@@ -913,50 +3879,153 @@ class State(object):
 
     def __init__(self):
         self.contact_views = {} # Main data structure, all contacts and conversations are stored here
+        self.contact_index = ContactIndex()
+        self.search_view = None     # made on the first /search
 
         self.command_handler = CommandHandler()
-        self.connection_handler = ConnectionHandler()
+        self.connections = ConnectionManager()
         self.config_handler = ConfigHandler()
+        self.render_scheduler = RenderScheduler()
+        self.message_store = MessageStore()
+        self.contact_snapshot = ContactSnapshot()
+        self.notifier = Notifier()
+        self.metrics = Metrics()
 
 
 
 def shutdown():
-    if state.connection_handler.connected:
-        # stop read looper thread
-        state.connection_handler.connected = False
-        state.connection_handler.socket.shutdown(socket.SHUT_RDWR)
-        state.connection_handler.socket.close()
+    # read loop tasks stop once the connections are closed, any reconnecting is called off
+    state.connections.disconnect()
+    state.notifier.stop()
 
     raise urwid.ExitMainLoop
 
 
+def run_daemon(server_args):
+    """ smscli-client --daemon <ip> <port>|<alias> """
+
+    from smscliclient.daemon import Daemon      # it imports this module
+
+    if not state.config_handler.init_config():
+        print('Failed to load config file')
+        exit(-1)
+
+    server = state.config_handler.get_alias(server_args[0]) if len(server_args) == 1 else server_args
+    if server is None or len(server) != 2 or not ConnectionHandler.is_valid_port(server[1]):
+        print(CommandHandler.HELP_DAEMON)
+        exit(-1)
+
+    daemon = Daemon(
+        server[0], int(server[1]),
+        os.path.join(ConfigHandler.CONFIG_DIR_PATH, Daemon.STORE_FILE_NAME),
+        state.config_handler.get_setting('heartbeat_interval', float),
+        state.config_handler.get_setting('liveness_timeout', float)
+    )
+
+    try:
+        asyncio.run(daemon.run(ConfigHandler.DAEMON_SOCKET_PATH))
+    except KeyboardInterrupt:
+        pass
+
+
 def main():
-    # TODO: implement command line options like config file specification and help
     # TODO: get rid of logview object, can do it through main_window
 
     global state
 
+    parser = argparse.ArgumentParser(prog='smscli-client')
+    parser.add_argument('--daemon', nargs='+', metavar='SERVER',
+                        help='run headless, holding the connection to <ip> <port> (or an alias) for frontends to attach to')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='time each step of startup up to the first frame, print it and exit')
+    args = parser.parse_args()
+
+    if args.daemon:
+        run_daemon(args.daemon)
+        return
+
+    profiler = StartupProfiler()
+
     state.log_view = LogView([])         
     state.log_view.print_message('Welcome to smscli')
 
     state.main_window = MainWindow(state.log_view)
+    profiler.mark('MainWindow')
 
     if not state.config_handler.init_config():
         print('Failed to load config file')
         exit(-1)
+    profiler.mark('ConfigHandler.init_config')
+
+    store_error = state.message_store.open(os.path.join(ConfigHandler.CONFIG_DIR_PATH, MessageStore.STORE_FILE_NAME))
+    if store_error is not None:
+        state.log_view.print_message(store_error)
+    profiler.mark('MessageStore.open')
 
     theme = state.config_handler.get_theme()
     if theme is None:
         print('Config file syntax is invalid')
         exit(-1)
 
+    max_fps = state.config_handler.get_setting('max_fps', float)
+    if max_fps > 0:
+        state.render_scheduler.set_max_fps(max_fps)
+
+    state.log_view.set_scrollback(state.config_handler.get_setting('log_scrollback', int),
+                                  os.path.join(ConfigHandler.CONFIG_DIR_PATH, ScrollbackFile.FILE_NAME))
+    ContactView.max_messages = state.config_handler.get_setting('view_scrollback', int)
+    state.main_window.highlight_words = [word.strip().casefold()
+                                         for word in state.config_handler.get_setting('highlight').split(',') if word.strip()]
+
+    state.notifier.configure(
+        state.config_handler.get_setting('notifications'),
+        state.config_handler.get_setting('notification_window', float),
+        state.config_handler.get_setting('notification_interval', float)
+    )
+
     signal.signal(signal.SIGINT, InputHandler.ctrl_c_quit)
 
+    # all socket io and rendering share this one loop, so widgets are only ever touched from here
+    state.event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(state.event_loop)
+
+    # contacts from the last connection, so /msg works before the phone has answered
+    state.contact_snapshot.set_directory(ConfigHandler.CONFIG_DIR_PATH)
+    state.contact_snapshot.start_restore()
+    profiler.mark('ContactSnapshot.load')
+
+    metrics_file = state.config_handler.get_setting('metrics_file')
+    if metrics_file:
+        state.event_loop.create_task(state.metrics.export_loop(
+            os.path.expanduser(metrics_file),
+            state.config_handler.get_setting('metrics_interval', float)
+        ))
+
+    # a warm daemon already has everything, attach to it rather than wait for a /connect
+    if os.path.exists(ConfigHandler.DAEMON_SOCKET_PATH) and not args.profile_startup:
+        state.connections.start_connection(ConfigHandler.DAEMON_SOCKET_PATH, None)
+
+    def first_frame(loop, user_data):
+        # alarms only fire once the loop is up and has drawn the screen
+        profiler.mark('first frame')
+        raise urwid.ExitMainLoop()
+
     try:
-        state.main_loop = urwid.MainLoop(state.main_window, theme, handle_mouse=False, unhandled_input=InputHandler().handle_input)
+        state.main_loop = MainLoop(state.main_window, theme, handle_mouse=False,
+                                   unhandled_input=InputHandler().handle_input,
+                                   event_loop=urwid.AsyncioEventLoop(loop=state.event_loop))
+        profiler.mark('MainLoop')
+
+        if args.profile_startup:
+            state.main_loop.set_alarm_in(0, first_frame)
         state.main_loop.run()
+
+        if args.profile_startup:
+            print(profiler.report())
     except urwid.AttrSpecError as e:
         print('Failed to initialize window: ' + str(e))
+    finally:
+        state.message_store.close()
 
 
 state = State()